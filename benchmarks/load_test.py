@@ -0,0 +1,430 @@
+"""
+game_backend HTTP 接口压测
+
+在临时目录中启动 game_backend（以及替身远程服务器），按给定比例混合发送
+save_player_data、get_player_data、get_queue_status 和 UE 的 transfer_player_data 请求，
+对每个 数据量 × 并发数 组合分别启动一个全新的服务器并预先写入数据，
+输出每个组合的吞吐量和 p50/p95/p99 延迟（JSON）。
+
+随机种子固定、每个组合都从相同的数据开始，同一台机器上不同提交的结果可以直接比较：
+    python benchmarks/load_test.py --output before.json
+    （切换到新提交）
+    python benchmarks/load_test.py --output after.json --compare before.json
+
+常用参数：
+    --sizes 0,1000,10000         预先写入的玩家数
+    --concurrency 1,8,32         并发客户端数
+    --mix save=40,player_data=20,queue_status=35,transfer=5
+    --requests 2000              每个组合计入统计的请求数
+    --mode asgi --storage journal --workers 1
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+from generate_data import generate_player_data
+import stand_in_remote
+
+# 复制到临时目录中运行的文件，BASE_DIR 指向临时目录，不会改动项目中的数据
+SERVER_FILES = ("game_backend.py", "game.html", "future.jpg")
+
+# 临时目录中的启动脚本：导入 game_backend 后按环境变量覆盖配置，多进程时每个 worker 导入时同样生效
+LAUNCHER = '''\
+import json
+import os
+import sys
+
+import game_backend
+from common.service_log import LEVELS
+
+for name, value in json.loads(os.environ["BENCH_OVERRIDES"]).items():
+    setattr(game_backend, name, value)
+game_backend.service_log.logger.setLevel(LEVELS[os.environ["BENCH_LOG_LEVEL"]])
+asgi_app = game_backend.asgi_app
+
+if __name__ == "__main__":
+    mode, port, workers = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+    game_backend.run_server(
+        game_backend.app,
+        asgi_app=asgi_app,
+        asgi_app_path="bench_server:asgi_app",
+        host="127.0.0.1",
+        port=port,
+        mode=mode,
+        workers=workers,
+        startup=game_backend.initialize_backend,
+        log=game_backend.log_message
+    )
+'''
+
+OPERATIONS = ("save", "player_data", "queue_status", "transfer")
+DEFAULT_MIX = "save=40,player_data=20,queue_status=35,transfer=5"
+
+
+def parse_int_list(text):
+    return [int(item) for item in text.split(',') if item.strip()]
+
+
+def parse_mix(text):
+    """解析 "save=40,queue_status=60" 形式的请求比例"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"未知的请求类型: {name}（可选 {', '.join(OPERATIONS)}）")
+        mix[name] = float(weight)
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("请求比例不能全部为0")
+    return mix
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    """最近秩法分位数"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies_ms):
+    values = sorted(latencies_ms)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50), 3),
+        "p95_ms": round(percentile(values, 0.95), 3),
+        "p99_ms": round(percentile(values, 0.99), 3),
+        "mean_ms": round(sum(values) / len(values), 3),
+        "max_ms": round(values[-1], 3)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ---------- 被测服务器 ----------
+
+class BackendUnderTest:
+    """在临时目录中运行的 game_backend"""
+
+    def __init__(self, args, remote_url, dataset_size, seed):
+        self.args = args
+        self.remote_url = remote_url
+        self.dataset_size = dataset_size
+        self.seed = seed
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workspace = None
+        self.process = None
+
+    def prepare(self):
+        self.workspace = tempfile.mkdtemp(prefix="game_backend_bench_")
+        for filename in SERVER_FILES:
+            shutil.copy2(os.path.join(PROJECT_DIR, filename), self.workspace)
+        shutil.copytree(os.path.join(PROJECT_DIR, "common"), os.path.join(self.workspace, "common"),
+                        ignore=shutil.ignore_patterns("__pycache__"))
+        with open(os.path.join(self.workspace, "bench_server.py"), 'w', encoding='utf-8') as f:
+            f.write(LAUNCHER)
+
+        # 每个组合从相同的数据开始
+        random.seed(self.seed)
+        data = generate_player_data(self.dataset_size)
+        with open(os.path.join(self.workspace, "data.json"), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+        output_dir = os.path.join(self.workspace, "output")
+        os.makedirs(output_dir)
+        rng = random.Random(self.seed)
+        for i in range(self.args.output_files):
+            with open(os.path.join(output_dir, f"bench_output_{i}.csv"), 'w', encoding='utf-8') as f:
+                for row in range(self.args.output_file_rows):
+                    f.write(f"{row},{rng.random():.6f},{rng.random():.6f},{rng.random():.6f}\n")
+        return output_dir
+
+    def start(self):
+        output_dir = self.prepare()
+        overrides = {
+            "REMOTE_SERVER": self.remote_url,
+            "OUTPUT_PATH": output_dir,
+            "STORAGE_MODE": self.args.storage,
+            "SERVER_THREADS": self.args.server_threads
+        }
+        env = dict(os.environ, BENCH_OVERRIDES=json.dumps(overrides), BENCH_LOG_LEVEL=self.args.server_log_level)
+        self.log_file = open(os.path.join(self.workspace, "server.log"), 'w', encoding='utf-8')
+        self.process = subprocess.Popen(
+            [sys.executable, "bench_server.py", self.args.mode, str(self.port), str(self.args.workers)],
+            cwd=self.workspace, env=env, stdout=self.log_file, stderr=subprocess.STDOUT
+        )
+        deadline = time.monotonic() + self.args.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if requests.get(f"{self.url}/health", timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop(keep_workspace=True)
+        raise RuntimeError(f"game_backend 未能启动，日志见 {os.path.join(self.workspace, 'server.log')}")
+
+    def stop(self, keep_workspace=False):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.process is not None:
+            self.log_file.close()
+        if self.workspace and not keep_workspace and not self.args.keep_workspace:
+            shutil.rmtree(self.workspace, ignore_errors=True)
+
+
+# ---------- 负载 ----------
+
+def build_player(rng):
+    return {
+        "Player Name": f"bench_{rng.randrange(1_000_000)}",
+        "Player Money": rng.randint(8000000, 100000000),
+        "Player Age": 18,
+        "Player Body State": 80,
+        "Player Mind State": 100,
+        "PlayerIQ": 120,
+        "Player El": 120,
+        "R": rng.randint(0, 255),
+        "G": rng.randint(0, 255),
+        "B": rng.randint(0, 255),
+        "Additional Info": "压测生成的玩家数据"
+    }
+
+
+def send_request(session, base_url, operation, rng, args):
+    if operation == "save":
+        return session.post(f"{base_url}/save_player_data", json=build_player(rng), timeout=args.timeout)
+    if operation == "player_data":
+        params = {"limit": args.page_size} if args.page_size else None
+        return session.get(f"{base_url}/get_player_data", params=params, timeout=args.timeout)
+    if operation == "queue_status":
+        return session.get(f"{base_url}/get_queue_status", timeout=args.timeout)
+    return session.post(f"{base_url}/transfer_player_data",
+                        json={"CanGenerateAgantNum": args.ue_samples}, timeout=args.timeout)
+
+
+def run_load(base_url, concurrency, mix, args, seed):
+    """
+    用 concurrency 个线程发送 warmup + requests 个请求，只统计 warmup 之后的请求
+
+    Returns:
+        (每个请求的 (类型, 毫秒, 是否成功) 列表, 计入统计部分的耗时秒数)
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    total = args.warmup + args.requests
+    lock = threading.Lock()
+    issued = [0]
+    results = []
+    measure_start = [None]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        try:
+            while True:
+                with lock:
+                    if issued[0] >= total:
+                        return
+                    issued[0] += 1
+                    measured = issued[0] > args.warmup
+                    if measured and measure_start[0] is None:
+                        measure_start[0] = time.perf_counter()
+                operation = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = send_request(session, base_url, operation, rng, args)
+                    response.content
+                    ok = response.status_code < 400
+                except requests.RequestException:
+                    ok = False
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if measured:
+                    with lock:
+                        results.append((operation, elapsed_ms, ok))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - (measure_start[0] or time.perf_counter())
+    return results, elapsed
+
+
+def measure_cell(args, remote_url, dataset_size, concurrency, mix):
+    seed = args.seed + dataset_size * 7919 + concurrency
+    backend = BackendUnderTest(args, remote_url, dataset_size, seed)
+    backend.start()
+    try:
+        results, elapsed = run_load(backend.url, concurrency, mix, args, seed)
+    finally:
+        backend.stop()
+
+    by_operation = {}
+    for operation, elapsed_ms, ok in results:
+        by_operation.setdefault(operation, []).append((elapsed_ms, ok))
+    errors = sum(1 for _, _, ok in results if not ok)
+    return {
+        "dataset_size": dataset_size,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed > 0 else None,
+        "latency": summarize([elapsed_ms for _, elapsed_ms, _ in results]),
+        "operations": {
+            operation: dict(summarize([elapsed_ms for elapsed_ms, _ in samples]),
+                            errors=sum(1 for _, ok in samples if not ok))
+            for operation, samples in sorted(by_operation.items())
+        }
+    }
+
+
+# ---------- 对比 ----------
+
+def compare(current, baseline_path):
+    """按 数据量 × 并发数 对比两次结果的吞吐量和 p95"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(cell['dataset_size'], cell['concurrency']): cell for cell in baseline.get('results', [])}
+    print(f"\n与 {baseline_path}（提交 {baseline.get('git_commit')}）对比：", file=sys.stderr)
+    print(f"{'玩家数':>8} {'并发':>5} {'吞吐量 rps':>22} {'p95 ms':>24}", file=sys.stderr)
+    for cell in current['results']:
+        old = previous.get((cell['dataset_size'], cell['concurrency']))
+        if old is None:
+            continue
+
+        def change(new_value, old_value):
+            if not old_value or new_value is None:
+                return f"{new_value}"
+            return f"{old_value} → {new_value} ({(new_value - old_value) / old_value:+.1%})"
+
+        print(f"{cell['dataset_size']:>8} {cell['concurrency']:>5} "
+              f"{change(cell['throughput_rps'], old['throughput_rps']):>22} "
+              f"{change(cell['latency'].get('p95_ms'), old['latency'].get('p95_ms')):>24}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="game_backend HTTP 接口压测")
+    parser.add_argument('--sizes', type=parse_int_list, default=[0, 1000, 10000], help="预先写入的玩家数，逗号分隔")
+    parser.add_argument('--concurrency', type=parse_int_list, default=[1, 8, 32], help="并发客户端数，逗号分隔")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"请求比例（{', '.join(OPERATIONS)}），默认 {DEFAULT_MIX}")
+    parser.add_argument('--requests', type=int, default=2000, help="每个组合计入统计的请求数")
+    parser.add_argument('--warmup', type=int, default=100, help="每个组合开始时不计入统计的请求数")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子")
+    parser.add_argument('--mode', default="asgi", help="game_backend 的服务方式（asgi / threaded）")
+    parser.add_argument('--storage', default="journal", help="STORAGE_MODE（journal / sqlite / json / shared）")
+    parser.add_argument('--workers', type=int, default=1, help="asgi 模式的进程数（需要 --storage shared）")
+    parser.add_argument('--server-threads', type=int, default=64, help="asgi 模式执行 Flask 路由的线程数")
+    parser.add_argument('--server-log-level', default="warning", help="game_backend 的日志级别")
+    parser.add_argument('--page-size', type=int, default=0, help="get_player_data 的 limit，0 表示取全部")
+    parser.add_argument('--ue-samples', type=int, default=5, help="每个 UE 请求的 CanGenerateAgantNum")
+    parser.add_argument('--output-files', type=int, default=5, help="放入输出目录、由云同步上传的 csv 文件数")
+    parser.add_argument('--output-file-rows', type=int, default=2000, help="每个 csv 文件的行数")
+    parser.add_argument('--remote-latency', type=float, default=0.0, help="替身远程服务器每个请求的额外延迟（毫秒）")
+    parser.add_argument('--timeout', type=float, default=60.0, help="单个请求的超时（秒）")
+    parser.add_argument('--startup-timeout', type=float, default=60.0, help="等待服务器启动的最长时间（秒）")
+    parser.add_argument('--keep-workspace', action='store_true', help="保留临时目录（含服务器日志）")
+    parser.add_argument('--output', help="结果 JSON 的保存路径，默认输出到标准输出")
+    parser.add_argument('--compare', help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args()
+
+    remote_port = free_port()
+    remote = multiprocessing.Process(target=stand_in_remote.serve, args=(remote_port, args.remote_latency / 1000),
+                                     daemon=True)
+    remote.start()
+    remote_url = f"http://127.0.0.1:{remote_port}"
+
+    report = {
+        "benchmark": "game_backend_load",
+        "started_at": datetime.now().isoformat(timespec='seconds'),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "mix": args.mix,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "mode": args.mode,
+            "storage": args.storage,
+            "workers": args.workers,
+            "server_threads": args.server_threads,
+            "page_size": args.page_size,
+            "ue_samples": args.ue_samples,
+            "output_files": args.output_files,
+            "remote_latency_ms": args.remote_latency
+        },
+        "results": []
+    }
+    try:
+        for dataset_size in args.sizes:
+            for concurrency in args.concurrency:
+                print(f"压测: {dataset_size} 个玩家, {concurrency} 个并发 ...", file=sys.stderr)
+                cell = measure_cell(args, remote_url, dataset_size, concurrency, args.mix)
+                print(f"  {cell['throughput_rps']} rps, p50 {cell['latency'].get('p50_ms')} ms, "
+                      f"p95 {cell['latency'].get('p95_ms')} ms, p99 {cell['latency'].get('p99_ms')} ms, "
+                      f"{cell['errors']} 个错误", file=sys.stderr)
+                report['results'].append(cell)
+    finally:
+        remote.terminate()
+        remote.join()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"结果已保存到 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
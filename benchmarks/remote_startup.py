@@ -0,0 +1,158 @@
+"""
+remote_backend 启动耗时
+
+    1. 用 python -X importtime 导入 remote_backend，统计总导入时间和最慢的模块
+    2. 同样统计可视化依赖（visualization.data_visualizer）的导入时间，即不在启动路径上的部分
+    3. 多次启动 cloud/remote_backend.py，测量从启动进程到 /health 返回 200 的时间
+
+每次都在新的临时目录中运行（remote_backend 的数据文件和日志写在当前目录），结果输出为 JSON：
+    python benchmarks/remote_startup.py --runs 5 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARK_DIR)
+CLOUD_DIR = os.path.join(PROJECT_DIR, "cloud")
+sys.path.insert(0, BENCHMARK_DIR)
+from load_test import free_port, git_commit
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 的输出
+
+    Returns:
+        [(模块名, 嵌套层级, 自身微秒, 累计微秒), ...]，按导入完成的顺序
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # import time:       self [us] | cumulative | imported package（名称前每层缩进两个空格）
+        self_part, cumulative_part, name = line.split('|', 2)
+        self_us = int(self_part.split(':', 1)[1])
+        level = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), level, self_us, int(cumulative_part)))
+    return entries
+
+
+def import_profile(module, workspace, top):
+    """在子进程中导入 module，返回总耗时和最慢的模块"""
+    code = f"import sys; sys.path.insert(0, {CLOUD_DIR!r}); sys.path.insert(0, {PROJECT_DIR!r}); import {module}"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=workspace,
+                            capture_output=True, text=True, timeout=300)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败: {result.stderr[-2000:]}")
+    entries = parse_importtime(result.stderr)
+    total = next((cumulative for name, level, _, cumulative in reversed(entries) if name == module and level == 0), None)
+    # 最外层（由 remote_backend 直接或间接首次导入的顶层包）按累计时间排序
+    top_level = sorted((entry for entry in entries if entry[1] <= 1 and entry[0] != module),
+                       key=lambda entry: entry[3], reverse=True)
+    return {
+        "module": module,
+        "total_ms": round(total / 1000, 1) if total is not None else None,
+        "modules_imported": len(entries),
+        "slowest": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+            for name, _, self_us, cumulative in top_level[:top]
+        ]
+    }
+
+
+def time_to_healthy(workspace, timeout, preload):
+    """启动 remote_backend，返回 /health 首次返回 200 的秒数"""
+    port = free_port()
+    command = [sys.executable, os.path.join(CLOUD_DIR, "remote_backend.py"), "--port", str(port)]
+    if not preload:
+        command.append("--no-preload")
+    with open(os.path.join(workspace, "server.log"), 'w', encoding='utf-8') as log_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=workspace, stdout=log_file, stderr=subprocess.STDOUT)
+        try:
+            while time.perf_counter() - start < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"remote_backend 启动失败，日志见 {os.path.join(workspace, 'server.log')}")
+                try:
+                    if requests.get(f"http://127.0.0.1:{port}/health", timeout=0.5).status_code == 200:
+                        return time.perf_counter() - start
+                except requests.RequestException:
+                    pass
+                time.sleep(0.01)
+            raise RuntimeError(f"remote_backend 在 {timeout} 秒内没有响应 /health")
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="remote_backend 启动耗时")
+    parser.add_argument('--runs', type=int, default=5, help="测量 /health 就绪时间的启动次数")
+    parser.add_argument('--top', type=int, default=15, help="列出导入最慢的模块数")
+    parser.add_argument('--no-preload', action='store_true', help="启动时不在后台预先加载可视化依赖")
+    parser.add_argument('--timeout', type=float, default=60.0, help="等待 /health 的最长时间（秒）")
+    parser.add_argument('--output', help="结果 JSON 的保存路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp(prefix="remote_startup_bench_")
+    try:
+        print("统计导入时间 ...", file=sys.stderr)
+        startup_imports = import_profile("remote_backend", workspace, args.top)
+        visualization_imports = import_profile("visualization.data_visualizer", workspace, args.top)
+
+        ready_times = []
+        for i in range(args.runs):
+            run_dir = os.path.join(workspace, f"run_{i}")
+            os.makedirs(run_dir)
+            ready_times.append(time_to_healthy(run_dir, args.timeout, not args.no_preload))
+            print(f"  第 {i + 1} 次启动: {ready_times[-1] * 1000:.0f} ms 后 /health 就绪", file=sys.stderr)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    report = {
+        "benchmark": "remote_backend_startup",
+        "started_at": datetime.now().isoformat(timespec='seconds'),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "preload_visualization": not args.no_preload,
+        "time_to_healthy_ms": {
+            "runs": len(ready_times),
+            "median": round(statistics.median(ready_times) * 1000, 1),
+            "min": round(min(ready_times) * 1000, 1),
+            "max": round(max(ready_times) * 1000, 1)
+        },
+        "import_remote_backend": startup_imports,
+        "import_visualization": visualization_imports
+    }
+    print(f"remote_backend 导入 {startup_imports['total_ms']} ms，"
+          f"可视化依赖导入 {visualization_imports['total_ms']} ms（不在启动路径上），"
+          f"/health 就绪中位数 {report['time_to_healthy_ms']['median']} ms", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"结果已保存到 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
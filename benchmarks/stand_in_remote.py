@@ -0,0 +1,108 @@
+"""
+压测用的替身远程服务器
+
+实现 game_backend 云同步用到的 remote_backend 接口（/health、/sync_state、/missing_files、
+/upload_file、/receive_transferred_data），只记录同步水位和收到的文件哈希，不保存数据、不生成可视化，
+这样压测结果只反映 game_backend 本身。可以用 latency 模拟网络往返时间。
+
+单独运行：
+    python benchmarks/stand_in_remote.py --port 18002 --latency 20
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+from flask import Flask, request, jsonify
+
+# 共享的 common 包位于项目根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.transfer import read_json_body, open_decoded_stream, supported_encodings, CHUNK_SIZE
+
+
+def create_app(latency=0.0):
+    """
+    Args:
+        latency: 每个请求额外等待的秒数
+    """
+    app = Flask(__name__)
+    lock = threading.Lock()
+    state = {"sync_id": None, "sequence": None, "received_hashes": set(), "requests": 0}
+
+    @app.before_request
+    def simulate_latency():
+        with lock:
+            state['requests'] += 1
+        if latency:
+            time.sleep(latency)
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({"status": "healthy", "transfer_encodings": supported_encodings()})
+
+    @app.route('/sync_state', methods=['GET'])
+    def sync_state():
+        with lock:
+            return jsonify({"sync_id": state['sync_id'], "sequence": state['sequence']})
+
+    @app.route('/missing_files', methods=['POST'])
+    def missing_files():
+        files = (request.get_json() or {}).get('files', [])
+        with lock:
+            missing = [entry['sha256'] for entry in files if entry.get('sha256') not in state['received_hashes']]
+        return jsonify({"missing": missing})
+
+    @app.route('/upload_file', methods=['POST'])
+    def upload_file():
+        # 读完请求体（按 Content-Encoding 解压），与真实服务器的读取开销相当
+        stream = open_decoded_stream(request.stream, request.headers.get('Content-Encoding'))
+        while stream.read(CHUNK_SIZE):
+            pass
+        with lock:
+            state['received_hashes'].add(request.args.get('sha256'))
+        return jsonify({"status": "success"})
+
+    @app.route('/receive_transferred_data', methods=['POST'])
+    def receive_transferred_data():
+        payload = read_json_body(request) or {}
+        with lock:
+            if payload.get('transfer_type') == 'delta':
+                if (payload.get('sync_id'), payload.get('base_sequence')) != (state['sync_id'], state['sequence']):
+                    return jsonify({"status": "error", "message": "sync watermark mismatch"}), 409
+                metadata = payload.get('metadata', {})
+            else:
+                metadata = payload.get('data', {}).get('metadata', {})
+            state['sync_id'] = metadata.get('sync_id')
+            state['sequence'] = metadata.get('sequence')
+        return jsonify({"status": "success"})
+
+    @app.route('/stand_in_stats', methods=['GET'])
+    def stand_in_stats():
+        with lock:
+            return jsonify({
+                "requests": state['requests'],
+                "files": len(state['received_hashes']),
+                "sequence": state['sequence']
+            })
+
+    return app
+
+
+def serve(port, latency=0.0, host='127.0.0.1'):
+    """启动替身服务器并一直运行（供 multiprocessing 调用）"""
+    import logging
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server(host, port, create_app(latency), threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="压测用的替身远程服务器")
+    parser.add_argument('--port', type=int, default=10002, help="监听端口")
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求额外等待的毫秒数")
+    args = parser.parse_args()
+    print(f"替身远程服务器监听端口 {args.port}，延迟 {args.latency} 毫秒")
+    serve(args.port, args.latency / 1000, host='0.0.0.0')
@@ -1,174 +1,340 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
-import json
+import argparse
+import atexit
+import hashlib
 import os
-from threading import Lock
-from visualization.data_visualizer import DataVisualizer
+import shutil
+import sys
+import threading
+
+# 共享的 common 包位于项目根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.storage import open_storage
+from common.sync import SyncConflict, sync_state, decode_changes
+from common.file_manifest import FileManifest, file_sha256
+from common.resumable import (
+    UploadSessions, UploadSessionNotFound, OffsetMismatch, ChecksumMismatch, CHUNK_SHA256_HEADER
+)
+from common.service_log import ServiceLogger
+from common.metrics import install_flask_metrics
+from common.job_queue import JobQueue, JobWorkers, JobNotFound
+from common.transfer import (
+    safe_filename, receive_stream, read_json_body, open_decoded_stream, decompress_bytes,
+    supported_encodings, UnsupportedEncoding
+)
+from visualization.render_pool import RenderPool
+from visualization.render_manifest import RenderManifest
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
+install_flask_metrics(app, "remote_backend")  # 请求指标，GET /metrics
 
 # 数据文件路径
 DATA_FILE = "data.json"
-# 线程锁，确保多线程安全写入
-file_lock = Lock()
+# SQLite数据库路径，与wechat_bot.py共用
+DATABASE_FILE = "data.db"
+# 存储后端：sqlite（按编号索引，支持多进程并发）或 json（单个data.json文件）
+STORAGE_BACKEND = "sqlite"  # 可以改为 "json"
+# 存储实例，启动时由 initialize_storage() 打开
+storage = None
+# 接收文件的保存目录
+SAVE_DIR = "received_files"
+# 已接收文件的内容哈希清单，主服务器据此只上传缺少的文件
+FILE_MANIFEST = "received_files_manifest.json"
+# 文件清单实例，启动时由 initialize_storage() 打开
+file_manifest = None
+# 分块上传未完成的数据保存在这里，断线后可以续传
+UPLOAD_SESSIONS_DIR = "upload_sessions"
+# 分块上传会话，启动时由 initialize_storage() 创建
+upload_sessions = None
+# 生成可视化图表的任务队列（SQLite），进程重启后未完成的任务继续处理
+RENDER_JOBS_DATABASE = "render_jobs.db"
+RENDER_JOB_KIND = "visualization"
+# 同时处理的任务数（后台线程）；每个任务的各个图表在进程池中并行生成
+RENDER_WORKERS = 2
+# 生成图表的工作进程数，None 表示CPU核心数
+RENDER_PROCESSES = None
+# 每个工作进程的内存上限（MB），0 表示不限制（Windows 上不生效）
+RENDER_MEMORY_LIMIT_MB = 2048
+# 每个CSV文件生成的图表（与 DataVisualizer.CHARTS 一致）
+VISUALIZATION_CHARTS = ("money", "body_state", "mind_state", "movement")
+# DataVisualizer 的输出目录（项目根目录下的 output_videos，与当前目录无关）
+VISUALIZATION_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output_videos")
+# 任务队列和后台线程，启动时由 initialize_storage() 和 start_render_workers() 创建
+render_jobs = None
+render_workers = None
+# 每个CSV文件的图表生成记录（与任务队列在同一个数据库中），启动时由 initialize_storage() 打开
+render_manifest = None
+# 生成图表的进程池，第一次生成时创建
+render_pool = None
+render_pool_lock = threading.Lock()
 
 # 配置标准输出流的编码为UTF-8
-import sys
 import io
 
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
 
+# 服务器监听端口
+SERVER_PORT = 10002
+
+# 可视化依赖（pandas、matplotlib、cv2）导入需要数秒，不在启动时导入，服务器可以立即响应；
+# 为 True 时在服务器开始监听后由后台线程预先导入，首次生成图表时不必等待
+VISUALIZATION_PRELOAD = True
+
 # 不生成图表的文件名列表（不含后缀）
 SKIP_VISUALIZATION_LIST = [
     "Dr. Paul Farmer", "DrSmith", "ElonMusk", "Huhu", 
     "Lin", "Rubin Carter", "Ya", "Zoe"
 ]
 
-# 记录请求日志的辅助方法
-def log_message(message, client_ip=None):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    client_info = f"[Client: {client_ip}]" if client_ip else ""
-    print(f"{timestamp} {client_info} {message}")
-
-
-def initialize_data_file():
-    """初始化数据文件，如果文件不存在则创建"""
-    if not os.path.exists(DATA_FILE):
-        initial_data = {
-            "received_data": {
-                "players": [],
-                "metadata": {
-                    "description": "从主服务器接收的玩家数据存储",
-                    "version": "1.0",
-                    "total_players": 0,
-                    "current_number": 0,
-                    "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "color_info": "R、G、B字段表示玩家的颜色属性，取值范围为0-255整数"
-                }
-            },
-            "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "source_server": "unknown"
-        }
-
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(initial_data, f, ensure_ascii=False, indent=4)
-
-
-def read_data_file():
-    """读取数据文件"""
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError as e:
-        log_message(f"JSON解析错误: {str(e)}")
-        # 如果文件损坏，返回初始化结构
-        return {
-            "received_data": {
-                "players": [],
-                "metadata": {
-                    "total_players": 0,
-                    "current_number": 0,
-                    "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
+# 日志级别（debug / info / warning / error）和日志文件目录（每行一个JSON，按大小轮转）
+LOG_LEVEL = "info"
+LOG_DIR = "logs"
+# 高频日志的抽样比例：每 N 条只记录 1 条
+LOG_SAMPLE_RATES = {"health": 20, "player_data": 10}
+service_log = ServiceLogger("remote_backend", LOG_DIR, level=LOG_LEVEL, sample_rates=LOG_SAMPLE_RATES)
+atexit.register(service_log.close)
+
+
+# 记录请求日志的辅助方法：只放入队列，由后台线程写控制台和日志文件，请求线程不等待输出
+def log_message(message, client_ip=None, level="info", sample=None, **fields):
+    service_log.log(message, level=level, sample=sample, client=client_ip, **fields)
+
+
+def build_initial_data():
+    """构建空的数据文件结构"""
+    return {
+        "received_data": {
+            "players": [],
+            "metadata": {
+                "description": "从主服务器接收的玩家数据存储",
+                "version": "1.0",
+                "total_players": 0,
+                "current_number": 0,
+                "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "color_info": "R、G、B字段表示玩家的颜色属性，取值范围为0-255整数"
             }
-        }
+        },
+        "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "source_server": "unknown"
+    }
 
 
-def generate_visualizations_for_files(save_dir):
-    """为新保存的CSV文件生成可视化图表"""
-    try:
-        # 获取所有CSV文件
-        csv_files = [f for f in os.listdir(save_dir) if f.endswith('.csv')]
-        
-        generated_count = 0
-        skipped_count = 0
-        
-        for csv_file in csv_files:
-            # 检查文件名（不含后缀）是否在跳过列表中
-            filename_without_ext = os.path.splitext(csv_file)[0]
-            # 去除可能的编号前缀（如 "0_@zlj.csv" -> "@zlj"）
-            if '_@' in filename_without_ext:
-                actual_name = filename_without_ext.split('_@', 1)[1]
-            elif '_' in filename_without_ext:
-                actual_name = filename_without_ext.split('_', 1)[1]
-            else:
-                actual_name = filename_without_ext
-            
-            if actual_name in SKIP_VISUALIZATION_LIST:
-                log_message(f"跳过为 {csv_file} 生成可视化图表（在跳过列表中）")
+def initialize_storage():
+    """打开存储和文件清单，如果数据不存在则创建"""
+    global storage, file_manifest, upload_sessions, render_jobs, render_manifest
+    storage = open_storage(STORAGE_BACKEND, DATA_FILE, DATABASE_FILE, build_initial_data, log=log_message)
+    file_manifest = FileManifest(FILE_MANIFEST, log=log_message)
+    upload_sessions = UploadSessions(UPLOAD_SESSIONS_DIR, SAVE_DIR)
+    render_jobs = JobQueue(RENDER_JOBS_DATABASE, log=log_message)
+    render_manifest = RenderManifest(RENDER_JOBS_DATABASE)
+
+
+def load_visualizer():
+    """导入并返回 DataVisualizer 类（首次调用时加载 pandas、matplotlib、cv2）"""
+    from visualization.data_visualizer import DataVisualizer
+    return DataVisualizer
+
+
+def preload_visualizer():
+    """在后台线程中预先导入可视化依赖"""
+    def preload():
+        start = datetime.now()
+        try:
+            load_visualizer()
+            log_message(f"可视化依赖已加载，用时 {(datetime.now() - start).total_seconds():.2f} 秒")
+        except Exception as e:
+            log_message(f"预先加载可视化依赖失败，将在生成图表时重试: {str(e)}", level="warning")
+
+    threading.Thread(target=preload, name="visualizer-preload", daemon=True).start()
+
+
+def visualization_name(csv_file):
+    """去除文件名的后缀和可能的编号前缀（如 "0_@zlj.csv" -> "@zlj"），用于匹配跳过列表"""
+    filename_without_ext = os.path.splitext(csv_file)[0]
+    if '_@' in filename_without_ext:
+        return filename_without_ext.split('_@', 1)[1]
+    if '_' in filename_without_ext:
+        return filename_without_ext.split('_', 1)[1]
+    return filename_without_ext
+
+
+def expected_visualization_files(csv_file):
+    """DataVisualizer 为一个CSV文件生成的图表路径 {图表: 路径}"""
+    csv_basename = os.path.basename(csv_file)
+    return {
+        chart: os.path.join(VISUALIZATION_OUTPUT_DIR, f"{csv_basename}_{chart}_video.gif")
+        for chart in VISUALIZATION_CHARTS
+    }
+
+
+def get_render_pool():
+    """返回生成图表的进程池，第一次调用时启动工作进程"""
+    global render_pool
+    with render_pool_lock:
+        if render_pool is None:
+            render_pool = RenderPool(workers=RENDER_PROCESSES, memory_limit_mb=RENDER_MEMORY_LIMIT_MB)
+            log_message(f"已启动 {render_pool.workers} 个生成图表的工作进程")
+        return render_pool
+
+
+def enqueue_visualizations(filenames):
+    """
+    为新保存的CSV文件提交生成图表的任务，不等待生成
+
+    只查询这些文件在 render_manifest 中的记录：内容没有变化并且已经生成或正在生成的文件不再提交
+
+    Returns:
+        ([{"job_id": ..., "filename": ...}, ...], 跳过的文件数)
+    """
+    jobs = []
+    skipped_count = 0
+    for csv_file in filenames:
+        if not csv_file.endswith('.csv'):
+            continue
+        if visualization_name(csv_file) in SKIP_VISUALIZATION_LIST:
+            log_message(f"跳过为 {csv_file} 生成可视化图表（在跳过列表中）")
+            skipped_count += 1
+            continue
+
+        try:
+            stat = os.stat(os.path.join(SAVE_DIR, csv_file))
+        except OSError as e:
+            log_message(f"无法读取 {csv_file}，不生成可视化图表: {str(e)}", level="warning")
+            continue
+        # 接收时已经记录的内容哈希：重新发送的相同内容修改时间会变，但不需要重新生成
+        received = file_manifest.get(csv_file)
+        sha256 = received['sha256'] if received is not None else None
+        entry = render_manifest.get(csv_file)
+
+        if RenderManifest.matches(entry, stat, sha256):
+            if entry['status'] == 'done':
+                log_message(f"跳过为 {csv_file} 生成可视化图表（内容没有变化，图表已生成）")
                 skipped_count += 1
                 continue
-            
-            csv_file_path = os.path.join(save_dir, csv_file)
-            
-            # 检查可视化文件是否已经存在
-            csv_basename = os.path.basename(csv_file)
-            output_dir = "output_videos"  # DataVisualizer使用的输出目录
-            
-            # 定义需要检查的可视化文件列表
-            expected_files = [
-                os.path.join(output_dir, f"{csv_basename}_money_video.gif"),
-                os.path.join(output_dir, f"{csv_basename}_body_state_video.gif"),
-                os.path.join(output_dir, f"{csv_basename}_mind_state_video.gif"),
-                os.path.join(output_dir, f"{csv_basename}_movement_video.gif")
-            ]
-            
-            # 检查是否所有可视化文件都已存在
-            all_files_exist = all(os.path.exists(file_path) for file_path in expected_files)
-            
-            if all_files_exist:
-                log_message(f"跳过为 {csv_file} 生成可视化图表（所有可视化文件已存在）")
-                skipped_count += 1
+            if entry['status'] == 'queued' and job_pending(entry['job_id']):
+                jobs.append({"job_id": entry['job_id'], "filename": csv_file})
                 continue
-            
-            log_message(f"开始为 {csv_file} 生成可视化图表...")
-            
-            try:
-                visualizer = DataVisualizer(csv_file_path)
-                
-                # 生成三个数值变化的GIF
-                value_gifs = visualizer.create_all_value_gifs(duration=8)
-                gif_count = len([gif for gif in value_gifs if gif is not None])
-                
-                # 生成行动轨迹视频
-                movement_video = visualizer.create_movement_video(duration=8)
-                if movement_video:
-                    gif_count += 1
-                
-                log_message(f"成功为 {csv_file} 生成 {gif_count} 个可视化文件")
-                generated_count += 1
-                
-            except Exception as e:
-                log_message(f"为 {csv_file} 生成可视化图表时出错: {str(e)}")
-        
-        log_message(f"可视化生成完成：成功 {generated_count} 个，跳过 {skipped_count} 个")
-        return generated_count, skipped_count
-        
-    except Exception as e:
-        log_message(f"生成可视化图表时发生错误: {str(e)}")
-        return 0, 0
-def write_data_file(data):
-    """写入数据文件"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+            outputs = entry['outputs']
+        elif entry is None and all(os.path.exists(path) for path in expected_visualization_files(csv_file).values()):
+            # 没有记录之前生成的图表：记录一次，以后不再检查输出文件
+            render_manifest.update(csv_file, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256,
+                                   status='done', outputs=expected_visualization_files(csv_file))
+            log_message(f"跳过为 {csv_file} 生成可视化图表（所有可视化文件已存在）")
+            skipped_count += 1
+            continue
+        else:
+            # 新文件或内容已改变：重新生成全部图表
+            outputs = {}
+
+        job = render_jobs.enqueue(RENDER_JOB_KIND, {"filename": csv_file}, key=csv_file)
+        render_manifest.update(csv_file, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256,
+                               status='queued', job_id=job['id'], outputs=outputs, error=None)
+        jobs.append({"job_id": job['id'], "filename": csv_file})
+    if jobs:
+        log_message(f"已提交 {len(jobs)} 个生成可视化图表的任务")
+    return jobs, skipped_count
+
+
+def job_pending(job_id):
+    """任务是否还在排队或处理中"""
+    try:
+        return render_jobs.get(job_id)['status'] in ('queued', 'running')
+    except JobNotFound:
+        return False
+
+
+def render_visualizations(payload):
+    """后台任务：为一个CSV文件生成可视化图表，返回生成的文件列表"""
+    csv_file = payload['filename']
+    csv_file_path = os.path.join(SAVE_DIR, csv_file)
+    if not os.path.exists(csv_file_path):
+        raise FileNotFoundError(f"文件不存在: {csv_file}")
+    stat = os.stat(csv_file_path)
+    sha256 = file_manifest.hash_file(csv_file_path)
+
+    # 记录对应当前内容时，之前已经生成的图表（例如上次部分失败）不再生成
+    entry = render_manifest.get(csv_file)
+    outputs = dict(entry['outputs']) if RenderManifest.matches(entry, stat, sha256) else {}
+    charts = [chart for chart in VISUALIZATION_CHARTS if chart not in outputs]
+    if not charts:
+        render_manifest.update(csv_file, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256,
+                               status='done', outputs=outputs, error=None)
+        log_message(f"跳过为 {csv_file} 生成可视化图表（所有可视化文件已生成）")
+        return {"skipped": True, "files": list(outputs.values())}
+
+    log_message(f"开始为 {csv_file} 生成 {len(charts)} 个可视化图表...")
+    errors = {}
+
+    def record_chart(_, chart, path, error):
+        # 每个图表完成后立即记录，进程在任务中途退出时已经生成的图表不再重新生成
+        if error is None:
+            outputs[chart] = path
+            render_manifest.update(csv_file, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256,
+                                   outputs=outputs)
+        else:
+            errors[chart] = error
+
+    get_render_pool().render({csv_file_path: charts}, duration=8, on_result=record_chart)
+    if errors:
+        render_manifest.update(csv_file, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256,
+                               status='failed', outputs=outputs, error=str(errors))
+        raise RuntimeError(f"为 {csv_file} 生成可视化图表时出错: {errors}")
+    render_manifest.update(csv_file, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256,
+                           status='done', outputs=outputs, error=None)
+    log_message(f"成功为 {csv_file} 生成 {len(charts)} 个可视化文件")
+    return {"skipped": False, "files": list(outputs.values())}
+
+
+def rendered_result(job):
+    """
+    上次退出时正在处理的任务：render_manifest 中已经记录了当前文件的全部图表时返回任务结果，否则返回None
+    """
+    csv_file = job['payload']['filename']
+    csv_file_path = os.path.join(SAVE_DIR, csv_file)
+    entry = render_manifest.get(csv_file)
+    if entry is None or not os.path.exists(csv_file_path):
+        return None
+    stat = os.stat(csv_file_path)
+    if not RenderManifest.matches(entry, stat, file_manifest.hash_file(csv_file_path)):
+        return None
+    if any(chart not in entry['outputs'] for chart in VISUALIZATION_CHARTS):
+        return None
+    render_manifest.update(csv_file, status='done', error=None)
+    return {"skipped": True, "files": list(entry['outputs'].values())}
+
+
+def start_render_workers():
+    """重新排队上次退出时未完成的任务（图表已经全部生成的直接完成），并启动后台生成图表的线程"""
+    global render_workers
+    requeued, failed, done = render_jobs.recover(completed=rendered_result)
+    if requeued or failed or done:
+        log_message(f"恢复未完成的可视化任务：重新排队 {requeued} 个，放弃 {failed} 个，已生成 {done} 个")
+    render_workers = JobWorkers(render_jobs, {RENDER_JOB_KIND: render_visualizations}, workers=RENDER_WORKERS,
+                                name="render", log=log_message)
+    render_workers.start()
 
 
 @app.route('/receive_transferred_data', methods=['POST'])
 def receive_transferred_data():
-    """接收从主服务器传输过来的完整数据并完全替换本地数据"""
+    """接收从主服务器传输过来的数据：完整复制时替换本地数据，增量同步时只应用新的修改"""
     try:
         log_message(f"接收到来自主服务器的数据传输请求", request.remote_addr)
         
-        # 获取主服务器发送的数据
-        transferred_data = request.get_json()
+        # 获取主服务器发送的数据，压缩过的请求体会被透明解压
+        try:
+            transferred_data = read_json_body(request)
+        except UnsupportedEncoding as e:
+            log_message(f"不支持的请求体编码: {str(e)}", request.remote_addr, level="warning")
+            return jsonify({"status": "error", "message": f"Unsupported Content-Encoding: {str(e)}"}), 415
         
         # 验证数据格式
         if not transferred_data or 'status' not in transferred_data or transferred_data['status'] != 'success':
-            log_message(f"无效的数据传输请求: {transferred_data}", request.remote_addr)
+            log_message(f"无效的数据传输请求: {transferred_data}", request.remote_addr, level="warning")
             return jsonify({
                 "status": "error",
                 "message": "Invalid data transfer request"
@@ -177,24 +343,34 @@ def receive_transferred_data():
         # 检查是否为完整复制模式
         transfer_type = transferred_data.get('transfer_type', 'partial')
         
-        # 获取实际的数据
-        received_data = transferred_data['data']
+        # 获取实际的数据（增量同步时没有完整数据）
+        received_data = transferred_data.get('data')
         
         # 检查是否有文件数据需要保存
         files_received = transferred_data.get('files', [])
-        saved_files_count = 0
+        # 已经通过 /upload_file 流式上传的文件
+        saved_filenames = [name for name in transferred_data.get('uploaded_files', []) if safe_filename(name)]
         
         # 创建保存文件的目录
-        save_dir = "received_files"
+        save_dir = SAVE_DIR
         os.makedirs(save_dir, exist_ok=True)
         
+        # 因为内容已有而没有上传的文件：文件名不同时在本地复制，并和上传的文件一样生成图表
+        copied_filenames, unresolved_files = copy_present_files(transferred_data.get('present_files', []), request.remote_addr)
+        saved_filenames.extend(copied_filenames)
+        saved_files_count = len(saved_filenames)
+        
         # 处理并保存每个文件
         for file_info in files_received:
             try:
-                filename = file_info.get('filename')
+                filename = safe_filename(file_info.get('filename', ''))
                 file_content_hex = file_info.get('content')
                 
-                if filename and file_content_hex:
+                if filename is None:
+                    # 与 /upload_file 一样只接受不含路径的 csv / txt 文件名，避免写到保存目录之外
+                    log_message(f"跳过不合法的文件名: {file_info.get('filename')!r}", request.remote_addr, level="warning")
+                    continue
+                if file_content_hex:
                     # 将十六进制字符串转换回二进制数据
                     file_content = bytes.fromhex(file_content_hex)
                     
@@ -202,118 +378,329 @@ def receive_transferred_data():
                     file_path = os.path.join(save_dir, filename)
                     with open(file_path, 'wb') as f:
                         f.write(file_content)
+                    file_manifest.record(file_path, hashlib.sha256(file_content).hexdigest(), received_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
                     
+                    saved_filenames.append(filename)
                     saved_files_count += 1
-                    log_message(f"成功保存文件: {filename}", request.remote_addr)
+                    log_message(f"成功保存文件: {filename}", request.remote_addr, level="debug")
             except Exception as e:
-                log_message(f"保存文件时发生错误: {str(e)}", request.remote_addr)
+                log_message(f"保存文件时发生错误: {str(e)}", request.remote_addr, level="error")
         
-        # 为新保存的CSV文件生成可视化图表
-        viz_generated, viz_skipped = 0, 0
+        # 为新保存的CSV文件提交生成可视化图表的任务，由后台线程生成，请求不等待
+        viz_jobs, viz_skipped = [], 0
         if saved_files_count > 0:
-            log_message(f"开始为新保存的文件生成可视化图表...", request.remote_addr)
-            viz_generated, viz_skipped = generate_visualizations_for_files(save_dir)
+            file_manifest.save()
+            viz_jobs, viz_skipped = enqueue_visualizations(saved_filenames)
         
-        with file_lock:
-            if transfer_type == 'full_copy':
-                # 完整复制模式：完全替换本地数据
-                log_message(f"完整复制模式：完全替换本地数据", request.remote_addr)
-                
-                # 完全使用主服务器的数据结构
-                new_data = {
-                    "received_data": received_data,
-                    "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "source_server": request.remote_addr,
-                    "transfer_type": "full_copy"
-                }
-                
-                # 写入新数据
-                write_data_file(new_data)
-                
-                total_players = len(received_data['players'])
-                log_message(f"完整数据复制成功，总玩家数: {total_players}", request.remote_addr)
-                
-                return jsonify({
-                    "status": "success",
-                    "message": "Complete data copy received and saved successfully",
-                    "total_players": total_players,
-                    "saved_files_count": saved_files_count,
-                    "visualizations_generated": viz_generated,
-                    "visualizations_skipped": viz_skipped,
-                    "transfer_type": "full_copy"
-                })
-            else:
-                # 原有的增量模式（保持兼容性）
-                log_message(f"增量模式：合并数据到本地", request.remote_addr)
-                
-                # 读取本地现有数据
-                local_data = read_data_file()
-                
-                # 合并接收到的玩家数据到本地数据中
-                existing_players = local_data['received_data']['players']
-                new_players = received_data['players']
-                
-                # 为新玩家分配新的编号
-                current_max_number = max((player.get('Number', -1) for player in existing_players), default=-1)
-                for i, player in enumerate(new_players):
-                    player['Number'] = current_max_number + i + 1
-                    player['Timestamp'] = datetime.now().isoformat()
-                    existing_players.append(player)
-                
-                # 更新元数据
-                metadata = local_data['received_data']['metadata']
-                metadata['total_players'] = len(existing_players)
-                metadata['last_updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # 更新接收时间和来源服务器
-                local_data['received_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                local_data['source_server'] = request.remote_addr
-                
-                # 写回更新后的数据
-                write_data_file(local_data)
-                
-                log_message(f"成功接收并保存 {len(new_players)} 个玩家数据，本地总玩家数: {len(local_data['received_data']['players'])}", request.remote_addr)
+        if transfer_type == 'delta':
+            # 增量模式：校验水位后在一次写入中应用水位之后的修改
+            changes = decode_changes(transferred_data.get('changes', []))
+            base_sequence = transferred_data.get('base_sequence')
+            log_message(f"增量同步模式：基准序号 {base_sequence}，{len(changes)} 条修改", request.remote_addr)
+
+            header = {
+                "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "source_server": request.remote_addr,
+                "transfer_type": "delta"
+            }
+            try:
+                storage.apply_changes(
+                    changes, transferred_data['metadata'], header,
+                    expected=(transferred_data.get('sync_id'), base_sequence)
+                )
+            except SyncConflict as e:
+                log_message(f"增量同步被拒绝，需要完整复制: {str(e)}", request.remote_addr, level="warning")
                 return jsonify({
-                    "status": "success",
-                    "message": "Player data and files received and saved successfully",
-                    "received_count": len(new_players),
-                    "total_count": len(local_data['received_data']['players']),
+                    "status": "error",
+                    "message": f"Sync conflict: {str(e)}",
+                    "sync_state": e.state,
                     "saved_files_count": saved_files_count,
-                    "visualizations_generated": viz_generated,
-                    "visualizations_skipped": viz_skipped,
-                    "transfer_type": "incremental"
-                })
+                    "unresolved_files": unresolved_files
+                }), 409
+
+            log_message(f"增量同步成功，当前序号: {transferred_data['metadata'].get('sequence')}", request.remote_addr)
+            return jsonify({
+                "status": "success",
+                "message": "Delta changes applied successfully",
+                "applied_changes": len(changes),
+                "total_players": transferred_data.get('total_players'),
+                "sync_state": sync_state(transferred_data['metadata']),
+                "saved_files_count": saved_files_count,
+                "unresolved_files": unresolved_files,
+                "render_jobs": viz_jobs,
+                "visualizations_skipped": viz_skipped,
+                "transfer_type": "delta"
+            })
+        elif transfer_type == 'full_copy':
+            # 完整复制模式：完全替换本地数据
+            log_message(f"完整复制模式：完全替换本地数据", request.remote_addr)
+            
+            # 完全使用主服务器的数据结构
+            new_data = {
+                "received_data": received_data,
+                "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "source_server": request.remote_addr,
+                "transfer_type": "full_copy"
+            }
+            
+            # 写入新数据
+            storage.write_document(new_data)
+            
+            total_players = len(received_data['players'])
+            log_message(f"完整数据复制成功，总玩家数: {total_players}", request.remote_addr)
+            
+            return jsonify({
+                "status": "success",
+                "message": "Complete data copy received and saved successfully",
+                "total_players": total_players,
+                "saved_files_count": saved_files_count,
+                "unresolved_files": unresolved_files,
+                "render_jobs": viz_jobs,
+                "visualizations_skipped": viz_skipped,
+                "transfer_type": "full_copy"
+            })
+        else:
+            # 原有的增量模式（保持兼容性）
+            log_message(f"增量模式：合并数据到本地", request.remote_addr)
+            
+            # 合并接收到的玩家数据到本地数据中，在存储内为新玩家分配新的编号
+            new_players = received_data['players']
+            total_count = storage.merge_players(new_players, request.remote_addr)
+            
+            log_message(f"成功接收并保存 {len(new_players)} 个玩家数据，本地总玩家数: {total_count}", request.remote_addr)
+            return jsonify({
+                "status": "success",
+                "message": "Player data and files received and saved successfully",
+                "received_count": len(new_players),
+                "total_count": total_count,
+                "saved_files_count": saved_files_count,
+                "unresolved_files": unresolved_files,
+                "render_jobs": viz_jobs,
+                "visualizations_skipped": viz_skipped,
+                "transfer_type": "incremental"
+            })
     
     except Exception as e:
         import traceback
-        log_message(f"接收数据时发生错误: {str(e)}", request.remote_addr)
-        log_message(f"错误详情: {traceback.format_exc()}")
+        log_message(f"接收数据时发生错误: {str(e)}", request.remote_addr, level="error")
+        log_message(f"错误详情: {traceback.format_exc()}", level="error")
         return jsonify({
             "status": "error",
             "message": f"An error occurred: {str(e)}"
         }), 500
 
 
+@app.route('/upload_file', methods=['POST'])
+def upload_file():
+    """以二进制流接收单个文件，按块直接写入received_files目录"""
+    filename = safe_filename(request.args.get('filename', ''))
+    if filename is None:
+        log_message(f"拒绝非法文件名: {request.args.get('filename')}", request.remote_addr, level="warning")
+        return jsonify({"status": "error", "message": "Invalid filename"}), 400
+
+    encoding = request.headers.get('Content-Encoding')
+    try:
+        stream = open_decoded_stream(request.stream, encoding)
+    except UnsupportedEncoding:
+        log_message(f"不支持的文件编码: {encoding}", request.remote_addr, level="warning")
+        return jsonify({"status": "error", "message": f"Unsupported Content-Encoding: {encoding}"}), 415
+
+    # 压缩上传时用发送端提供的原始大小校验，否则用Content-Length校验
+    expected_size = request.args.get('size', type=int)
+    if expected_size is None and not encoding:
+        expected_size = request.content_length
+
+    # 发送端提供内容哈希时边接收边校验，校验通过后记入文件清单
+    expected_sha256 = request.args.get('sha256')
+
+    try:
+        os.makedirs(SAVE_DIR, exist_ok=True)
+        file_path = os.path.join(SAVE_DIR, filename)
+        size = receive_stream(stream, file_path, expected_size, expected_sha256=expected_sha256)
+        sha256 = expected_sha256 or file_sha256(file_path)
+        file_manifest.record(file_path, sha256, received_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        file_manifest.save()
+        log_message(f"成功保存文件: {filename} ({size} 字节)", request.remote_addr)
+        return jsonify({"status": "success", "filename": filename, "size": size, "sha256": sha256})
+    except Exception as e:
+        log_message(f"保存文件 {filename} 时发生错误: {str(e)}", request.remote_addr, level="error")
+        return jsonify({"status": "error", "message": f"An error occurred: {str(e)}"}), 500
+
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """创建（或找回）分块上传会话，返回服务器已收到的位置"""
+    try:
+        request_data = request.get_json() or {}
+        state = upload_sessions.open(request_data.get('filename', ''), request_data.get('size'), request_data.get('sha256'))
+        log_message(f"分块上传会话 {state['upload_id']}: {state['filename']}，已收到 {state['offset']}/{state['size']} 字节", request.remote_addr)
+        return jsonify({"status": "success", **state})
+    except ValueError as e:
+        log_message(f"创建分块上传会话失败: {str(e)}", request.remote_addr, level="warning")
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        log_message(f"创建分块上传会话时发生错误: {str(e)}", request.remote_addr, level="error")
+        return jsonify({"status": "error", "message": f"An error occurred: {str(e)}"}), 500
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """查询分块上传会话已收到的位置"""
+    try:
+        return jsonify({"status": "success", **upload_sessions.status(upload_id)})
+    except UploadSessionNotFound:
+        return jsonify({"status": "error", "message": "Upload session not found"}), 404
+
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """接收一个块；offset 必须等于服务器已收到的位置，全部收到后校验并保存文件"""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({"status": "error", "message": "Missing offset"}), 400
+    try:
+        data = decompress_bytes(request.get_data(), request.headers.get('Content-Encoding'))
+    except UnsupportedEncoding as e:
+        return jsonify({"status": "error", "message": f"Unsupported Content-Encoding: {str(e)}"}), 415
+
+    try:
+        state = upload_sessions.write_chunk(upload_id, offset, data, request.headers.get(CHUNK_SHA256_HEADER))
+    except UploadSessionNotFound:
+        return jsonify({"status": "error", "message": "Upload session not found"}), 404
+    except OffsetMismatch as e:
+        return jsonify({"status": "error", "message": str(e), "offset": e.offset}), 409
+    except (ChecksumMismatch, ValueError) as e:
+        log_message(f"分块上传 {upload_id} 的块被拒绝: {str(e)}", request.remote_addr, level="warning")
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        log_message(f"写入分块上传 {upload_id} 时发生错误: {str(e)}", request.remote_addr, level="error")
+        return jsonify({"status": "error", "message": f"An error occurred: {str(e)}"}), 500
+
+    if state['complete']:
+        file_path = os.path.join(SAVE_DIR, state['filename'])
+        file_manifest.record(file_path, state['sha256'], received_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        file_manifest.save()
+        log_message(f"分块上传完成，成功保存文件: {state['filename']} ({state['size']} 字节)", request.remote_addr)
+    return jsonify({"status": "success", **state})
+
+
+@app.route('/missing_files', methods=['POST'])
+def missing_files():
+    """
+    根据内容哈希返回本地缺少的文件
+
+    请求体: {"files": [{"filename": ..., "sha256": ...}, ...]}
+    同名或其他文件内容相同时视为已有，不需要重新上传；只查询不修改文件，
+    内容相同但文件名不同的文件在 /receive_transferred_data 收到 present_files 时才复制
+    """
+    try:
+        request_data = request.get_json() or {}
+        missing = []
+        for item in request_data.get('files', []):
+            filename = safe_filename(item.get('filename', ''))
+            sha256 = item.get('sha256')
+            if filename is None or not sha256:
+                continue
+            if find_file_content(filename, sha256) is None:
+                missing.append(sha256)
+        file_manifest.save()
+        log_message(f"文件清单查询: {len(request_data.get('files', []))} 个文件，缺少 {len(missing)} 个", request.remote_addr)
+        return jsonify({"status": "success", "missing": missing})
+    except Exception as e:
+        log_message(f"查询文件清单时发生错误: {str(e)}", request.remote_addr, level="error")
+        return jsonify({"status": "error", "message": f"An error occurred: {str(e)}"}), 500
+
+
+def find_file_content(filename, sha256):
+    """
+    在received_files中查找内容为 sha256 的文件，只查询不修改
+
+    Returns:
+        同名文件内容相同时返回 filename，其他文件内容相同时返回那个文件名，都没有时返回None
+    """
+    file_path = os.path.join(SAVE_DIR, filename)
+    if os.path.exists(file_path) and file_manifest.hash_file(file_path) == sha256:
+        return filename
+    for other_name in file_manifest.filenames_with_hash(sha256):
+        other_path = os.path.join(SAVE_DIR, other_name)
+        if os.path.exists(other_path) and file_manifest.hash_file(other_path) == sha256:
+            return other_name
+    return None
+
+
+def copy_present_files(present_files, client_ip=None):
+    """
+    主服务器因 /missing_files 判断为已有而没有上传的文件：内容相同但文件名不同时在本地复制一份
+
+    Returns:
+        (新复制的文件名列表, 找不到相同内容、需要主服务器重新上传的文件名列表)
+    """
+    copied, unresolved = [], []
+    for item in present_files:
+        filename = safe_filename(item.get('filename', ''))
+        sha256 = item.get('sha256')
+        if filename is None or not sha256:
+            continue
+        source_name = find_file_content(filename, sha256)
+        if source_name is None:
+            unresolved.append(filename)
+        elif source_name != filename:
+            shutil.copyfile(os.path.join(SAVE_DIR, source_name), os.path.join(SAVE_DIR, filename))
+            file_manifest.record(os.path.join(SAVE_DIR, filename), sha256, received_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            copied.append(filename)
+            log_message(f"文件 {filename} 与已有的 {source_name} 内容相同，已在本地复制", client_ip)
+    return copied, unresolved
+
+
+@app.route('/sync_state', methods=['GET'])
+def get_sync_state():
+    """返回已同步到的数据集标识和序号（高水位），主服务器据此只发送之后的修改"""
+    try:
+        state = sync_state(storage.get_metadata())
+        return jsonify({"status": "ok", **state})
+    except Exception as e:
+        log_message(f"读取同步水位时发生错误: {str(e)}", request.remote_addr, level="error")
+        return jsonify({"status": "error", "message": f"An error occurred: {str(e)}"}), 500
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查端点"""
-    log_message(f"健康检查请求", request.remote_addr)
-    return jsonify({"status": "ok", "message": "Remote server is running"})
+    log_message(f"健康检查请求", request.remote_addr, sample="health")
+    return jsonify({
+        "status": "ok",
+        "message": "Remote server is running",
+        "transfer_encodings": supported_encodings(),
+        "visualization_loaded": "visualization.data_visualizer" in sys.modules,
+        "render_jobs": render_jobs.counts() if render_jobs is not None else {},
+        "visualizations": render_manifest.counts() if render_manifest is not None else {}
+    })
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询后台任务（如生成可视化图表）的状态：queued / running / done / failed"""
+    try:
+        return jsonify({"status": "success", "job": render_jobs.get(job_id)})
+    except JobNotFound:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    except Exception as e:
+        log_message(f"查询任务 {job_id} 时发生错误: {str(e)}", request.remote_addr, level="error")
+        return jsonify({"status": "error", "message": f"An error occurred: {str(e)}"}), 500
 
 
 @app.route('/get_all_player_data', methods=['GET'])
 def get_all_player_data():
     """获取所有玩家数据（用于测试）"""
     try:
-        log_message(f"接收到获取所有玩家数据请求", request.remote_addr)
-        with file_lock:
-            data = read_data_file()
-        log_message(f"返回所有玩家数据成功", request.remote_addr)
+        log_message(f"接收到获取所有玩家数据请求", request.remote_addr, level="debug")
+        data = storage.read_document()
+        log_message(f"返回所有玩家数据成功", request.remote_addr, sample="player_data")
         return jsonify(data)
     except Exception as e:
         import traceback
-        log_message(f"获取所有玩家数据时发生错误: {str(e)}", request.remote_addr)
-        log_message(f"错误详情: {traceback.format_exc()}")
+        log_message(f"获取所有玩家数据时发生错误: {str(e)}", request.remote_addr, level="error")
+        log_message(f"错误详情: {traceback.format_exc()}", level="error")
         return jsonify({
             "status": "error",
             "message": f"An error occurred: {str(e)}"
@@ -321,12 +708,18 @@ def get_all_player_data():
 
 
 if __name__ == '__main__':
-    # 初始化数据文件
-    initialize_data_file()
-    
-    # 服务器监听端口
-    server_port = 10002
-    
+    parser = argparse.ArgumentParser(description="远程服务器")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="监听端口")
+    parser.add_argument('--no-preload', action='store_true', help="不在后台预先加载可视化依赖")
+    args = parser.parse_args()
+
+    # 初始化存储，启动生成图表的后台线程
+    initialize_storage()
+    start_render_workers()
+
+    if VISUALIZATION_PRELOAD and not args.no_preload:
+        preload_visualizer()
+
     # 启动服务器
-    log_message(f"启动远程服务器，监听端口 {server_port}")
-    app.run(host='0.0.0.0', port=server_port, debug=False)
\ No newline at end of file
+    log_message(f"启动远程服务器，监听端口 {args.port}")
+    app.run(host='0.0.0.0', port=args.port, debug=False)
\ No newline at end of file
@@ -9,10 +9,22 @@ import os
 from matplotlib.ticker import FuncFormatter
 import cv2
 
+def load_csv_data(csv_file_path):
+    # 读取CSV文件，跳过第0行，从第1行开始读取数据
+    columns = ['round', 'money', 'body_state', 'mind_state', 'x', 'y', 'z']
+    df = pd.read_csv(csv_file_path, header=None, names=columns, skiprows=1)
+    return df
+
 class DataVisualizer:
-    def __init__(self, csv_file_path):
+    # 每个CSV文件生成的图表：三个数值变化的GIF和行动轨迹
+    CHARTS = ('money', 'body_state', 'mind_state', 'movement')
+    # 数值图表的线条颜色
+    CHART_COLORS = {'money': 'r', 'body_state': 'g', 'mind_state': 'b'}
+
+    def __init__(self, csv_file_path, data=None):
+        """data 为已经用 load_csv_data 解析好的数据时不再读取CSV文件"""
         self.csv_file_path = csv_file_path
-        self.data = self.load_data()
+        self.data = data if data is not None else self.load_data()
         # 设置输出目录为项目根目录下的output_videos
         # 从cloud目录调用时，需要正确设置路径
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -23,14 +35,17 @@ class DataVisualizer:
             # 原有逻辑保持不变
             self.output_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'output_videos')
         
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+        # 多个进程可能同时创建
+        os.makedirs(self.output_dir, exist_ok=True)
     
     def load_data(self):
-        # 读取CSV文件，跳过第0行，从第1行开始读取数据
-        columns = ['round', 'money', 'body_state', 'mind_state', 'x', 'y', 'z']
-        df = pd.read_csv(self.csv_file_path, header=None, names=columns, skiprows=1)
-        return df
+        return load_csv_data(self.csv_file_path)
+    
+    def render_chart(self, chart, duration=10):
+        """生成 CHARTS 中的一个图表，返回输出路径，失败时返回None"""
+        if chart == 'movement':
+            return self.create_movement_video(duration)
+        return self.create_single_value_gif(chart, self.CHART_COLORS[chart], duration)
     
     def format_money(self, value, pos):
         # 将金钱格式化为更易读的形式
@@ -200,30 +215,37 @@ class DataVisualizer:
             return None
 
 if __name__ == "__main__":
-    # 示例使用
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="为 received_files 中的所有CSV文件生成可视化图表")
+    parser.add_argument('--workers', type=int, default=None, help="工作进程数，默认为CPU核心数")
+    parser.add_argument('--duration', type=int, default=10, help="动画时长（秒）")
+    args = parser.parse_args()
+
     # 获取当前脚本的目录
     script_dir = os.path.dirname(os.path.abspath(__file__))
+    # 工作进程按 visualization.data_visualizer 导入，需要 cloud 目录在导入路径中
+    sys.path.insert(0, os.path.dirname(script_dir))
+    from visualization.render_pool import RenderPool
+
     # 计算CSV文件目录的绝对路径
     csv_files_dir = os.path.join(script_dir, '..', 'received_files')
     
-    # 获取所有CSV文件
+    # 获取所有CSV文件，每个文件的每个图表作为一个任务并行生成
     csv_files = [f for f in os.listdir(csv_files_dir) if f.endswith('.csv')]
+    csv_charts = {os.path.join(csv_files_dir, csv_file): DataVisualizer.CHARTS for csv_file in csv_files}
     
-    for csv_file in csv_files:
-        csv_file_path = os.path.join(csv_files_dir, csv_file)
-        print(f"Processing {csv_file}...")
-        
-        try:
-            visualizer = DataVisualizer(csv_file_path)
-            
-            # 创建三个数值变化的GIF
-            value_gifs = visualizer.create_all_value_gifs()
-            for gif_path in value_gifs:
-                print(f"Value GIF created: {gif_path}")
-            
-            # 创建行动轨迹视频
-            movement_video = visualizer.create_movement_video()
-            print(f"Movement video created: {movement_video}")
-            
-        except Exception as e:
-            print(f"Error processing {csv_file}: {e}")
\ No newline at end of file
+    pool = RenderPool(workers=args.workers)
+    print(f"Processing {len(csv_files)} CSV files with {pool.workers} workers...")
+    try:
+        results = pool.render(csv_charts, duration=args.duration)
+    finally:
+        pool.close()
+    
+    for csv_file_path, charts in results.items():
+        for chart, (path, error) in charts.items():
+            if error is None:
+                print(f"{chart} GIF created: {path}")
+            else:
+                print(f"Error processing {os.path.basename(csv_file_path)} ({chart}): {error}")
@@ -0,0 +1,100 @@
+"""
+可视化图表的生成记录
+
+每个收到的CSV文件一行（SQLite，与任务队列共用 render_jobs.db）：
+    filename   received_files 中的文件名
+    size / mtime_ns / sha256   生成（或提交生成）时CSV文件的大小、修改时间和内容哈希
+    status     queued / done / failed
+    job_id     最近一次生成任务的编号
+    outputs    {图表: 输出路径}，已经生成的图表
+    error      失败时的错误信息
+
+收到文件时只查询这一个文件的记录：大小和修改时间（或内容哈希）与记录一致时说明已经生成或正在生成，
+不再列出目录或检查输出文件是否存在；内容改变时重新生成全部图表。
+"""
+
+import json
+import sqlite3
+
+from common.journal import now_text
+from common.storage import DEFAULT_POOL_SIZE, SqliteConnectionPool
+
+
+class RenderManifest:
+    """CSV文件 → 图表生成状态，可以在多个线程间共享"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS renders (
+            filename TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            sha256 TEXT,
+            status TEXT NOT NULL,
+            job_id TEXT,
+            outputs TEXT,
+            error TEXT,
+            updated_at TEXT NOT NULL
+        );
+    """
+    FIELDS = ("size", "mtime_ns", "sha256", "status", "job_id", "outputs", "error")
+
+    def __init__(self, path, timeout=30, pool_size=DEFAULT_POOL_SIZE):
+        """
+        Args:
+            path: 数据库文件路径
+            timeout: 等待其他连接释放写锁的秒数
+            pool_size: 最多同时打开的连接数
+        """
+        self.path = path
+        self.timeout = timeout
+        self._pool = SqliteConnectionPool(path, timeout=timeout, size=pool_size, row_factory=sqlite3.Row)
+        with self._pool.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def get(self, filename):
+        """返回文件的记录，没有记录时返回None"""
+        with self._pool.connection() as conn:
+            row = conn.execute("SELECT * FROM renders WHERE filename = ?", (filename,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry['outputs'] = json.loads(entry['outputs']) if entry['outputs'] else {}
+        return entry
+
+    def update(self, filename, **fields):
+        """添加或更新文件的记录，只修改给出的字段"""
+        unknown = set(fields) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"未知字段: {sorted(unknown)}")
+        if 'outputs' in fields:
+            fields['outputs'] = json.dumps(fields['outputs'], ensure_ascii=False)
+        fields['updated_at'] = now_text()
+        # 新记录没有给出状态时为 queued
+        values = {"status": "queued", **fields}
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' for _ in values)
+        assignments = ', '.join(f"{column} = excluded.{column}" for column in fields)
+        with self._pool.connection() as conn:
+            conn.execute(
+                f"INSERT INTO renders (filename, {columns}) VALUES (?, {placeholders}) "
+                f"ON CONFLICT(filename) DO UPDATE SET {assignments}",
+                (filename, *values.values())
+            )
+
+    @staticmethod
+    def matches(entry, stat, sha256=None):
+        """记录是否对应文件的当前内容：大小和修改时间一致，或给出的内容哈希一致"""
+        if entry is None:
+            return False
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        return sha256 is not None and entry['sha256'] == sha256
+
+    def counts(self):
+        """各状态的文件数"""
+        with self._pool.connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM renders GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        self._pool.close()
@@ -0,0 +1,175 @@
+"""
+多进程生成可视化图表
+
+matplotlib 生成动画只能用一个 CPU 核心，并且 pyplot 不能在多个线程中同时使用，
+所以把每个 (CSV文件, 图表) 作为一个任务交给进程池：
+    - CSV 在提交任务的进程中只解析一次，解析后的数据随任务发送给工作进程，工作进程不再读取文件
+    - 工作进程数可配置，默认为 CPU 核心数
+    - 每个工作进程的地址空间限制为 memory_limit_mb（仅 Linux/macOS），超过时该任务失败而不会拖垮整台机器；
+      每个进程处理 max_tasks_per_worker 个任务后由新进程替换，释放 matplotlib 积累的内存
+    - 图表超过 task_timeout 秒仍未完成时视为失败，并替换整个进程池终止卡住的进程（Pool 不能单独终止
+      正在执行任务的进程，卡住的进程会一直占用一个名额）；被一同终止的其他任务提交到新的进程池重新生成
+
+工作进程使用 spawn 方式启动，不继承服务器进程中的线程和锁。
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+# 每个工作进程的地址空间上限（MB），0 表示不限制
+DEFAULT_MEMORY_LIMIT_MB = 2048
+# 每个工作进程处理多少个任务后由新进程替换
+DEFAULT_MAX_TASKS_PER_WORKER = 20
+# 单个图表的最长生成时间（秒），超过后视为失败（例如工作进程被系统杀死）
+DEFAULT_TASK_TIMEOUT = 600
+# 等待结果时检查进程池是否已被替换的间隔（秒）
+POLL_INTERVAL = 1.0
+
+# 工作进程中的数值计算库只用一个线程：并行由进程池提供，多线程只会增加内存占用
+_SINGLE_THREAD_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def _init_worker(memory_limit_mb):
+    """工作进程启动时调用：限制计算库线程数和进程内存"""
+    for name in _SINGLE_THREAD_ENV:
+        os.environ.setdefault(name, "1")
+    if memory_limit_mb:
+        try:
+            import resource
+        except ImportError:
+            # Windows 没有 resource 模块，不限制内存
+            return
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _render_chart(csv_file_path, chart, data, duration):
+    """在工作进程中生成一个图表，返回 (CSV路径, 图表, 输出路径, 错误信息)"""
+    try:
+        from visualization.data_visualizer import DataVisualizer
+
+        path = DataVisualizer(csv_file_path, data=data).render_chart(chart, duration)
+        if path is None:
+            return csv_file_path, chart, None, f"生成 {chart} 图表失败"
+        return csv_file_path, chart, path, None
+    except MemoryError:
+        return csv_file_path, chart, None, "超过工作进程的内存上限"
+    except Exception as e:
+        return csv_file_path, chart, None, str(e)
+
+
+class RenderPool:
+    """生成图表的进程池，可以在多个线程中同时调用 render"""
+
+    # 在工作进程中执行的函数，参数为 (CSV路径, 图表, 数据, 时长)
+    task = staticmethod(_render_chart)
+
+    def __init__(self, workers=None, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB,
+                 max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER, task_timeout=DEFAULT_TASK_TIMEOUT):
+        """
+        Args:
+            workers: 工作进程数，None 表示 CPU 核心数
+            memory_limit_mb: 每个工作进程的地址空间上限（MB），0 表示不限制
+            max_tasks_per_worker: 每个工作进程处理多少个任务后替换
+            task_timeout: 单个图表的最长生成时间（秒）
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.memory_limit_mb = memory_limit_mb
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.task_timeout = task_timeout
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._pool = self._start_pool()
+
+    def _start_pool(self):
+        return multiprocessing.get_context("spawn").Pool(
+            self.workers, initializer=_init_worker, initargs=(self.memory_limit_mb,),
+            maxtasksperchild=self.max_tasks_per_worker
+        )
+
+    def _submit(self, args):
+        """提交任务，返回 (提交时的进程池编号, AsyncResult)"""
+        with self._lock:
+            return self.restarts, self._pool.apply_async(self.task, args)
+
+    def _restart(self, generation):
+        """终止当前进程池中的全部工作进程并启动新的进程池；其他线程已经替换过时不再替换"""
+        with self._lock:
+            if generation != self.restarts:
+                return
+            self._pool.terminate()
+            self._pool = self._start_pool()
+            self.restarts += 1
+
+    def _wait(self, args, generation, async_result):
+        """
+        等待一个任务的结果，返回 (输出路径, 错误信息)
+
+        任务超时时替换进程池；任务所在的进程池因其他任务超时被替换时，提交到新的进程池重新等待。
+        """
+        deadline = time.monotonic() + self.task_timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                _, _, path, error = async_result.get(max(0, min(remaining, POLL_INTERVAL)))
+                return path, error
+            except multiprocessing.TimeoutError:
+                pass
+            if async_result.ready():
+                continue
+            with self._lock:
+                replaced = generation != self.restarts
+            if replaced:
+                generation, async_result = self._submit(args)
+                deadline = time.monotonic() + self.task_timeout
+            elif remaining <= 0:
+                self._restart(generation)
+                return None, f"生成 {args[1]} 图表超过 {self.task_timeout} 秒"
+
+    def render(self, csv_charts, duration=10, on_result=None):
+        """
+        生成图表，所有任务完成后返回
+
+        Args:
+            csv_charts: {CSV路径: 要生成的图表列表}，图表为 DataVisualizer.CHARTS 中的名称
+            duration: 动画时长（秒）
+            on_result: 每个图表完成（或失败）时调用 on_result(CSV路径, 图表, 输出路径, 错误信息)，
+                       用于在全部完成之前记录进度
+
+        Returns:
+            {CSV路径: {图表: (输出路径, 错误信息)}}；成功时错误信息为None，失败时输出路径为None
+        """
+        from visualization.data_visualizer import load_csv_data
+
+        results = {}
+        pending = []
+        for csv_file_path, charts in csv_charts.items():
+            results[csv_file_path] = {}
+            try:
+                data = load_csv_data(csv_file_path)
+            except Exception as e:
+                for chart in charts:
+                    results[csv_file_path][chart] = (None, f"读取CSV文件失败: {str(e)}")
+                    if on_result is not None:
+                        on_result(csv_file_path, chart, None, results[csv_file_path][chart][1])
+                continue
+            for chart in charts:
+                args = (csv_file_path, chart, data, duration)
+                pending.append((args, *self._submit(args)))
+
+        for args, generation, async_result in pending:
+            csv_file_path, chart = args[:2]
+            path, error = self._wait(args, generation, async_result)
+            results[csv_file_path][chart] = (path, error)
+            if on_result is not None:
+                on_result(csv_file_path, chart, path, error)
+        return results
+
+    def close(self):
+        """等待已提交的任务完成后关闭工作进程"""
+        with self._lock:
+            pool = self._pool
+        pool.close()
+        pool.join()
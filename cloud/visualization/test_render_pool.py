@@ -0,0 +1,60 @@
+"""生成图表的进程池：卡住的任务超时后替换进程池，不会占满全部工作进程"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from visualization.render_pool import RenderPool
+
+
+def fake_render(csv_file_path, chart, data, duration):
+    """名为 hang 的图表一直不结束，其余立即完成"""
+    if chart == "hang":
+        time.sleep(60)
+    return csv_file_path, chart, f"{chart}.gif", None
+
+
+class FakeRenderPool(RenderPool):
+    task = staticmethod(fake_render)
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "game.csv"
+    path.write_text("header\n1,100,50,50,0,0,0\n", encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def pool():
+    pool = FakeRenderPool(workers=1, memory_limit_mb=0, task_timeout=1)
+    yield pool
+    pool.close()
+
+
+def test_hung_task_times_out_and_frees_worker(pool, csv_file):
+    finished = []
+    results = pool.render({csv_file: ["hang", "money", "movement"]},
+                          on_result=lambda *result: finished.append(result[1:]))
+
+    # 排在卡住的任务后面的任务随进程池替换被终止，重新提交后完成
+    path, error = results[csv_file]["hang"]
+    assert path is None and "1 秒" in error
+    assert results[csv_file]["money"] == ("money.gif", None)
+    assert results[csv_file]["movement"] == ("movement.gif", None)
+    assert [chart for chart, _, _ in finished] == ["hang", "money", "movement"]
+    assert pool.restarts == 1
+
+    # 唯一的工作进程没有被卡住的任务一直占用
+    assert pool.render({csv_file: ["money"]})[csv_file]["money"] == ("money.gif", None)
+
+
+def test_repeated_timeouts_do_not_exhaust_pool(pool, csv_file):
+    for _ in range(3):
+        assert pool.render({csv_file: ["hang"]})[csv_file]["hang"][0] is None
+    assert pool.restarts == 3
+    assert pool.render({csv_file: ["body_state"]})[csv_file]["body_state"] == ("body_state.gif", None)
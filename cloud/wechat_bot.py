@@ -1,15 +1,23 @@
 from flask import Flask, request, make_response, send_from_directory
 import hashlib
 import xml.etree.ElementTree as ET
-import json
+import atexit
 import os
+import sys
 import time
 from datetime import datetime
-from threading import Lock
 import glob
 from zhipu_chat import ZhipuChat
 
+# 共享的 common 包位于项目根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.storage import open_storage
+from common.http_client import default_client
+from common.service_log import ServiceLogger
+from common.metrics import install_flask_metrics
+
 app = Flask(__name__)
+install_flask_metrics(app, "wechat_bot")  # 请求指标，GET /metrics
 
 # 微信公众号配置
 WECHAT_TOKEN = "futuresample"  # 请替换为你的微信公众号Token
@@ -19,14 +27,24 @@ ZHIPU_API_KEY = "c17166d25b2142e3bde3649d1bd38d97.cixb4bTLpHjFMmH4"  # 请替换
 
 # 数据文件路径
 DATA_FILE = "data.json"
-file_lock = Lock()
+# SQLite数据库路径，与remote_backend.py共用
+DATABASE_FILE = "data.db"
+# 存储后端，需要与remote_backend.py的STORAGE_BACKEND保持一致
+STORAGE_BACKEND = "sqlite"  # 可以改为 "json"
+# 存储实例，启动时由 initialize_storage() 打开
+storage = None
 
 # 配置标准输出流的编码为UTF-8
-import sys
 import io
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
+# 日志级别（debug / info / warning / error）和日志文件目录（每行一个JSON，按大小轮转）
+LOG_LEVEL = "info"
+LOG_DIR = "logs"
+service_log = ServiceLogger("wechat_bot", LOG_DIR, level=LOG_LEVEL, client_field="user", client_label="User")
+atexit.register(service_log.close)
+
 def find_player_file_by_number(player_number):
     """根据编号查找对应的txt文件"""
     try:
@@ -39,7 +57,7 @@ def find_player_file_by_number(player_number):
         else:
             return None
     except Exception as e:
-        log_message(f"查找玩家文件时出错: {str(e)}")
+        log_message(f"查找玩家文件时出错: {str(e)}", level="error")
         return None
 
 
@@ -54,32 +72,41 @@ def load_player_story_content(file_path):
             
             # 检查内容是否有效（不是乱码）
             if content and len(content) > 10:
-                log_message(f"成功使用 {encoding} 编码读取文件")
+                log_message(f"成功使用 {encoding} 编码读取文件", level="debug")
                 return content
                 
         except (UnicodeDecodeError, UnicodeError):
             continue
         except Exception as e:
-            log_message(f"读取文件时出错 ({encoding}): {str(e)}")
+            log_message(f"读取文件时出错 ({encoding}): {str(e)}", level="warning")
             continue
     
-    log_message(f"所有编码格式都无法读取文件: {file_path}")
+    log_message(f"所有编码格式都无法读取文件: {file_path}", level="warning")
     return None
 
 
-def log_message(message, user_id=None):
-    """记录日志信息"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user_info = f"[User: {user_id}]" if user_id else ""
-    print(f"{timestamp} {user_info} {message}")
+def log_message(message, user_id=None, level="info", sample=None, **fields):
+    """记录日志信息：只放入队列，由后台线程写控制台和日志文件"""
+    service_log.log(message, level=level, sample=sample, user=user_id, **fields)
+
+def initialize_storage():
+    """打开与remote_backend.py共用的存储"""
+    global storage
+    storage = open_storage(
+        STORAGE_BACKEND,
+        DATA_FILE,
+        DATABASE_FILE,
+        lambda: {"received_data": {"players": [], "metadata": {}}},
+        log=log_message
+    )
 
-def read_data_file():
-    """读取数据文件"""
+
+def read_metadata():
+    """读取元数据（sqlite 模式下只读取元数据这一行）"""
     try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        log_message(f"读取数据文件失败: {str(e)}")
+        return storage.get_metadata()
+    except Exception as e:
+        log_message(f"读取数据失败: {str(e)}", level="warning")
         return None
 
 def verify_wechat_signature(signature, timestamp, nonce):
@@ -100,7 +127,7 @@ def parse_xml_message(xml_data):
             msg[child.tag] = child.text
         return msg
     except Exception as e:
-        log_message(f"解析XML消息失败: {str(e)}")
+        log_message(f"解析XML消息失败: {str(e)}", level="warning")
         return None
 
 def create_text_response(to_user, from_user, content):
@@ -138,7 +165,7 @@ def check_existing_visualizations(player_number):
             
     except Exception as e:
         error_msg = f"检查可视化文件时发生错误: {str(e)}"
-        log_message(error_msg)
+        log_message(error_msg, level="error")
         return None, error_msg
 def create_download_response(player_number, generated_files):
     """创建下载链接响应消息"""
@@ -174,7 +201,7 @@ def create_download_response(player_number, generated_files):
         return response_text
         
     except Exception as e:
-        log_message(f"创建下载响应消息时出错: {str(e)}")
+        log_message(f"创建下载响应消息时出错: {str(e)}", level="error")
         return f"🎉 编号 {player_number} 的图表已准备好！但生成链接时出错。"
 
 
@@ -186,32 +213,30 @@ def query_player_status(player_number):
     except ValueError:
         return "请输入有效的数字编号"
     
-    with file_lock:
-        data = read_data_file()
-        if not data:
-            return "系统数据暂时无法读取，请稍后再试"
-        
-        metadata = data.get('received_data', {}).get('metadata', {})
-        current_number = metadata.get('current_number', 0)
-        total_players = metadata.get('total_players', 0)
-        
-        log_message(f"查询编号 {player_number}，当前完成: {current_number}，总数: {total_players}")
-        
-        if player_number > total_players:
-            return f"编号 {player_number} 不存在，当前系统中最大编号为 {total_players}"
-        
-        if player_number <= current_number:
-            # 已完成，可以查看可视化
-            return f"🎉 编号 {player_number} 已完成！\n\n回复 '查看图表-{player_number}' 来获取您的个人数据可视化图表\n\n回复 '对话-{player_number}-消息内容' 来和未来的你对话"
-        else:
-            # 未完成，计算等待时间
-            remaining_count = player_number - current_number
-            estimated_minutes = remaining_count * 3  # 平均每人3分钟
-            
-            return f"⏳ 编号 {player_number} 还未完成\n\n" \
-                   f"您前面还有 {remaining_count} 人在排队\n" \
-                   f"预计还需要等待约 {estimated_minutes} 分钟\n\n" \
-                   f"系统会自动处理，请耐心等待 😊"
+    metadata = read_metadata()
+    if metadata is None:
+        return "系统数据暂时无法读取，请稍后再试"
+    
+    current_number = metadata.get('current_number', 0)
+    total_players = metadata.get('total_players', 0)
+    
+    log_message(f"查询编号 {player_number}，当前完成: {current_number}，总数: {total_players}")
+    
+    if player_number > total_players:
+        return f"编号 {player_number} 不存在，当前系统中最大编号为 {total_players}"
+    
+    if player_number <= current_number:
+        # 已完成，可以查看可视化
+        return f"🎉 编号 {player_number} 已完成！\n\n回复 '查看图表-{player_number}' 来获取您的个人数据可视化图表\n\n回复 '对话-{player_number}-消息内容' 来和未来的你对话"
+    else:
+        # 未完成，计算等待时间
+        remaining_count = player_number - current_number
+        estimated_minutes = remaining_count * 3  # 平均每人3分钟
+        
+        return f"⏳ 编号 {player_number} 还未完成\n\n" \
+               f"您前面还有 {remaining_count} 人在排队\n" \
+               f"预计还需要等待约 {estimated_minutes} 分钟\n\n" \
+               f"系统会自动处理，请耐心等待 😊"
 
 def handle_chat_with_future_self(message_content, user_id):
     """处理与未来自己对话的请求"""
@@ -242,16 +267,14 @@ def handle_chat_with_future_self(message_content, user_id):
         log_message(f"用户 {user_id} 请求与编号 {player_number} 的未来自己对话，消息: {user_message[:50]}...")
         
         # 检查是否已完成游戏
-        with file_lock:
-            data = read_data_file()
-            if not data:
-                return "系统数据暂时无法读取，请稍后再试"
-            
-            metadata = data.get('received_data', {}).get('metadata', {})
-            current_number = metadata.get('current_number', 0)
-            
-            if player_number_int > current_number:
-                return f"编号 {player_number} 尚未完成游戏，无法与未来自己对话"
+        metadata = read_metadata()
+        if metadata is None:
+            return "系统数据暂时无法读取，请稍后再试"
+        
+        current_number = metadata.get('current_number', 0)
+        
+        if player_number_int > current_number:
+            return f"编号 {player_number} 尚未完成游戏，无法与未来自己对话"
         
         # 查找对应的玩家文件
         player_file = find_player_file_by_number(player_number)
@@ -291,11 +314,11 @@ def handle_chat_with_future_self(message_content, user_id):
                 return "😔 抱歉，未来的你暂时无法回应，请稍后再试"
                 
         except Exception as e:
-            log_message(f"创建智谱AI对话实例时出错: {str(e)}")
+            log_message(f"创建智谱AI对话实例时出错: {str(e)}", level="error")
             return f"😔 AI服务暂时不可用，请稍后再试"
             
     except Exception as e:
-        log_message(f"处理与未来自己对话请求时发生错误: {str(e)}")
+        log_message(f"处理与未来自己对话请求时发生错误: {str(e)}", level="error")
         return "系统出现错误，请稍后再试"
 
 
@@ -314,16 +337,14 @@ def handle_generate_charts_request(message_content, user_id):
             return "请输入有效的数字编号"
         
         # 检查是否已完成游戏
-        with file_lock:
-            data = read_data_file()
-            if not data:
-                return "系统数据暂时无法读取，请稍后再试"
-            
-            metadata = data.get('received_data', {}).get('metadata', {})
-            current_number = metadata.get('current_number', 0)
-            
-            if player_number > current_number:
-                return f"编号 {player_number} 尚未完成游戏，无法获取图表"
+        metadata = read_metadata()
+        if metadata is None:
+            return "系统数据暂时无法读取，请稍后再试"
+        
+        current_number = metadata.get('current_number', 0)
+        
+        if player_number > current_number:
+            return f"编号 {player_number} 尚未完成游戏，无法获取图表"
         
         # 检查是否存在已生成的可视化文件
         log_message(f"用户 {user_id} 请求查看编号 {player_number} 的图表")
@@ -341,7 +362,7 @@ def handle_generate_charts_request(message_content, user_id):
             
     except Exception as e:
         error_msg = f"处理查看图表请求时发生错误: {str(e)}"
-        log_message(error_msg)
+        log_message(error_msg, level="error")
         return "系统出现错误，请稍后再试"
 
 def process_message(msg):
@@ -402,8 +423,8 @@ def process_message(msg):
 @app.route('/wechat', methods=['GET', 'POST'])
 def wechat_handler():
     """微信公众号消息处理入口"""
-    log_message(f"收到请求: {request.method} {request.url}")
-    log_message(f"请求参数: {dict(request.args)}")
+    log_message(f"收到请求: {request.method} {request.url}", level="debug")
+    log_message(f"请求参数: {dict(request.args)}", level="debug")
     
     if request.method == 'GET':
         # 验证服务器配置
@@ -412,13 +433,13 @@ def wechat_handler():
         nonce = request.args.get('nonce', '')
         echostr = request.args.get('echostr', '')
         
-        log_message(f"微信验证请求 - signature: {signature}, timestamp: {timestamp}, nonce: {nonce}, echostr: {echostr}")
+        log_message(f"微信验证请求 - signature: {signature}, timestamp: {timestamp}, nonce: {nonce}, echostr: {echostr}", level="debug")
         
         if verify_wechat_signature(signature, timestamp, nonce):
             log_message("微信签名验证成功")
             return echostr
         else:
-            log_message("微信签名验证失败")
+            log_message("微信签名验证失败", level="warning")
             return 'Invalid signature', 403
     
     elif request.method == 'POST':
@@ -432,8 +453,8 @@ def wechat_handler():
             
             # 处理消息并生成回复
             response_content = process_message(msg)
-            log_message(f"process_message 返回内容长度: {len(response_content) if response_content else 0}")
-            log_message(f"回复内容前50字符: {response_content[:50] if response_content else 'None'}...")
+            log_message(f"process_message 返回内容长度: {len(response_content) if response_content else 0}", level="debug")
+            log_message(f"回复内容前50字符: {response_content[:50] if response_content else 'None'}...", level="debug")
             
             # 创建回复XML
             response_xml = create_text_response(
@@ -442,16 +463,16 @@ def wechat_handler():
                 response_content
             )
             
-            log_message(f"XML回复生成成功，长度: {len(response_xml)}")
-            log_message(f"XML前100字符: {response_xml[:100]}...")
+            log_message(f"XML回复生成成功，长度: {len(response_xml)}", level="debug")
+            log_message(f"XML前100字符: {response_xml[:100]}...", level="debug")
             
             response = make_response(response_xml)
             response.content_type = 'application/xml; charset=utf-8'
-            log_message(f"准备返回XML响应，Content-Type: {response.content_type}")
+            log_message(f"准备返回XML响应，Content-Type: {response.content_type}", level="debug")
             return response
             
         except Exception as e:
-            log_message(f"处理微信消息时发生错误: {str(e)}")
+            log_message(f"处理微信消息时发生错误: {str(e)}", level="error")
             return 'Internal server error', 500
 
 @app.route('/download/<filename>', methods=['GET'])
@@ -473,7 +494,7 @@ def download_file(filename):
         return send_from_directory(output_dir, filename, as_attachment=True)
         
     except Exception as e:
-        log_message(f"下载文件失败: {str(e)}")
+        log_message(f"下载文件失败: {str(e)}", level="warning")
         return "Download failed", 500
 
 @app.route('/health', methods=['GET'])
@@ -495,18 +516,18 @@ def root_endpoint():
 @app.route('/status', methods=['GET'])
 def get_status():
     """获取系统状态API"""
-    with file_lock:
-        data = read_data_file()
-        if not data:
-            return {"error": "Cannot read data file"}, 500
-        
-        metadata = data.get('received_data', {}).get('metadata', {})
-        return {
-            "current_number": metadata.get('current_number', 0),
-            "total_players": metadata.get('total_players', 0),
-            "last_updated": metadata.get('last_updated', ''),
-            "server_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
+    metadata = read_metadata()
+    if metadata is None:
+        return {"error": "Cannot read data file"}, 500
+    
+    return {
+        "current_number": metadata.get('current_number', 0),
+        "total_players": metadata.get('total_players', 0),
+        "last_updated": metadata.get('last_updated', ''),
+        "server_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        # 智谱AI等出站请求按主机统计的耗时
+        "http": default_client().stats()
+    }
 
 if __name__ == '__main__':
     log_message("启动微信公众号服务...")
@@ -522,4 +543,7 @@ if __name__ == '__main__':
         os.makedirs('../output_videos')
         log_message("创建 output_videos 目录")
     
+    # 打开存储
+    initialize_storage()
+    
     app.run(host='0.0.0.0', port=80, debug=False)
\ No newline at end of file
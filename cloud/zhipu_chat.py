@@ -6,22 +6,30 @@
 """
 
 import json
+import os
+import sys
 import requests
 import time
 from typing import Dict, List, Optional, Any
 
+# 共享的 common 包位于项目根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.http_client import HttpClient, default_client
+
 
 class ZhipuChat:
     """智谱AI对话类"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, http_client: Optional[HttpClient] = None):
         """
         初始化智谱AI对话
         
         Args:
             api_key: 智谱AI的API密钥
+            http_client: 出站HTTP客户端，默认使用进程内共享的客户端，多个对话实例复用同一个连接池
         """
         self.api_key = api_key
+        self.http_client = http_client or default_client()
         self.base_url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
         self.headers = {
             "Authorization": f"Bearer {api_key}",
@@ -73,12 +81,13 @@ class ZhipuChat:
         }
         
         try:
-            # 发送请求
-            response = requests.post(
+            # 发送请求；连接失败或限流（429/5xx）时按退避策略重试
+            response = self.http_client.post(
                 self.base_url, 
                 headers=self.headers, 
                 json=data,
-                timeout=30
+                timeout=30,
+                retry=True
             )
             response.raise_for_status()
             
@@ -131,13 +140,14 @@ class ZhipuChat:
         }
         
         try:
-            # 发送流式请求
-            response = requests.post(
+            # 发送流式请求；重试只发生在开始接收内容之前
+            response = self.http_client.post(
                 self.base_url, 
                 headers=self.headers, 
                 json=data,
                 stream=True,
-                timeout=30
+                timeout=30,
+                retry=True
             )
             response.raise_for_status()
             
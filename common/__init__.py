@@ -0,0 +1,3 @@
+"""
+FutureSpecimens 各服务共享的公共模块
+"""
@@ -0,0 +1,73 @@
+"""
+最新值广播
+
+保存一个缓存的最新值，只有值真正变化时才递增版本号并唤醒等待者，
+用于 SSE 推送这类"有变化才通知"的场景；线程可以用 wait() 等待，
+asyncio 协程可以用 wait_async() 等待，不占用线程。
+"""
+
+import asyncio
+import threading
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ValueBroadcaster:
+    """缓存最新值，值变化时唤醒所有等待的连接"""
+
+    def __init__(self, value=None):
+        self._cond = threading.Condition()
+        self._value = value
+        self._version = 0
+        self._async_waiters = set()
+
+    @property
+    def value(self):
+        """当前缓存的值"""
+        return self._value
+
+    def publish(self, value):
+        """发布新值，与当前值相同时不通知，返回是否发生了变化"""
+        with self._cond:
+            if value == self._value:
+                return False
+            self._value = value
+            self._version += 1
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+            self._async_waiters.clear()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return True
+
+    def wait(self, version, timeout=None):
+        """
+        等待版本号超过 version
+
+        Returns:
+            (版本号, 值)；超时时版本号不变
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._version > version, timeout)
+            return self._version, self._value
+
+    async def wait_async(self, version, timeout=None):
+        """wait() 的 asyncio 版本，发布方可以在任意线程中"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._version > version:
+                return self._version, self._value
+            waiter = (loop, loop.create_future())
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+        with self._cond:
+            return self._version, self._value
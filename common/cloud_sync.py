@@ -0,0 +1,149 @@
+"""
+后台云同步
+
+UE 取样请求不再等待网络：请求处理时只把 C:\\output 中的文件移入本地发件箱（outbox 目录），
+唤醒后台线程后立即返回；后台线程负责上传文件和同步玩家数据，失败时按指数退避重试。
+
+发件箱就是一个目录，文件上传成功后才删除，进程重启后未上传的文件仍在其中，
+启动时会自动重新同步；玩家数据按同步水位（见 common/sync.py）增量发送，本身不需要排队。
+"""
+
+import os
+import random
+import shutil
+import threading
+import time
+
+from common.journal import now_text
+from common.transfer import list_transfer_files
+
+
+class FileOutbox:
+    """等待上传的文件，保存在本地目录中"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def put(self, file_path):
+        """把文件移入发件箱，同名文件会被新文件覆盖，返回发件箱中的路径"""
+        dest_path = os.path.join(self.directory, os.path.basename(file_path))
+        try:
+            os.replace(file_path, dest_path)
+        except OSError:
+            # 输出目录与发件箱不在同一个磁盘上时无法直接重命名
+            shutil.move(file_path, dest_path)
+        return dest_path
+
+    def pending(self):
+        """按放入的先后顺序返回等待上传的文件路径"""
+        return sorted(list_transfer_files(self.directory), key=os.path.getmtime)
+
+    def remove(self, file_path):
+        """删除已经上传成功的文件"""
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+
+class SyncWorker:
+    """在后台线程中执行同步，失败后按带随机抖动的指数退避重试"""
+
+    def __init__(self, sync_once, interval=60, initial_backoff=1.0, max_backoff=300.0, log=print):
+        """
+        Args:
+            sync_once: 执行一次同步的函数，失败时抛出异常，成功时返回结果摘要（dict）
+            interval: 没有新请求时定期同步的间隔（秒）
+            initial_backoff: 第一次失败后的重试等待时间（秒）
+            max_backoff: 重试等待时间的上限（秒）
+            log: 日志输出函数
+        """
+        self.sync_once = sync_once
+        self.interval = interval
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.log = log
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._status_lock = threading.Lock()
+        self._status = {
+            "state": "idle",
+            "attempts": 0,
+            "consecutive_failures": 0,
+            "last_attempt_at": None,
+            "last_success_at": None,
+            "last_error": None,
+            "last_result": None,
+            "next_retry_at": None
+        }
+
+    def start(self):
+        """启动后台线程并立即同步一次，发送上次退出时留下的内容"""
+        self._thread = threading.Thread(target=self._run, name="cloud-sync", daemon=True)
+        self._thread.start()
+        self.request()
+        return self
+
+    def request(self):
+        """请求尽快同步；退避等待期间的请求会在等待结束后一起处理"""
+        self._wake.set()
+
+    def status(self):
+        """返回同步状态的副本"""
+        with self._status_lock:
+            return dict(self._status)
+
+    def _update_status(self, **values):
+        with self._status_lock:
+            self._status.update(values)
+
+    def _backoff(self, failures):
+        delay = min(self.max_backoff, self.initial_backoff * (2 ** (failures - 1)))
+        # 随机抖动，避免多个客户端在远程恢复后同时重试
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+
+            self._update_status(state="syncing", last_attempt_at=now_text(), next_retry_at=None)
+            with self._status_lock:
+                self._status['attempts'] += 1
+            try:
+                result = self.sync_once()
+            except Exception as e:
+                with self._status_lock:
+                    self._status['consecutive_failures'] += 1
+                    failures = self._status['consecutive_failures']
+                delay = self._backoff(failures)
+                self._update_status(
+                    state="retrying",
+                    last_error=str(e),
+                    next_retry_at=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() + delay))
+                )
+                self.log(f"云同步失败（连续第 {failures} 次），{delay:.1f}秒后重试: {str(e)}")
+                if self._stop.wait(delay):
+                    return
+                self._wake.set()
+                continue
+
+            self._update_status(
+                state="idle",
+                consecutive_failures=0,
+                last_success_at=now_text(),
+                last_error=None,
+                last_result=result
+            )
+
+    def close(self, timeout=None):
+        """停止后台线程，正在进行的同步会先完成"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,85 @@
+"""
+跨进程文件锁
+
+多个进程（例如 asgi 模式下的多个 worker）共用同一个数据文件时，用操作系统的文件锁
+（Windows 上为 msvcrt.locking，其他系统为 fcntl.flock）保证同一时刻只有一个进程在读改写；
+同一进程内的线程之间再用 threading.Lock 互斥。进程退出时操作系统会自动释放锁。
+"""
+
+import os
+import threading
+import time
+
+from common.metrics import LOCK_WAIT_SECONDS
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+
+class FileLock:
+    """基于锁文件的跨进程互斥锁，可作为上下文管理器使用"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: 锁文件路径，不存在时自动创建；文件内容无意义
+        """
+        self.path = path
+        self.name = os.path.basename(path)
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, blocking=True):
+        """获得锁，blocking 为 False 时获取不到立即返回 False"""
+        start = time.perf_counter()
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            self._file = open(self.path, 'a+b')
+            if msvcrt is not None:
+                # msvcrt.LK_LOCK 最多重试10秒就会失败，这里自己重试直到拿到锁
+                self._file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        time.sleep(0.05)
+            else:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(self._file.fileno(), flags)
+        except OSError:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            if blocking:
+                raise
+            return False
+        LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, lock=self.name)
+        return True
+
+    def release(self):
+        """释放锁"""
+        try:
+            if msvcrt is not None:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,112 @@
+"""
+按内容哈希记录文件的清单
+
+game_backend 的发件箱和 remote_backend 的 received_files 各有一份清单（JSON 文件）：
+    {"files": {文件名: {"sha256": ..., "size": ..., "mtime_ns": ..., 其他字段}}}
+
+哈希按 (大小, 修改时间) 缓存，文件没有变化时不会重新读取；
+发送端先用清单中的哈希询问远程缺少哪些文件，只上传缺少的，远程确认后才删除本地文件。
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from common.journal import write_json_atomic
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """文件名 → 内容哈希的持久化清单，可以在多个线程间共享"""
+
+    def __init__(self, path, log=print):
+        self.path = path
+        self.log = log
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._files = {}
+        self._by_hash = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                files = json.load(f).get('files', {})
+        except (OSError, json.JSONDecodeError) as e:
+            # 清单只是缓存，损坏时重新计算哈希即可
+            self.log(f"读取文件清单 {self.path} 失败，将重新计算哈希: {str(e)}")
+            return
+        for filename, entry in files.items():
+            self._set(filename, entry)
+
+    def _set(self, filename, entry):
+        previous = self._files.get(filename)
+        if previous is not None:
+            self._by_hash.get(previous['sha256'], set()).discard(filename)
+        self._files[filename] = entry
+        self._by_hash.setdefault(entry['sha256'], set()).add(filename)
+        self._dirty = True
+
+    def get(self, filename):
+        """返回文件名对应的记录副本，不存在时返回None"""
+        with self._lock:
+            entry = self._files.get(filename)
+            return dict(entry) if entry is not None else None
+
+    def filenames_with_hash(self, sha256):
+        """返回内容哈希为 sha256 的文件名"""
+        with self._lock:
+            return sorted(self._by_hash.get(sha256, ()))
+
+    def hash_file(self, file_path):
+        """返回文件的 sha256；大小和修改时间与记录一致时直接使用记录中的哈希"""
+        filename = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        with self._lock:
+            entry = self._files.get(filename)
+            if entry is not None and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+                return entry['sha256']
+        sha256 = file_sha256(file_path)
+        self.record(file_path, sha256)
+        return sha256
+
+    def record(self, file_path, sha256, **fields):
+        """记录文件的哈希和当前大小、修改时间，替换之前的记录"""
+        stat = os.stat(file_path)
+        entry = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **fields}
+        with self._lock:
+            self._set(os.path.basename(file_path), entry)
+
+    def update(self, filename, **fields):
+        """给已有的记录添加字段"""
+        with self._lock:
+            if filename in self._files:
+                self._files[filename].update(fields)
+                self._dirty = True
+
+    def save(self):
+        """有修改时把清单写回磁盘"""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                files = {filename: dict(entry) for filename, entry in self._files.items()}
+                self._dirty = False
+            write_json_atomic(self.path, {"files": files})
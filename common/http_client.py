@@ -0,0 +1,200 @@
+"""
+共享的出站 HTTP 客户端
+
+所有对外请求（game_backend → remote_backend 的传输、wechat_bot 调用智谱AI）都通过这里发出：
+    - 基于 requests.Session 的连接池，复用 TCP/TLS 连接（keep-alive）
+    - 每个主机的并发请求数有上限，超过时排队等待
+    - 连接失败或返回可重试的状态码时，按带随机抖动的指数退避重试
+    - 按主机统计请求次数、错误数、重试次数和耗时分位数
+
+请求体是生成器或文件对象时无法重放，这类请求不会自动重试。
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.metrics import HTTP_CLIENT_RETRIES, HTTP_CLIENT_SECONDS
+
+# 默认会自动重试的请求方法（幂等）
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+# 默认会重试的响应状态码
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 1)
+
+
+class HostStats:
+    """单个主机的请求统计，耗时只保留最近的若干次用于计算分位数"""
+
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent_ms = deque(maxlen=window)
+
+    def record(self, elapsed_ms, error):
+        self.requests += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.recent_ms.append(elapsed_ms)
+        if error:
+            self.errors += 1
+
+    def summary(self):
+        recent = sorted(self.recent_ms)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else None,
+            "p50_ms": _percentile(recent, 0.50),
+            "p95_ms": _percentile(recent, 0.95),
+            "p99_ms": _percentile(recent, 0.99),
+            "max_ms": round(self.max_ms, 1)
+        }
+
+
+class HttpClient:
+    """带连接池、并发上限、重试和耗时统计的 HTTP 客户端，可以在多个线程间共享"""
+
+    def __init__(self, pool_size=10, max_per_host=4, retries=2, backoff=0.5, max_backoff=10.0,
+                 retry_statuses=RETRY_STATUSES, log=print):
+        """
+        Args:
+            pool_size: 每个主机保持的空闲连接数
+            max_per_host: 每个主机同时进行的请求数上限
+            retries: 失败后最多重试的次数
+            backoff: 第一次重试前的等待时间上限（秒），之后每次翻倍
+            max_backoff: 重试等待时间的上限（秒）
+            retry_statuses: 需要重试的响应状态码
+            log: 日志输出函数
+        """
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.log = log
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._stats = {}
+
+    def _host_state(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+                self._stats[host] = HostStats()
+            return self._semaphores[host], self._stats[host]
+
+    def _retry_delay(self, attempt, response=None):
+        # 完全抖动：在 [0, 上限] 内随机等待，避免多个客户端同时重试
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(self.max_backoff, int(retry_after)))
+        return delay
+
+    @staticmethod
+    def _replayable(kwargs):
+        data = kwargs.get('data')
+        return data is None or isinstance(data, (bytes, str, dict, list, tuple))
+
+    def request(self, method, url, retry=None, **kwargs):
+        """
+        发送请求，参数与 requests.request 相同
+
+        Args:
+            retry: 是否在失败时重试；None 表示只对幂等方法且请求体可重放时重试
+
+        Returns:
+            requests.Response；重试用尽后返回最后一次的响应，或抛出最后一次的异常
+        """
+        method = method.upper()
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+        retry = retry and self._replayable(kwargs)
+        attempts = 1 + (self.retries if retry else 0)
+
+        host = urlsplit(url).netloc
+        semaphore, stats = self._host_state(host)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            start = time.perf_counter()
+            response = None
+            with semaphore:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    HTTP_CLIENT_SECONDS.observe(elapsed_ms / 1000, host=host, method=method, status="error")
+                    with self._lock:
+                        stats.record(elapsed_ms, error=True)
+                    if last_attempt:
+                        raise
+                    error = e
+                else:
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    HTTP_CLIENT_SECONDS.observe(elapsed_ms / 1000, host=host, method=method,
+                                                status=response.status_code)
+                    failed = response.status_code >= 500 or response.status_code in self.retry_statuses
+                    with self._lock:
+                        stats.record(elapsed_ms, error=failed)
+                    if last_attempt or response.status_code not in self.retry_statuses:
+                        return response
+                    error = f"状态码 {response.status_code}"
+
+            delay = self._retry_delay(attempt, response)
+            with self._lock:
+                stats.retries += 1
+            HTTP_CLIENT_RETRIES.inc(host=host)
+            self.log(f"请求 {method} {url} 失败（{error}），{delay:.2f}秒后第 {attempt + 1} 次重试")
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """按主机返回请求统计"""
+        with self._lock:
+            return {host: stats.summary() for host, stats in self._stats.items()}
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def default_client():
+    """进程内共享的默认客户端"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
@@ -0,0 +1,272 @@
+"""
+持久化的后台任务队列
+
+remote_backend 生成可视化图表需要数十秒，不能在请求中同步完成：请求只把任务写入队列并返回任务编号，
+由后台工作线程依次处理，GET /jobs/<id> 查询状态。
+
+任务保存在 SQLite 数据库（WAL 模式）中，进程重启后未完成的任务继续处理：
+    queued   等待处理
+    running  正在处理；进程意外退出后重启时重新放回队列（工作已经完成的直接标记为 done），
+             超过 max_attempts 次则标记为 failed
+    done     处理完成，result 为处理函数的返回值
+    failed   处理出错，error 为错误信息
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from common.journal import now_text
+from common.metrics import JOB_SECONDS
+from common.storage import DEFAULT_POOL_SIZE, SqliteConnectionPool
+
+# 任务最多尝试的次数（进程在处理中退出也算一次），避免一个导致进程崩溃的任务反复执行
+DEFAULT_MAX_ATTEMPTS = 3
+# 工作线程没有任务时检查队列的间隔（秒）；同一进程内提交任务时会立即唤醒
+POLL_INTERVAL = 2.0
+
+
+class JobNotFound(KeyError):
+    """任务编号不存在"""
+
+
+def _job_from_row(row):
+    job = dict(row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else None
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+class JobQueue:
+    """保存在 SQLite 中的任务队列，可以在多个线程间共享"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            key TEXT,
+            payload TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            seq INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, seq);
+        CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs(kind, key, status);
+    """
+
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS, timeout=30, log=print,
+                 pool_size=DEFAULT_POOL_SIZE):
+        """
+        Args:
+            path: 数据库文件路径
+            max_attempts: 任务最多尝试的次数
+            timeout: 等待其他进程释放写锁的秒数
+            log: 日志输出函数
+            pool_size: 最多同时打开的连接数
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.log = log
+        self._pool = SqliteConnectionPool(path, timeout=timeout, size=pool_size, row_factory=sqlite3.Row)
+        # 同一进程内提交任务时唤醒等待的工作线程
+        self._available = threading.Condition()
+        with self._pool.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _transaction(self):
+        return self._pool.transaction(write=True)
+
+    def enqueue(self, kind, payload=None, key=None):
+        """
+        提交任务，返回任务记录
+
+        Args:
+            kind: 任务类型
+            payload: 交给处理函数的参数（可以转换为JSON）
+            key: 去重键；同类型、同键的任务还在排队时直接返回那个任务，不重复提交。
+                 同键的任务正在处理时新任务照常排队，但要等那个任务结束后才会被取出（见 claim）
+        """
+        with self._transaction() as conn:
+            if key is not None:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE kind = ? AND key = ? AND status = 'queued' LIMIT 1", (kind, key)
+                ).fetchone()
+                if row is not None:
+                    return _job_from_row(row)
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs").fetchone()[0]
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, key, payload, status, created_at, seq) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, key, json.dumps(payload, ensure_ascii=False), now_text(), seq)
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        with self._available:
+            self._available.notify()
+        return _job_from_row(row)
+
+    def get(self, job_id):
+        """返回任务记录，不存在时抛出 JobNotFound"""
+        with self._pool.connection() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFound(job_id)
+        return _job_from_row(row)
+
+    def claim(self, kinds):
+        """
+        取出最早排队的一个任务并标记为 running，没有任务时返回None
+
+        同类型、同键的任务同时只处理一个：有同键任务正在处理时跳过该任务，
+        避免多个工作线程同时处理同一个文件（例如同时写入相同的图表文件）。
+        """
+        placeholders = ','.join('?' for _ in kinds)
+        with self._transaction() as conn:
+            row = conn.execute(
+                f"SELECT * FROM jobs AS queued WHERE status = 'queued' AND kind IN ({placeholders}) "
+                "AND (key IS NULL OR NOT EXISTS ("
+                "    SELECT 1 FROM jobs AS running WHERE running.kind = queued.kind AND running.key = queued.key "
+                "    AND running.status = 'running')) "
+                "ORDER BY seq LIMIT 1",
+                tuple(kinds)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (now_text(), row['id'])
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+        return _job_from_row(row)
+
+    def finish(self, job_id, result=None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ? WHERE id = ?",
+                (json.dumps(result, ensure_ascii=False), now_text(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (error, now_text(), job_id)
+            )
+
+    def recover(self, completed=None):
+        """
+        进程启动时调用：上次退出时还在处理的任务重新排队，已达到尝试次数上限的标记为 failed
+
+        只应在没有其他进程处理同一队列时调用。
+
+        Args:
+            completed: 可选，completed(任务记录) 在任务的工作其实已经完成时（例如在记入 done 之前退出）
+                       返回结果，这些任务直接标记为 done，不再重新处理；否则返回None
+
+        Returns:
+            (重新排队的任务数, 标记为失败的任务数, 已完成的任务数)
+        """
+        done = 0
+        if completed is not None:
+            with self._pool.connection() as conn:
+                rows = conn.execute("SELECT * FROM jobs WHERE status = 'running'").fetchall()
+            for job in map(_job_from_row, rows):
+                result = completed(job)
+                if result is not None:
+                    self.finish(job['id'], result)
+                    done += 1
+        with self._transaction() as conn:
+            failed = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                "WHERE status = 'running' AND attempts >= ?",
+                (f"处理中断已达 {self.max_attempts} 次", now_text(), self.max_attempts)
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+        return requeued, failed, done
+
+    def counts(self):
+        """各状态的任务数"""
+        with self._pool.connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def wait(self, timeout):
+        """等待同一进程内提交新任务，最多 timeout 秒"""
+        with self._available:
+            self._available.wait(timeout)
+
+    def wake_all(self):
+        """唤醒所有等待的工作线程"""
+        with self._available:
+            self._available.notify_all()
+
+    def close(self):
+        self._pool.close()
+
+
+class JobWorkers:
+    """从队列中取出任务并调用处理函数的后台线程"""
+
+    def __init__(self, queue, handlers, workers=1, name="jobs", log=print):
+        """
+        Args:
+            queue: JobQueue
+            handlers: {任务类型: 处理函数}，处理函数接收 payload，返回值记入任务的 result
+            workers: 工作线程数
+            name: 线程名和指标中使用的队列名
+            log: 日志输出函数
+        """
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.name = name
+        self.log = log
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """通知工作线程退出；正在处理的任务会先完成"""
+        self._stop.set()
+        self.queue.wake_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        kinds = tuple(self.handlers)
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(kinds)
+            except sqlite3.Error as e:
+                self.log(f"读取任务队列失败: {str(e)}")
+                job = None
+            if job is None:
+                self.queue.wait(POLL_INTERVAL)
+                continue
+            self._process(job)
+
+    def _process(self, job):
+        start = time.perf_counter()
+        try:
+            result = self.handlers[job['kind']](job['payload'])
+        except Exception as e:
+            JOB_SECONDS.observe(time.perf_counter() - start, queue=self.name, kind=job['kind'], status="failed")
+            self.log(f"任务 {job['id']}（{job['kind']}）失败: {str(e)}")
+            self.queue.fail(job['id'], str(e))
+            return
+        JOB_SECONDS.observe(time.perf_counter() - start, queue=self.name, kind=job['kind'], status="done")
+        self.queue.finish(job['id'], result)
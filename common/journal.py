@@ -0,0 +1,254 @@
+"""
+追加日志（journal）存储引擎
+
+每次修改只向日志文件追加一行紧凑的 JSON 记录，启动时由快照 + 日志重放恢复状态，
+恢复出的文档交给 PlayerStore 后由 PlayerStore 持有，日志本身不在内存中保留数据。
+压缩时由写入方（JournalPersister）提供与最后一条记录一致的文档写成新快照，
+并导出与原 data.json 完全相同布局的文件，供 UE 客户端和 remote_backend.py 继续使用。
+
+文件布局：
+    data.snapshot.json      快照 {"seq": 最后包含的记录序号, "data": 完整文档}
+    data.journal            当前日志，每行一条记录；写入快照后截断
+    data.journal.<seq>      旧版本压缩时轮转出来的日志段，启动时重放，下次压缩后删除
+"""
+
+import glob
+import json
+import os
+import threading
+from datetime import datetime
+
+from common.player import Player, player_json_default
+
+
+def now_text():
+    """返回与 metadata.last_updated 相同格式的当前时间"""
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _Replay:
+    """启动时把日志记录依次应用到恢复中的文档；出队只推进队首位置，重放结束后一次截掉"""
+
+    def __init__(self, data):
+        self.data = data
+        self.players = list(data['received_data']['players'])
+        self.head = 0
+        self.acked = set(data['received_data']['metadata'].get('acked_numbers', ()))
+
+    def apply(self, record):
+        metadata = self.data['received_data']['metadata']
+        op = record['op']
+        if op == 'add_player':
+            self.players.append(Player.from_dict(record['player']))
+            metadata['total_players'] = metadata.get('total_players', 0) + 1
+        elif op == 'add_players':
+            self.players.extend(Player.from_dict(player) for player in record['players'])
+            metadata['total_players'] = metadata.get('total_players', 0) + len(record['players'])
+        elif op == 'dequeue':
+            count = record['count']
+            if self.acked:
+                self.acked.difference_update(player.get('Number') for player in self.players[self.head:self.head + count])
+            self.head += count
+            metadata['current_number'] = metadata.get('current_number', 0) + count
+        elif op == 'acknowledge':
+            # 已确认、但前面还有未确认玩家而暂时留在队列中的玩家
+            self.acked.update(record['numbers'])
+        elif op == 'set_metadata':
+            metadata.update(record['values'])
+            if 'acked_numbers' in record['values']:
+                self.acked = set(record['values']['acked_numbers'])
+        else:
+            raise ValueError(f"未知的日志操作: {op}")
+
+        # PlayerStore 写入的记录带有同步序号（见 common/sync.py）
+        if 'sequence' in record:
+            metadata['sequence'] = record['sequence']
+        metadata['last_updated'] = record['time']
+        self.data['received_at'] = record['time']
+
+    def finish(self):
+        """返回重放后的文档"""
+        self.data['received_data']['players'] = self.players[self.head:]
+        metadata = self.data['received_data']['metadata']
+        metadata.pop('acked_numbers', None)
+        if self.acked:
+            metadata['acked_numbers'] = sorted(self.acked)
+        return self.data
+
+
+def write_json_atomic(path, data, indent=None):
+    """先写临时文件再原子替换，避免读者看到写了一半的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        if indent is None:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'), default=player_json_default)
+        else:
+            json.dump(data, f, ensure_ascii=False, indent=indent, default=player_json_default)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class PlayerJournal:
+    """基于追加日志的玩家数据存储，只负责记录的追加、重放和压缩"""
+
+    def __init__(self, journal_path, snapshot_path, export_path, initial_data,
+                 compact_threshold=1000, compact_interval=30, fsync=True, log=print):
+        """
+        Args:
+            journal_path: 日志文件路径
+            snapshot_path: 快照文件路径
+            export_path: 导出的 data.json 路径；首次启动时也从这里迁移旧数据
+            initial_data: 返回空文档的函数
+            compact_threshold: 累积多少条未压缩记录后立即压缩
+            compact_interval: 没有新记录多少秒后压缩一次，让导出的 data.json 跟上最新数据
+            fsync: 每次追加后是否 fsync，关闭可换取更低延迟
+            log: 日志输出函数
+        """
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.export_path = export_path
+        self.initial_data = initial_data
+        self.compact_threshold = compact_threshold
+        self.compact_interval = compact_interval
+        self.fsync = fsync
+        self.log = log
+
+        self._lock = threading.Lock()
+        self._closed = False
+        self._journal_file = None
+        self._seq = 0
+        self._snapshot_seq = 0
+
+    # ---------- 启动与恢复 ----------
+
+    def open(self):
+        """恢复状态并打开日志，返回恢复出的文档（由调用方持有，日志不保留副本）"""
+        with self._lock:
+            data, self._snapshot_seq = self._load_base()
+            self._seq = self._snapshot_seq
+            replay = _Replay(data)
+            for segment_path in self._segment_paths():
+                self._replay(segment_path, replay, truncate_torn_tail=False)
+            self._replay(self.journal_path, replay, truncate_torn_tail=True)
+            self._journal_file = open(self.journal_path, 'a', encoding='utf-8')
+            data = replay.finish()
+
+        if not os.path.exists(self.export_path):
+            write_json_atomic(self.export_path, data, indent=4)
+
+        self.log(f"日志存储已恢复：快照序号 {self._snapshot_seq}，当前序号 {self._seq}，"
+                 f"玩家数 {len(data['received_data']['players'])}")
+        return data
+
+    def _load_base(self):
+        """读取快照；没有快照时从旧的 data.json 迁移"""
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            return snapshot['data'], snapshot['seq']
+
+        if os.path.exists(self.export_path):
+            try:
+                with open(self.export_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.log(f"未找到快照，从 {self.export_path} 迁移现有数据")
+                return data, 0
+            except json.JSONDecodeError as e:
+                self.log(f"迁移 {self.export_path} 失败，使用空数据: {str(e)}")
+
+        return self.initial_data(), 0
+
+    def _segment_paths(self):
+        """按序号返回旧版本压缩时轮转出的日志段"""
+        segments = []
+        for path in glob.glob(f"{glob.escape(self.journal_path)}.*"):
+            suffix = path.rsplit('.', 1)[1]
+            if suffix.isdigit():
+                segments.append((int(suffix), path))
+        return [path for _, path in sorted(segments)]
+
+    def _replay(self, path, replay, truncate_torn_tail):
+        """重放一个日志文件中序号大于当前序号的记录"""
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb') as f:
+            offset = 0
+            for raw_line in f:
+                try:
+                    record = json.loads(raw_line.decode('utf-8'))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    # 进程崩溃时最后一行可能只写了一半，丢弃它及之后的内容
+                    self.log(f"日志 {path} 在偏移 {offset} 处存在不完整记录，已忽略")
+                    if truncate_torn_tail:
+                        f.close()
+                        with open(path, 'r+b') as tf:
+                            tf.truncate(offset)
+                    return
+                offset += len(raw_line)
+                if record['seq'] <= self._seq:
+                    continue
+                replay.apply(record)
+                self._seq = record['seq']
+
+    # ---------- 写入 ----------
+
+    def append(self, op, **fields):
+        """追加一条记录，返回该记录"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("日志存储已关闭")
+            record = {"seq": self._seq + 1, "op": op, "time": now_text(), **fields}
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=player_json_default)
+            self._journal_file.write(line + '\n')
+            self._journal_file.flush()
+            if self.fsync:
+                os.fsync(self._journal_file.fileno())
+            self._seq = record['seq']
+        return record
+
+    @property
+    def seq(self):
+        """最后一条已写入记录的序号"""
+        return self._seq
+
+    @property
+    def pending(self):
+        """尚未压缩进快照的记录数"""
+        return self._seq - self._snapshot_seq
+
+    # ---------- 压缩 ----------
+
+    def compact(self, data):
+        """
+        把 data 写成快照并截断日志，同时刷新导出的 data.json
+
+        data 必须正好包含到最后一条已追加记录为止的修改，由唯一的写入方在两次追加之间调用。
+        """
+        with self._lock:
+            if self._seq == self._snapshot_seq:
+                return False
+            seq = self._seq
+            write_json_atomic(self.snapshot_path, {"seq": seq, "data": data})
+            self._snapshot_seq = seq
+            # 截断前崩溃也没有关系：重放时跳过序号不大于快照的记录
+            self._journal_file.close()
+            self._journal_file = open(self.journal_path, 'w', encoding='utf-8')
+        for segment_path in self._segment_paths():
+            os.remove(segment_path)
+
+        write_json_atomic(self.export_path, data, indent=4)
+        return True
+
+    def close(self, data=None):
+        """关闭日志；给出与最后一条记录一致的文档时先做最后一次压缩"""
+        if self._closed:
+            return
+        try:
+            if data is not None:
+                self.compact(data)
+        finally:
+            with self._lock:
+                self._closed = True
+                self._journal_file.close()
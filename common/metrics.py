@@ -0,0 +1,284 @@
+"""
+进程内指标，以 Prometheus 文本格式在 /metrics 输出
+
+    http_requests_total / http_request_duration_seconds / http_request_size_bytes / http_response_size_bytes
+        每个 Flask 应用的每个路由（install_flask_metrics）和 asgi 模式下直接处理的路由
+    lock_wait_seconds                  等待 PlayerStore 写锁和跨进程文件锁的时间
+    storage_operation_duration_seconds 存储读写（journal / json / sqlite）的耗时
+    http_client_request_duration_seconds / http_client_retries_total
+        出站请求（远程服务器、智谱AI）的耗时和重试次数
+    job_duration_seconds               后台任务（如 remote_backend 生成可视化图表）的处理耗时
+
+不依赖 prometheus_client；多个 worker 进程时每个进程各自统计。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# 耗时直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 请求体和响应体大小的分桶（字节）
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+# 后台任务耗时的分桶（秒）
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+# 文本格式的 Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_items(items))
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_items(self, items):
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _render_items(self, items):
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """按分桶累计的分布，输出 _bucket / _sum / _count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 每个分桶的计数（非累计）、总和、次数
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 块的耗时（秒），异常时同样记录"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_items(self, items):
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    """指标集合，同名指标只创建一次"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"指标 {name} 已以不同的类型或标签注册")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """以 Prometheus 文本格式输出全部指标"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的默认指标集合
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "处理的HTTP请求数", ("service", "route", "method", "status"))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP请求处理耗时（秒）", ("service", "route", "method"))
+HTTP_REQUEST_BYTES = REGISTRY.histogram(
+    "http_request_size_bytes", "HTTP请求体大小（字节）", ("service", "route"), buckets=SIZE_BUCKETS)
+HTTP_RESPONSE_BYTES = REGISTRY.histogram(
+    "http_response_size_bytes", "HTTP响应体大小（字节），流式响应不统计", ("service", "route"), buckets=SIZE_BUCKETS)
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "正在处理的HTTP请求数", ("service",))
+LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "lock_wait_seconds", "等待锁的时间（秒）", ("lock",))
+STORAGE_SECONDS = REGISTRY.histogram(
+    "storage_operation_duration_seconds", "存储读写耗时（秒）", ("backend", "operation"))
+HTTP_CLIENT_SECONDS = REGISTRY.histogram(
+    "http_client_request_duration_seconds", "出站HTTP请求耗时（秒），连接失败时 status 为 error",
+    ("host", "method", "status"))
+HTTP_CLIENT_RETRIES = REGISTRY.counter(
+    "http_client_retries_total", "出站HTTP请求的重试次数", ("host",))
+JOB_SECONDS = REGISTRY.histogram(
+    "job_duration_seconds", "后台任务处理耗时（秒）", ("queue", "kind", "status"), buckets=JOB_BUCKETS)
+
+
+class TimedLock:
+    """记录等待时间的 threading.Lock，用法与 Lock 相同"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, lock=self.name)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def install_flask_metrics(app, service):
+    """
+    为 Flask 应用记录每个路由的请求数、耗时和请求/响应大小，并添加 GET /metrics
+
+    路由按 URL 规则（如 /get_player/<int:number>）统计，未匹配的请求记为 <unmatched>。
+    """
+    from flask import Response, g, request
+
+    def route_name():
+        return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(service=service)
+
+    @app.after_request
+    def _record_response_metrics(response):
+        if '_metrics_start' not in g:
+            return response
+        g._metrics_status = response.status_code
+        route = route_name()
+        if request.content_length:
+            HTTP_REQUEST_BYTES.observe(request.content_length, service=service, route=route)
+        if not response.is_streamed and response.content_length is not None:
+            HTTP_RESPONSE_BYTES.observe(response.content_length, service=service, route=route)
+        return response
+
+    @app.teardown_request
+    def _record_request_metrics(exc):
+        # 视图抛出异常时 Flask 不调用 after_request，但总会调用 teardown_request，
+        # 所以在这里减少进行中的请求数并记录耗时，异常的请求记为 500
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        HTTP_IN_FLIGHT.dec(service=service)
+        route = route_name()
+        status = g.pop('_metrics_status', 500)
+        HTTP_REQUESTS.inc(service=service, route=route, method=request.method, status=status)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, service=service, route=route, method=request.method)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus 文本格式的指标"""
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    return app
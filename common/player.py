@@ -0,0 +1,232 @@
+"""
+玩家记录模型
+
+PlayerStore 在内存中保存数万个玩家，原来每个玩家是一个13个键的 dict；
+Player 用 __slots__ 保存同样的字段，对外仍然表现为只读的映射（player['R']、player.get('Number')、
+dict(player) 都可以使用），序列化时按原来的 JSON 键名和顺序输出，data.json、日志和接口格式都不变。
+年龄、智商等固定字段与默认值相同时共用同一个对象，不再每个玩家保存一份。
+
+validate_player_input 一次完成前端提交数据的必填、类型转换和范围检查。
+"""
+
+from collections.abc import Mapping
+
+# (JSON 键名, 属性名)，按 data.json 中的字段顺序
+PLAYER_FIELDS = (
+    ("Player Name", "name"),
+    ("Player Money", "money"),
+    ("Player Age", "age"),
+    ("Player Body State", "body_state"),
+    ("Player Mind State", "mind_state"),
+    ("PlayerIQ", "iq"),
+    ("Player El", "el"),
+    ("R", "r"),
+    ("G", "g"),
+    ("B", "b"),
+    ("Additional Info", "info"),
+    ("Number", "number"),
+    ("Timestamp", "timestamp"),
+)
+_ATTRIBUTES = {key: attribute for key, attribute in PLAYER_FIELDS}
+
+# 游戏生成的玩家中固定不变的字段
+DEFAULT_VALUES = {
+    "Player Age": 18,
+    "Player Mind State": 100,
+    "PlayerIQ": 120,
+    "Player El": 120,
+    "Additional Info": "游戏生成的玩家数据",
+}
+
+# 玩家名称的最大长度
+MAX_NAME_LENGTH = 100
+# 资金上限
+MAX_MONEY = 10 ** 12
+
+# 记录中没有该字段（从旧数据读入的记录可能缺少部分字段）
+_MISSING = object()
+
+
+class Player(Mapping):
+    """一个玩家的只读记录"""
+
+    __slots__ = tuple(attribute for _, attribute in PLAYER_FIELDS) + ('extra',)
+
+    @classmethod
+    def new(cls, number, name, money, body_state, r, g, b, timestamp):
+        """按游戏的规则构建新玩家，固定字段使用默认值"""
+        player = cls.__new__(cls)
+        player.name = name
+        player.money = money
+        player.age = DEFAULT_VALUES["Player Age"]
+        player.body_state = body_state
+        player.mind_state = DEFAULT_VALUES["Player Mind State"]
+        player.iq = DEFAULT_VALUES["PlayerIQ"]
+        player.el = DEFAULT_VALUES["Player El"]
+        player.r = r
+        player.g = g
+        player.b = b
+        player.info = DEFAULT_VALUES["Additional Info"]
+        player.number = number
+        player.timestamp = timestamp
+        player.extra = None
+        return player
+
+    @classmethod
+    def from_dict(cls, data):
+        """从 JSON 记录构建，缺少的字段保持缺少，未知字段原样保留；已经是 Player 时直接返回"""
+        if isinstance(data, Player):
+            return data
+        player = cls.__new__(cls)
+        for key, attribute in PLAYER_FIELDS:
+            value = data.get(key, _MISSING)
+            default = DEFAULT_VALUES.get(key, _MISSING)
+            if value is not _MISSING and type(value) is type(default) and value == default:
+                value = default
+            setattr(player, attribute, value)
+        extra = {key: value for key, value in data.items() if key not in _ATTRIBUTES}
+        player.extra = extra or None
+        return player
+
+    def to_dict(self):
+        """转换为 data.json 中的记录格式"""
+        data = {}
+        for key, attribute in PLAYER_FIELDS:
+            value = getattr(self, attribute)
+            if value is not _MISSING:
+                data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, key):
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is None:
+            if self.extra and key in self.extra:
+                return self.extra[key]
+            raise KeyError(key)
+        value = getattr(self, attribute)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key, attribute in PLAYER_FIELDS:
+            if getattr(self, attribute) is not _MISSING:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        count = sum(1 for _, attribute in PLAYER_FIELDS if getattr(self, attribute) is not _MISSING)
+        return count + (len(self.extra) if self.extra else 0)
+
+    def __repr__(self):
+        return f"Player({self.to_dict()!r})"
+
+
+def player_json_default(value):
+    """json.dumps 的 default 参数：把 Player 转换为原来的字典格式"""
+    if isinstance(value, Player):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def compact_players(players):
+    """把玩家列表中的字典原地替换为 Player"""
+    for i, player in enumerate(players):
+        if not isinstance(player, Player):
+            players[i] = Player.from_dict(player)
+    return players
+
+
+def install_flask_json(app):
+    """让 Flask 的 jsonify 可以直接输出 Player"""
+    provider = getattr(app, 'json', None)
+    if provider is not None and hasattr(provider, 'default'):
+        # Flask 2.2 及以上：JSON provider 的 default
+        fallback = provider.default
+        provider.default = lambda value: value.to_dict() if isinstance(value, Player) else fallback(value)
+    else:
+        base_encoder = app.json_encoder
+
+        class PlayerJSONEncoder(base_encoder):
+            def default(self, value):
+                if isinstance(value, Player):
+                    return value.to_dict()
+                return super().default(value)
+
+        app.json_encoder = PlayerJSONEncoder
+
+
+# ---------- 前端提交数据的校验 ----------
+
+class PlayerValidationError(ValueError):
+    """提交的玩家数据缺少字段或取值无效"""
+
+
+def _integer(key, minimum, maximum):
+    def check(value):
+        if isinstance(value, bool):
+            raise PlayerValidationError(f"Field {key} must be an integer")
+        if isinstance(value, str):
+            try:
+                value = float(value.strip())
+            except ValueError:
+                raise PlayerValidationError(f"Field {key} must be an integer") from None
+        if isinstance(value, float):
+            if not value.is_integer():
+                raise PlayerValidationError(f"Field {key} must be an integer")
+            value = int(value)
+        if not isinstance(value, int):
+            raise PlayerValidationError(f"Field {key} must be an integer")
+        if not minimum <= value <= maximum:
+            raise PlayerValidationError(f"Field {key} must be between {minimum} and {maximum}")
+        return value
+    return check
+
+
+def _text(key, max_length):
+    def check(value):
+        if isinstance(value, (dict, list)) or value is None:
+            raise PlayerValidationError(f"Field {key} must be a string")
+        value = str(value).strip()
+        if len(value) > max_length:
+            raise PlayerValidationError(f"Field {key} must be at most {max_length} characters")
+        return value
+    return check
+
+
+def _compile_validator(schema):
+    """把 (键名, 检查函数) 列表编译为一个校验函数，按顺序一次检查并转换所有字段"""
+    checks = tuple(schema)
+
+    def validate(data):
+        if not isinstance(data, dict):
+            raise PlayerValidationError("Player data must be a JSON object")
+        values = {}
+        for key, check in checks:
+            if key not in data:
+                raise PlayerValidationError(f"Missing required field: {key}")
+            values[key] = check(data[key])
+        return values
+
+    return validate
+
+
+validate_player_input = _compile_validator((
+    ("R", _integer("R", 0, 255)),
+    ("G", _integer("G", 0, 255)),
+    ("B", _integer("B", 0, 255)),
+    ("Player Money", _integer("Player Money", 0, MAX_MONEY)),
+    ("Player Body State", _integer("Player Body State", 0, 100)),
+    ("Player Name", _text("Player Name", MAX_NAME_LENGTH)),
+))
+validate_player_input.__doc__ = """
+校验并转换前端提交的玩家数据
+
+Returns:
+    {键名: 转换后的值}，只包含 R、G、B、Player Money、Player Body State、Player Name
+Raises:
+    PlayerValidationError: 缺少字段、类型错误或超出范围
+"""
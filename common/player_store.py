@@ -0,0 +1,778 @@
+"""
+内存中的权威玩家数据存储
+
+玩家列表和元数据常驻内存，作为唯一的数据来源；写入方在写锁内生成新的只读快照并发布，
+读取方直接拿当前快照，无需加锁也不会被写入阻塞；落盘由后台线程异步完成。
+
+玩家列表只会在尾部追加、从头部出队，因此快照只记录共享列表上的 [start, end) 窗口，
+发布新快照不需要复制整个列表。
+
+UE 取样分为领取（claim）和确认（ack）两步：领取只在内存中登记一个带过期时间的租约，
+确认后才真正出队并持久化；租约过期未确认的玩家退回队列，下次领取时优先发出。
+租约不落盘，进程重启后所有未确认的玩家都回到队列中（至少送达一次）。
+前面还有未确认玩家时，已确认的玩家暂时留在队列中，每次确认只把新增的编号作为一条 acknowledge 修改写入，
+持久化的元数据 acked_numbers 中包含全部这样的编号，重启后不会再次发出。
+
+多个进程共用一份数据时使用 SharedPlayerStore：数据以 SQLite 数据库为准，
+编号分配、取样租约和修改日志都在数据库事务中完成，每个进程只缓存按修改日志追赶的快照。
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from types import MappingProxyType
+
+from common.journal import now_text, write_json_atomic
+from common.metrics import STORAGE_SECONDS, TimedLock
+from common.player import Player, compact_players
+from common.sync import new_sync_id
+
+
+class StoreSnapshot:
+    """某一时刻的只读数据视图，发布后不再改变"""
+
+    __slots__ = ('_players', '_start', '_end', '_acked', 'metadata', 'header', 'version')
+
+    def __init__(self, players, start, end, metadata, header, version, acked=((), 0, 0)):
+        self._players = players
+        self._start = start
+        self._end = end
+        # (已确认位置列表, 快照包含的长度, 位置到列表下标的偏移)；列表只在尾部追加，快照只读取前一段
+        self._acked = acked
+        self.metadata = metadata
+        self.header = header
+        self.version = version
+
+    @property
+    def player_count(self):
+        """快照中的玩家数量"""
+        return self._end - self._start
+
+    def players(self, start=0, stop=None):
+        """返回玩家列表（或其中一段）的副本，玩家记录本身为共享对象，不应修改"""
+        count = self.player_count
+        stop = count if stop is None else min(stop, count)
+        start = min(max(start, 0), stop)
+        return self._players[self._start + start:self._start + stop]
+
+    def latest_player(self):
+        """返回最后加入的玩家，没有玩家时返回None"""
+        if self._end == self._start:
+            return None
+        return self._players[self._end - 1]
+
+    def index_after_number(self, number):
+        """返回第一个 Number 大于 number 的玩家在快照中的下标（玩家按 Number 递增排列）"""
+        lo, hi = self._start, self._end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._players[mid].get('Number', -1) <= number:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - self._start
+
+    def find_player(self, number):
+        """按 Number 二分查找玩家，不存在时返回None"""
+        index = self._start + self.index_after_number(number - 1)
+        if index < self._end and self._players[index].get('Number') == number:
+            return self._players[index]
+        return None
+
+    def acked_numbers(self):
+        """已确认、但前面还有未确认的玩家而暂时留在队列中的玩家编号"""
+        positions, length, offset = self._acked
+        numbers = []
+        for position in islice(positions, length):
+            index = offset + position
+            # 已经出队的位置不再计入
+            if index >= self._start:
+                numbers.append(self._players[index].get('Number'))
+        return sorted(numbers)
+
+    def persisted_metadata(self):
+        """需要持久化的元数据：在 metadata 之外加上 acked_numbers"""
+        metadata = dict(self.metadata)
+        acked_numbers = self.acked_numbers()
+        if acked_numbers:
+            metadata['acked_numbers'] = acked_numbers
+        return metadata
+
+    def document(self):
+        """返回与 data.json 布局相同的文档"""
+        document = dict(self.header)
+        document['received_data'] = {
+            "players": self.players(),
+            "metadata": self.persisted_metadata()
+        }
+        return document
+
+
+class Lease:
+    """一批已领取、尚未确认的玩家"""
+
+    __slots__ = ('lease_id', 'ranges', 'players', 'expires_at')
+
+    def __init__(self, lease_id, ranges, players, expires_at):
+        self.lease_id = lease_id
+        # 队列中的绝对位置区间 [(a, b), ...]
+        self.ranges = ranges
+        self.players = players
+        self.expires_at = expires_at
+
+
+class JsonFilePersister:
+    """把完整文档重写到 data.json；多次修改合并为一次写入"""
+
+    name = "json"
+
+    def __init__(self, path, initial_data, log=print):
+        self.path = path
+        self.initial_data = initial_data
+        self.log = log
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self.initial_data()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            self.log(f"JSON解析错误: {str(e)}")
+            return self.initial_data()
+
+    def write(self, changes, snapshot):
+        write_json_atomic(self.path, snapshot.document(), indent=4)
+
+    def close(self):
+        pass
+
+
+class JournalPersister:
+    """
+    把每次修改作为一条记录追加到 PlayerJournal
+
+    日志不保留数据，压缩时使用 PlayerStore 的快照：快照版本等于最后写入的修改时，
+    快照正好对应日志的最后一条记录。未压缩的记录达到 compact_threshold 时立即压缩，
+    空闲 compact_interval 秒后再压缩一次，让导出的 data.json 跟上最新数据。
+    """
+
+    name = "journal"
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.idle_interval = journal.compact_interval
+        self._snapshot = None
+
+    def load(self):
+        return self.journal.open()
+
+    def write(self, changes, snapshot):
+        for _, op, fields in changes:
+            self.journal.append(op, **fields)
+        # 写入期间可能又发布了新快照，它包含还没有写入日志的修改，不能用来压缩
+        self._snapshot = snapshot if snapshot.version == changes[-1][0] else None
+        if self.journal.pending >= self.journal.compact_threshold:
+            self._compact()
+
+    def idle(self):
+        if self.journal.pending:
+            self._compact()
+
+    def _compact(self):
+        if self._snapshot is None:
+            return
+        # 压缩失败不影响已经追加的记录，不能让 PlayerStore 把这批修改当作失败重写一遍
+        try:
+            with STORAGE_SECONDS.time(backend="journal", operation="compact"):
+                if self.journal.compact(self._snapshot.document()):
+                    self.journal.log(f"日志已压缩为快照，序号 {self.journal.seq}")
+        except Exception as e:
+            self.journal.log(f"压缩日志时发生错误: {str(e)}")
+
+    def close(self):
+        self.journal.close(self._snapshot.document() if self._snapshot is not None else None)
+
+
+class StoragePersister:
+    """通过 common.storage 中的存储后端持久化，一批修改在一次写入中完成"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.name = storage.name
+
+    def load(self):
+        return self.storage.read_document()
+
+    def write(self, changes, snapshot):
+        self.storage.apply_changes(changes, snapshot.persisted_metadata(), dict(snapshot.header))
+
+    def close(self):
+        self.storage.close()
+
+
+class PlayerStore:
+    """内存权威存储：写入发布新快照，后台线程负责持久化"""
+
+    def __init__(self, persister, log=print, retry_interval=1.0, change_log_size=10000):
+        """
+        Args:
+            persister: 持久化后端，提供 load()/write(changes, snapshot)/close()，可选 idle_interval 和 idle()
+            log: 日志输出函数
+            retry_interval: 持久化失败后的重试间隔（秒）
+            change_log_size: 内存中保留多少条最近的修改用于增量同步
+        """
+        self.persister = persister
+        self.log = log
+        self.retry_interval = retry_interval
+        # 每次启动不同，与快照版本号一起用于生成 ETag，避免重启后版本号重复
+        self.instance_id = uuid.uuid4().hex[:8]
+
+        self._write_lock = TimedLock("player_store")
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._persisted_version = 0
+        self._stopping = False
+        self._thread = None
+
+        self._players = []
+        self._start = 0
+        self._metadata = {}
+        self._header = {}
+        self._version = 0
+        self._snapshot = None
+        self._listeners = []
+        # 取样租约，队列位置为绝对位置：_head 是队首（已确认出队的玩家数），_next 之后的玩家从未被领取
+        self._head = 0
+        self._next = 0
+        self._free = []          # 租约过期后退回的区间 (a, b)，最小堆
+        self._free_count = 0
+        self._acked = []         # 已确认、但前面还有未确认玩家的区间，最小堆
+        self._acked_count = 0
+        self._acked_positions = []   # 这些区间中的位置，只在尾部追加，供快照计算 acked_numbers
+        self._leases = {}
+        self._expiry = []        # (过期时间, lease_id)，最小堆
+        # 最近的修改 (sequence, op, fields)，序号连续；重启后为空，远程水位落在日志之前时需要完整复制
+        self._change_log = deque(maxlen=change_log_size)
+
+    def open(self):
+        """从持久化后端加载数据并启动后台写入线程"""
+        self._load_document(self.persister.load())
+        self._publish()
+        self._thread = threading.Thread(target=self._persist_loop, name="player-store-writer", daemon=True)
+        self._thread.start()
+        if not self._metadata.get('sync_id'):
+            # 旧数据没有数据集标识，补上后才能进行增量同步
+            with self._write_lock:
+                values = {"sync_id": new_sync_id()}
+                self._metadata.update(values)
+                self._commit('set_metadata', {"values": values})
+        return self
+
+    def _load_document(self, document):
+        received_data = document.get('received_data', {})
+        # 玩家以 Player 保存，占用的内存约为字典的一半以下
+        self._players = compact_players(list(received_data.get('players', [])))
+        self._start = 0
+        self._metadata = dict(received_data.get('metadata', {}))
+        self._header = {key: value for key, value in document.items() if key != 'received_data'}
+        self._head = self._next = self._free_count = self._acked_count = 0
+        self._free, self._acked, self._acked_positions, self._leases, self._expiry = [], [], [], {}, []
+        # 快照的元数据不包含 acked_numbers，持久化时由 StoreSnapshot.persisted_metadata 加上
+        acked_numbers = set(self._metadata.pop('acked_numbers', ()))
+        if acked_numbers:
+            self._restore_acked(acked_numbers)
+
+    def _restore_acked(self, acked_numbers):
+        """把上次已确认、但还没有出队的玩家恢复为已确认区间，它们之前的玩家作为退回的区间重新发出"""
+        position = 0
+        for i, player in enumerate(self._players):
+            if player.get('Number') not in acked_numbers:
+                continue
+            if position < i:
+                heapq.heappush(self._free, (position, i))
+                self._free_count += i - position
+            if self._acked and self._acked[-1][1] == i:
+                self._acked[-1] = (self._acked[-1][0], i + 1)
+            else:
+                self._acked.append((i, i + 1))
+            self._acked_positions.append(i)
+            self._acked_count += 1
+            position = i + 1
+        self._next = position
+
+    def _publish(self):
+        self._snapshot = StoreSnapshot(
+            self._players,
+            self._start,
+            len(self._players),
+            MappingProxyType(dict(self._metadata)),
+            MappingProxyType(dict(self._header)),
+            self._version,
+            (self._acked_positions, len(self._acked_positions), self._start - self._head)
+        )
+
+    def _touch(self):
+        timestamp = now_text()
+        self._metadata['last_updated'] = timestamp
+        self._header['received_at'] = timestamp
+
+    def _commit(self, op, fields):
+        """分配同步序号，发布新快照并把修改交给后台线程（调用方需持有写锁）"""
+        sequence = self._metadata.get('sequence', 0) + 1
+        self._metadata['sequence'] = sequence
+        fields = dict(fields, sequence=sequence)
+        self._change_log.append((sequence, op, fields))
+        self._version += 1
+        self._publish()
+        with self._cond:
+            self._pending.append((self._version, op, fields))
+            self._cond.notify_all()
+        for listener in self._listeners:
+            try:
+                listener(self._snapshot)
+            except Exception as e:
+                self.log(f"快照监听器出错: {str(e)}")
+
+    def add_listener(self, listener):
+        """注册在每次发布新快照后调用的函数，参数为新快照；函数应当很快返回"""
+        self._listeners.append(listener)
+
+    # ---------- 读取（无锁） ----------
+
+    def snapshot(self):
+        """返回当前快照；快照不可变，读取方无需加锁"""
+        return self._snapshot
+
+    def changes_since(self, sequence):
+        """
+        返回同步序号大于 sequence 的修改，用于增量同步
+
+        Returns:
+            (修改列表, 与之一致的快照)；修改日志已经不包含 sequence 之后的全部修改、
+            或 sequence 超过当前序号时修改列表为None，需要完整复制
+        """
+        with self._write_lock:
+            snapshot = self._snapshot
+            current = self._metadata.get('sequence', 0)
+            if sequence == current:
+                return [], snapshot
+            if sequence > current or not self._change_log or self._change_log[0][0] > sequence + 1:
+                return None, snapshot
+            offset = sequence + 1 - self._change_log[0][0]
+            return list(islice(self._change_log, offset, None)), snapshot
+
+    # ---------- 写入 ----------
+
+    def add_player(self, build_player):
+        """
+        分配编号并追加一个玩家
+
+        Args:
+            build_player: 接收编号、返回完整玩家记录的函数
+
+        Returns:
+            新玩家记录
+        """
+        with self._write_lock:
+            number = self._metadata.get('total_players', 0)
+            player = Player.from_dict(build_player(number))
+            self._players.append(player)
+            self._metadata['total_players'] = number + 1
+            self._touch()
+            self._commit('add_player', {"player": player})
+        return player
+
+    def add_players(self, build_players):
+        """
+        在一次加锁中为一批玩家分配连续的编号并追加，作为一条修改发布和持久化
+
+        Args:
+            build_players: 接收第一个编号、返回按编号排列的完整玩家记录列表的函数
+
+        Returns:
+            新玩家记录列表
+        """
+        with self._write_lock:
+            first_number = self._metadata.get('total_players', 0)
+            players = [Player.from_dict(player) for player in build_players(first_number)]
+            if not players:
+                return players
+            self._players.extend(players)
+            self._metadata['total_players'] = first_number + len(players)
+            self._touch()
+            self._commit('add_players', {"players": players})
+        return players
+
+    def available_count(self):
+        """可以领取的玩家数量（不含租约中的玩家）"""
+        with self._write_lock:
+            self._expire_leases()
+            return len(self._players) - self._start - (self._next - self._head) + self._free_count
+
+    def lease_count(self):
+        """尚未确认的租约数量"""
+        with self._write_lock:
+            self._expire_leases()
+            return len(self._leases)
+
+    def claim(self, count, lease_seconds):
+        """
+        从队首领取最多 count 个玩家，领取的玩家在租约期内不会再发给别人
+
+        Returns:
+            (lease_id, 玩家列表)；没有可领取的玩家时为 (None, [])
+        """
+        with self._write_lock:
+            self._expire_leases()
+            lease = self._claim(count, lease_seconds)
+            if lease is None:
+                return None, []
+            self._leases[lease.lease_id] = lease
+            heapq.heappush(self._expiry, (lease.expires_at, lease.lease_id))
+            return lease.lease_id, lease.players
+
+    def ack(self, lease_id):
+        """
+        确认一个租约：其中的玩家出队并持久化
+
+        Returns:
+            确认的玩家数量；租约不存在或已过期时返回None
+        """
+        with self._write_lock:
+            self._expire_leases()
+            lease = self._leases.pop(lease_id, None)
+            if lease is None:
+                return None
+            self._acknowledge(lease.ranges)
+            return len(lease.players)
+
+    def dequeue(self, count):
+        """从队首取出最多 count 个玩家并立即确认，返回取出的玩家"""
+        with self._write_lock:
+            self._expire_leases()
+            lease = self._claim(count, 0)
+            if lease is None:
+                return []
+            self._acknowledge(lease.ranges)
+            return lease.players
+
+    def _claim(self, count, lease_seconds):
+        # 先发退回的玩家，再从未领取过的位置继续，只访问领取的记录
+        ranges = []
+        remaining = max(0, count)
+        while remaining and self._free:
+            a, b = heapq.heappop(self._free)
+            take = min(remaining, b - a)
+            ranges.append((a, a + take))
+            if a + take < b:
+                heapq.heappush(self._free, (a + take, b))
+            self._free_count -= take
+            remaining -= take
+        end = self._head + len(self._players) - self._start
+        take = min(remaining, end - self._next)
+        if take > 0:
+            ranges.append((self._next, self._next + take))
+            self._next += take
+        if not ranges:
+            return None
+
+        offset = self._start - self._head
+        players = [player for a, b in ranges for player in self._players[offset + a:offset + b]]
+        return Lease(uuid.uuid4().hex, ranges, players, time.monotonic() + lease_seconds)
+
+    def _acknowledge(self, ranges):
+        # 只有队首连续确认的部分才能出队，其余的等前面的租约确认后一起出队
+        for a, b in ranges:
+            heapq.heappush(self._acked, (a, b))
+            self._acked_count += b - a
+        count = 0
+        while self._acked and self._acked[0][0] == self._head + count:
+            a, b = heapq.heappop(self._acked)
+            self._acked_count -= b - a
+            count += b - a
+        if count:
+            self._remove_head(count)
+
+        # 暂时留在队列中的已确认玩家也要持久化，否则重启后会再次发出；只写入这次确认、没有出队的编号
+        offset = self._start - self._head
+        numbers = []
+        for a, b in ranges:
+            if a >= self._head:
+                self._acked_positions.extend(range(a, b))
+                numbers.extend(player.get('Number') for player in self._players[offset + a:offset + b])
+        if numbers:
+            self._commit('acknowledge', {"numbers": numbers})
+
+        # 已出队的位置由快照跳过；列表中大部分位置已经出队时换一个新列表，旧快照仍引用旧列表
+        if not self._acked:
+            self._acked_positions = []
+        elif len(self._acked_positions) > 2 * self._acked_count:
+            self._acked_positions = [position for position in self._acked_positions if position >= self._head]
+
+    def _expire_leases(self):
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, lease_id = heapq.heappop(self._expiry)
+            lease = self._leases.pop(lease_id, None)
+            if lease is None:
+                continue
+            for a, b in lease.ranges:
+                heapq.heappush(self._free, (a, b))
+                self._free_count += b - a
+            self.log(f"取样租约 {lease_id} 已过期，{len(lease.players)} 个玩家退回队列")
+
+    def _remove_head(self, count):
+        """从队首移除 count 个玩家并推进 current_number（调用方需持有写锁）"""
+        self._start += count
+        self._head += count
+        # 头部空出的部分超过一半时换一个紧凑的新列表，旧快照仍引用旧列表
+        if self._start * 2 > len(self._players):
+            self._players = self._players[self._start:]
+            self._start = 0
+        self._metadata['current_number'] = self._metadata.get('current_number', 0) + count
+        self._touch()
+        self._commit('dequeue', {"count": count})
+
+    # ---------- 持久化 ----------
+
+    def _persist_loop(self):
+        # 持久化后端可以提供 idle()，没有新修改超过 idle_interval 秒时调用（例如压缩日志）
+        idle_interval = getattr(self.persister, 'idle_interval', None)
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._pending or self._stopping, idle_interval):
+                    changes = None
+                elif not self._pending:
+                    return
+                else:
+                    changes = list(self._pending)
+                    self._pending.clear()
+                    snapshot = self._snapshot
+
+            if changes is None:
+                try:
+                    self.persister.idle()
+                except Exception as e:
+                    self.log(f"持久化后端空闲处理失败: {str(e)}")
+                continue
+
+            try:
+                with STORAGE_SECONDS.time(backend=self.persister.name, operation="persist"):
+                    self.persister.write(changes, snapshot)
+            except Exception as e:
+                if self._stopping:
+                    self.log(f"关闭时持久化玩家数据失败，放弃剩余 {len(changes)} 条修改: {str(e)}")
+                    return
+                self.log(f"持久化玩家数据失败，{self.retry_interval}秒后重试: {str(e)}")
+                with self._cond:
+                    self._pending.extendleft(reversed(changes))
+                    self._cond.wait(self.retry_interval)
+                continue
+
+            with self._cond:
+                self._persisted_version = changes[-1][0]
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """等待当前为止的所有修改写入磁盘，返回是否在超时前完成"""
+        with self._cond:
+            target = self._version
+            return self._cond.wait_for(lambda: self._persisted_version >= target, timeout)
+
+    def close(self):
+        """写完剩余修改后停止后台线程并关闭持久化后端"""
+        with self._cond:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.persister.close()
+
+
+class SharedPlayerStore:
+    """
+    多进程共享的玩家存储，接口与 PlayerStore 相同
+
+    写入直接在 SqliteStorage 的写事务中完成，编号由数据库原子分配，多个进程不会重复；
+    读取前按数据库中的修改日志把本进程的缓存快照追到最新，只应用新增的修改。
+    后台线程定期检查其他进程的修改，并通知监听器（例如队列状态推送）。
+    """
+
+    def __init__(self, storage, log=print, poll_interval=0.5, change_log_size=10000):
+        """
+        Args:
+            storage: common.storage.SqliteStorage
+            log: 日志输出函数
+            poll_interval: 检查其他进程修改的间隔（秒）
+            change_log_size: 数据库中保留多少条最近的修改用于追赶快照和增量同步
+        """
+        self.storage = storage
+        self.log = log
+        self.poll_interval = poll_interval
+        self.change_log_size = change_log_size
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._players = []
+        self._start = 0
+        self._sequence = None
+        self._snapshot = None
+        self._listeners = []
+
+    @property
+    def instance_id(self):
+        """与快照版本号（同步序号）一起生成 ETag；各进程相同，重建数据集后改变"""
+        return (self._snapshot.metadata.get('sync_id') or "")[:8]
+
+    def open(self):
+        """加载数据并启动检查其他进程修改的后台线程"""
+        self.storage.ensure_sync_id(self.change_log_size)
+        with self._lock:
+            self._reload()
+        self._thread = threading.Thread(target=self._poll_loop, name="player-store-poll", daemon=True)
+        self._thread.start()
+        return self
+
+    def _reload(self):
+        document = self.storage.read_document()
+        received_data = document.get('received_data', {})
+        self._players = compact_players(list(received_data.get('players', [])))
+        self._start = 0
+        self._publish(
+            dict(received_data.get('metadata', {})),
+            {key: value for key, value in document.items() if key != 'received_data'}
+        )
+
+    def _publish(self, metadata, header):
+        self._sequence = metadata.get('sequence', 0)
+        self._snapshot = StoreSnapshot(
+            self._players,
+            self._start,
+            len(self._players),
+            MappingProxyType(metadata),
+            MappingProxyType(header),
+            self._sequence
+        )
+
+    def _refresh(self):
+        """把缓存追到数据库的最新状态，返回是否有变化"""
+        with self._lock:
+            changes, metadata, header = self.storage.read_changes(self._sequence)
+            if changes == []:
+                return False
+            if changes is None or any(op not in ('add_player', 'add_players', 'dequeue') for _, op, _ in changes):
+                self._reload()
+            else:
+                for _, op, fields in changes:
+                    if op == 'add_player':
+                        self._players.append(Player.from_dict(fields['player']))
+                    elif op == 'add_players':
+                        self._players.extend(Player.from_dict(player) for player in fields['players'])
+                    else:
+                        self._start += fields['count']
+                # 与 PlayerStore 相同：头部空出的部分超过一半时换一个紧凑的新列表
+                if self._start * 2 > len(self._players):
+                    self._players = self._players[self._start:]
+                    self._start = 0
+                self._publish(metadata, header)
+            snapshot = self._snapshot
+
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                self.log(f"快照监听器出错: {str(e)}")
+        return True
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._refresh()
+            except Exception as e:
+                self.log(f"检查玩家数据更新失败: {str(e)}")
+
+    def add_listener(self, listener):
+        """注册在快照变化后调用的函数，参数为新快照；其他进程的修改也会触发"""
+        self._listeners.append(listener)
+
+    # ---------- 读取 ----------
+
+    def snapshot(self):
+        """返回与数据库一致的最新快照"""
+        self._refresh()
+        return self._snapshot
+
+    def changes_since(self, sequence):
+        """与 PlayerStore.changes_since 相同，修改从数据库的修改日志读取"""
+        snapshot = self.snapshot()
+        if sequence == snapshot.version:
+            return [], snapshot
+        changes, metadata, _ = self.storage.read_changes(sequence)
+        if changes is None:
+            return None, snapshot
+        # 读取期间其他进程可能又有修改，只返回到快照为止的部分
+        changes = [change for change in changes if change[0] <= snapshot.version]
+        if not changes or changes[-1][0] != snapshot.version:
+            return None, snapshot
+        return changes, snapshot
+
+    def available_count(self):
+        """可以领取的玩家数量（不含租约中的玩家）"""
+        return max(0, self.snapshot().player_count - self.storage.unavailable_count())
+
+    def lease_count(self):
+        """尚未确认的租约数量"""
+        return self.storage.lease_count()
+
+    # ---------- 写入 ----------
+
+    def add_player(self, build_player):
+        """分配编号并追加一个玩家，返回新玩家记录"""
+        player = self.storage.add_player(build_player, self.change_log_size)
+        self._refresh()
+        return player
+
+    def add_players(self, build_players):
+        """在一个数据库事务中为一批玩家分配连续的编号并追加，返回新玩家记录列表"""
+        players = self.storage.add_players(build_players, self.change_log_size)
+        if players:
+            self._refresh()
+        return players
+
+    def claim(self, count, lease_seconds):
+        """领取最多 count 个玩家，返回 (lease_id, 玩家列表)；租约保存在数据库中，任一进程都可以确认"""
+        return self.storage.claim_players(count, lease_seconds)
+
+    def ack(self, lease_id):
+        """确认一个租约，返回确认的玩家数量；租约不存在或已过期时返回None"""
+        acked = self.storage.ack_players(lease_id, self.change_log_size)
+        if acked is not None:
+            self._refresh()
+        return acked
+
+    def dequeue(self, count):
+        """从队首取出最多 count 个玩家并立即确认，返回取出的玩家"""
+        players = self.storage.dequeue_players(count, self.change_log_size)
+        if players:
+            self._refresh()
+        return players
+
+    def flush(self, timeout=None):
+        """写入在事务提交时已经落盘"""
+        return True
+
+    def close(self):
+        """停止后台线程并关闭数据库连接"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.storage.close()
@@ -0,0 +1,249 @@
+"""
+可断点续传的分块上传
+
+较大的模拟输出文件（长时间游戏产生的 txt 日志、csv 轨迹）按固定大小分块上传，
+中断后从服务器已经收到的位置继续，不必从头重传：
+
+    POST /uploads                      {"filename", "size", "sha256"} → {"upload_id", "offset", "chunk_size"}
+    GET  /uploads/<upload_id>          → {"offset", "size", "complete"}
+    PUT  /uploads/<upload_id>?offset=N 请求体为一个块（可用 Content-Encoding 压缩），
+                                       X-Chunk-SHA256 为该块解压后内容的 sha256
+
+上传编号由文件名、大小和内容哈希决定，发送端重启后再次创建会话也会得到同一个编号和已收到的位置。
+块写入前先校验哈希，全部收到后再校验整个文件的哈希，才移动到接收目录。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from common.file_manifest import file_sha256
+from common.journal import now_text, write_json_atomic
+from common.transfer import compress_bytes, safe_filename
+
+# 默认块大小
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# 服务器接受的最大块大小，限制单个请求占用的内存
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+# 块内容哈希的请求头
+CHUNK_SHA256_HEADER = "X-Chunk-SHA256"
+
+
+class UploadSessionNotFound(KeyError):
+    """上传会话不存在（已完成、已过期或从未创建）"""
+
+
+class OffsetMismatch(ValueError):
+    """块的起始位置与服务器已收到的位置不一致"""
+
+    def __init__(self, offset):
+        super().__init__(f"服务器已收到 {offset} 字节")
+        self.offset = offset
+
+
+class ChecksumMismatch(ValueError):
+    """块或整个文件的内容哈希校验失败"""
+
+
+def upload_id_for(filename, size, sha256):
+    """同一文件（文件名、大小、内容哈希都相同）总是得到同一个上传编号"""
+    return hashlib.sha256(f"{filename}\0{size}\0{sha256}".encode('utf-8')).hexdigest()[:32]
+
+
+class UploadSessions:
+    """服务器端的上传会话，会话信息和已收到的数据都保存在磁盘上，进程重启后仍可续传"""
+
+    def __init__(self, directory, dest_dir, chunk_size=DEFAULT_CHUNK_SIZE, max_chunk_size=MAX_CHUNK_SIZE):
+        """
+        Args:
+            directory: 保存会话信息和未完成数据的目录
+            dest_dir: 上传完成后文件移动到的目录
+            chunk_size: 建议发送端使用的块大小
+            max_chunk_size: 接受的最大块大小
+        """
+        self.directory = directory
+        self.dest_dir = dest_dir
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size
+        self._lock = threading.Lock()
+        # {upload_id: [锁, 正在使用的线程数]}，没有线程使用时删除，会话完成或丢弃后不会一直留在这里
+        self._session_locks = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _paths(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadSessionNotFound(upload_id)
+        base = os.path.join(self.directory, upload_id)
+        return f"{base}.json", f"{base}.part"
+
+    @contextmanager
+    def _session_lock(self, upload_id):
+        """持有一个会话的锁；最后一个使用者离开时在 _lock 下删除这个锁"""
+        with self._lock:
+            entry = self._session_locks.setdefault(upload_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._session_locks[upload_id]
+
+    def _load(self, upload_id):
+        info_path, part_path = self._paths(upload_id)
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            raise UploadSessionNotFound(upload_id)
+        session['offset'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return session
+
+    def _state(self, session, complete=False):
+        return {
+            "upload_id": session['upload_id'],
+            "filename": session['filename'],
+            "size": session['size'],
+            "sha256": session['sha256'],
+            "offset": session['size'] if complete else session['offset'],
+            "chunk_size": self.chunk_size,
+            "complete": complete
+        }
+
+    def open(self, filename, size, sha256):
+        """创建上传会话；同一文件已有会话时返回已收到的位置"""
+        if safe_filename(filename) is None:
+            raise ValueError(f"非法文件名: {filename}")
+        if not isinstance(size, int) or size < 0 or not sha256:
+            raise ValueError("缺少文件大小或内容哈希")
+        upload_id = upload_id_for(filename, size, sha256)
+        with self._session_lock(upload_id):
+            try:
+                return self._state(self._load(upload_id))
+            except UploadSessionNotFound:
+                pass
+            session = {
+                "upload_id": upload_id,
+                "filename": filename,
+                "size": size,
+                "sha256": sha256.lower(),
+                "created_at": now_text()
+            }
+            info_path, part_path = self._paths(upload_id)
+            open(part_path, 'wb').close()
+            write_json_atomic(info_path, session)
+            session['offset'] = 0
+            return self._state(session)
+
+    def status(self, upload_id):
+        """返回会话当前已收到的位置"""
+        return self._state(self._load(upload_id))
+
+    def write_chunk(self, upload_id, offset, data, chunk_sha256=None):
+        """
+        在 offset 处写入一个块
+
+        Returns:
+            会话状态；complete 为 True 时文件已校验并移动到 dest_dir，会话随之删除
+
+        Raises:
+            UploadSessionNotFound / OffsetMismatch / ChecksumMismatch
+        """
+        if len(data) > self.max_chunk_size:
+            raise ValueError(f"块大小 {len(data)} 超过上限 {self.max_chunk_size}")
+        if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256.lower():
+            raise ChecksumMismatch("块内容校验失败")
+
+        with self._session_lock(upload_id):
+            session = self._load(upload_id)
+            if offset != session['offset']:
+                raise OffsetMismatch(session['offset'])
+            if offset + len(data) > session['size']:
+                raise ValueError(f"数据超出文件大小 {session['size']}")
+
+            info_path, part_path = self._paths(upload_id)
+            with open(part_path, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            session['offset'] = offset + len(data)
+            if session['offset'] < session['size']:
+                return self._state(session)
+
+            # 全部收到：校验整个文件后移动到接收目录
+            try:
+                if file_sha256(part_path) != session['sha256']:
+                    raise ChecksumMismatch("文件内容校验失败，需要重新上传")
+                os.makedirs(self.dest_dir, exist_ok=True)
+                os.replace(part_path, os.path.join(self.dest_dir, session['filename']))
+            finally:
+                for path in (info_path, part_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+            return self._state(session, complete=True)
+
+
+def upload_file_resumable(http, base_url, file_path, sha256, encoding=None, level=None,
+                          chunk_size=DEFAULT_CHUNK_SIZE, timeout=30):
+    """
+    分块上传文件，从服务器已收到的位置开始
+
+    Args:
+        http: common.http_client.HttpClient 或 requests.Session
+        base_url: 远程服务器地址
+        file_path: 本地文件路径
+        sha256: 文件内容的 sha256
+        encoding: 块的压缩编码，None 表示不压缩
+        level: 压缩级别
+        chunk_size: 块大小，服务器建议的块大小更小时使用服务器的
+        timeout: 每个请求的超时时间（秒），只影响单个块
+
+    Returns:
+        最后一个请求的 requests.Response（完成时为 200）；服务器不支持分块上传时返回None
+    """
+    size = os.path.getsize(file_path)
+    response = http.post(f"{base_url}/uploads", json={
+        "filename": os.path.basename(file_path),
+        "size": size,
+        "sha256": sha256
+    }, timeout=timeout)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        return response
+
+    session = response.json()
+    upload_url = f"{base_url}/uploads/{session['upload_id']}"
+    chunk_size = min(chunk_size, session.get('chunk_size') or chunk_size)
+    offset = session['offset']
+    if session.get('complete'):
+        return response
+
+    with open(file_path, 'rb') as f:
+        while True:
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+            headers = {
+                "Content-Type": "application/octet-stream",
+                CHUNK_SHA256_HEADER: hashlib.sha256(chunk).hexdigest()
+            }
+            body = chunk
+            if encoding is not None:
+                body = compress_bytes(chunk, encoding, level)
+                headers["Content-Encoding"] = encoding
+            response = http.request("PUT", upload_url, params={"offset": offset}, data=body,
+                                    headers=headers, timeout=timeout)
+            if response.status_code == 409:
+                # 服务器已收到的位置与本地不同（例如上一个块的响应丢失），从服务器的位置继续
+                offset = response.json()['offset']
+                continue
+            if response.status_code != 200:
+                return response
+            state = response.json()
+            if state.get('complete'):
+                return response
+            offset = state['offset']
@@ -0,0 +1,192 @@
+"""
+服务日志
+
+game_backend、remote_backend 和 wechat_bot 的 log_message 都通过这里记录：
+    - 请求线程只把日志记录放进有界队列后立即返回，由后台线程写控制台和文件；队列满时丢弃并计数
+    - 日志文件每行一个 JSON 对象（时间、级别、服务、消息和附加字段），按大小轮转
+    - 多进程时（asgi 的多个工作进程、渲染子进程）每个子进程写自己的 <service>.<pid>.log：
+      轮转只在单个进程内进行，多个进程共用一个文件时轮转会互相覆盖、丢失日志
+    - 控制台保持原来的 "时间 [Client: ip] 消息" 格式
+    - 低于设定级别的日志直接忽略；高频消息可以按键抽样，每 N 条只记录 1 条
+"""
+
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR
+}
+
+
+def is_child_process():
+    """当前进程是否由其他进程启动（multiprocessing 子进程，或开发模式自动重载启动的服务进程）"""
+    return multiprocessing.parent_process() is not None or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+
+
+def log_file_path(log_dir, service, per_process=None):
+    """
+    日志文件路径：主进程为 <service>.log，子进程为 <service>.<pid>.log
+
+    Args:
+        per_process: 是否按进程号分开；None 表示子进程分开
+    """
+    if per_process is None:
+        per_process = is_child_process()
+    if per_process:
+        return os.path.join(log_dir, f"{service}.{os.getpid()}.log")
+    return os.path.join(log_dir, f"{service}.log")
+
+
+class JsonLineFormatter(logging.Formatter):
+    """每条日志一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname.lower(),
+            "service": record.name,
+            "message": record.getMessage()
+        }
+        entry.update((key, value) for key, value in getattr(record, 'fields', {}).items() if value is not None)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """与原来 print 输出相同的格式"""
+
+    def __init__(self, client_field, client_label):
+        super().__init__()
+        self.client_field = client_field
+        self.client_label = client_label
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
+        client = getattr(record, 'fields', {}).get(self.client_field)
+        client_info = f"[{self.client_label}: {client}]" if client else ""
+        level = "" if record.levelno == logging.INFO else f"[{record.levelname}] "
+        return f"{timestamp} {client_info} {level}{record.getMessage()}"
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志而不是阻塞请求线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 同一进程内传递，不需要提前格式化，格式化交给后台线程
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ServiceLogger:
+    """一个服务的日志：有界队列 + 后台写入线程"""
+
+    def __init__(self, service, log_dir=None, level="info", console=True, client_field="client",
+                 client_label="Client", max_bytes=10 * 1024 * 1024, backup_count=5,
+                 sample_rates=None, queue_size=10000, per_process=None):
+        """
+        Args:
+            service: 服务名，也是日志文件名（<service>.log，子进程为 <service>.<pid>.log）
+            log_dir: 日志文件目录，None 表示不写文件
+            level: 记录的最低级别（debug / info / warning / error）
+            console: 是否同时输出到控制台
+            client_field: 控制台格式中显示在方括号里的字段名
+            client_label: 控制台格式中该字段的标签
+            max_bytes: 单个日志文件的大小上限，超过后轮转
+            backup_count: 保留的轮转文件数
+            sample_rates: {抽样键: N}，带该键的日志每 N 条只记录 1 条
+            queue_size: 等待写入的日志条数上限
+            per_process: 是否写入按进程号区分的日志文件，None 表示子进程自动区分
+        """
+        self.logger = logging.getLogger(service)
+        self.logger.setLevel(LEVELS[level])
+        self.logger.propagate = False
+
+        handlers = []
+        if console:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(ConsoleFormatter(client_field, client_label))
+            handlers.append(console_handler)
+        if log_dir is not None:
+            os.makedirs(log_dir, exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file_path(log_dir, service, per_process),
+                maxBytes=max_bytes,
+                backupCount=backup_count,
+                encoding='utf-8',
+                # 第一次写入时才打开文件：以 spawn 方式启动的子进程会重新导入服务模块，不应占用日志文件
+                delay=True
+            )
+            file_handler.setFormatter(JsonLineFormatter())
+            handlers.append(file_handler)
+
+        self._handler = _DroppingQueueHandler(queue.Queue(queue_size))
+        self.logger.handlers = [self._handler]
+        self._listener = logging.handlers.QueueListener(self._handler.queue, *handlers)
+        self._listener.start()
+        self._closed = False
+
+        self.sample_rates = dict(sample_rates or {})
+        self._sample_counts = {}
+        self._sample_lock = threading.Lock()
+
+    def _keep_sample(self, key):
+        rate = self.sample_rates.get(key, 1)
+        if rate <= 1:
+            return True
+        with self._sample_lock:
+            count = self._sample_counts.get(key, 0)
+            self._sample_counts[key] = count + 1
+        return count % rate == 0
+
+    def log(self, message, level="info", sample=None, exc_info=None, **fields):
+        """
+        记录一条日志，只放入队列，不等待写入
+
+        Args:
+            message: 日志内容
+            level: debug / info / warning / error
+            sample: 抽样键，在 sample_rates 中配置了 N 时每 N 条只记录 1 条
+            exc_info: 异常信息，写入 JSON 的 exception 字段
+            fields: 附加字段（如 client），写入 JSON 日志
+        """
+        levelno = LEVELS[level]
+        if not self.logger.isEnabledFor(levelno):
+            return
+        if sample is not None:
+            if not self._keep_sample(sample):
+                return
+            fields['sampled'] = self.sample_rates.get(sample, 1)
+        self.logger.log(levelno, message, exc_info=exc_info, extra={"fields": fields})
+
+    def stats(self):
+        """队列中等待写入的条数和因队列满丢弃的条数"""
+        return {"queued": self._handler.queue.qsize(), "dropped": self._handler.dropped}
+
+    def close(self):
+        """写完队列中剩余的日志后停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
@@ -0,0 +1,281 @@
+"""
+game_backend 的服务方式
+
+    asgi          uvicorn + asyncio 事件循环：长连接（队列状态推送）和简单查询直接在事件循环中处理，
+                  不占用线程；其余 Flask 路由在固定大小的线程池中执行
+    threaded      Werkzeug 多线程服务器（原有方式），每个请求占用一个线程
+    development   Flask 开发服务器，带调试和自动重载
+
+uvicorn 为可选依赖，未安装时 asgi 模式退回 threaded 模式。
+"""
+
+import asyncio
+import json
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from common.metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, HTTP_REQUESTS
+
+try:
+    import uvicorn
+except ImportError:
+    # uvicorn 为可选依赖，未安装时只能使用 threaded 模式
+    uvicorn = None
+
+SERVER_MODES = ("asgi", "threaded", "development")
+# 请求体超过这个大小时转存到临时文件
+MAX_MEMORY_BODY = 1024 * 1024
+
+
+def port_available(host, port):
+    """检查端口是否可以监听"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind((host, port))
+            return True
+        except socket.error:
+            return False
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def send_json(send, body, status=200, headers=()):
+    """在 ASGI 处理函数中发送 JSON 响应"""
+    payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": _encode_headers([
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(payload))),
+            *headers
+        ])
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def wait_disconnect(receive):
+    """等待客户端断开连接"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+class AsgiApp:
+    """
+    把 Flask 应用包装为 ASGI 应用
+
+    用 route() 注册的路径由 async 处理函数 handler(scope, receive, send) 直接处理，
+    其余请求交给 Flask，在线程池中执行，响应逐块送回事件循环。
+    """
+
+    def __init__(self, wsgi_app, threads=64, startup=None, default_headers=(), service=None, log=print):
+        """
+        Args:
+            wsgi_app: Flask 应用
+            threads: 执行 Flask 路由的线程数
+            startup: 服务器开始接受请求前在每个进程中调用一次的初始化函数
+            default_headers: 添加到 async 处理函数响应中的响应头（例如 CORS）
+            service: 服务名，提供时记录 async 处理函数的请求指标（Flask 路由由 Flask 应用自己记录）
+            log: 日志输出函数
+        """
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.startup = startup
+        self.default_headers = tuple(default_headers)
+        self.service = service
+        self.log = log
+        self._routes = {}
+        self._executor = None
+
+    def route(self, path, methods=("GET",)):
+        """注册 async 处理函数的装饰器"""
+        def decorator(handler):
+            for method in methods:
+                self._routes[(method, path)] = handler
+            return handler
+        return decorator
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        handler = self._routes.get((scope['method'], scope['path']))
+        if handler is not None and self.service is not None:
+            await self._call_measured(handler, scope, receive, send)
+        elif handler is not None:
+            await handler(scope, receive, send)
+        else:
+            await self._call_wsgi(scope, receive, send)
+
+    async def _call_measured(self, handler, scope, receive, send):
+        # 长连接（事件推送）的耗时为整个连接的持续时间
+        status = [500]
+
+        async def measured_send(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        route, method = scope['path'], scope['method']
+        HTTP_IN_FLIGHT.inc(service=self.service)
+        start = time.perf_counter()
+        try:
+            await handler(scope, receive, measured_send)
+        finally:
+            HTTP_IN_FLIGHT.dec(service=self.service)
+            HTTP_REQUESTS.inc(service=self.service, route=route, method=method, status=status[0])
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, service=self.service, route=route, method=method)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="wsgi")
+                    if self.startup is not None:
+                        await asyncio.get_running_loop().run_in_executor(self._executor, self.startup)
+                except Exception as e:
+                    self.log(f"服务器初始化失败: {str(e)}")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # ---------- 在线程池中执行 Flask 路由 ----------
+
+    async def _call_wsgi(self, scope, receive, send):
+        body = SpooledTemporaryFile(max_size=MAX_MEMORY_BODY)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="wsgi")
+        try:
+            await loop.run_in_executor(self._executor, self._run_wsgi, scope, body, send, loop)
+        finally:
+            body.close()
+
+    def _run_wsgi(self, scope, body, send, loop):
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start.update({
+                "type": "http.response.start",
+                "status": int(status.split(' ', 1)[0]),
+                "headers": _encode_headers(headers)
+            })
+
+        result = self.wsgi_app(self._build_environ(scope, body), start_response)
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if response_start:
+                    send_sync(response_start)
+                    response_start = None
+                send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+            if response_start:
+                send_sync(response_start)
+            send_sync({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    @staticmethod
+    def _build_environ(scope, body):
+        server_name, server_port = scope.get('server') or ("localhost", 80)
+        client = scope.get('client') or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope['method'],
+            "SCRIPT_NAME": scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            "PATH_INFO": scope['path'].encode('utf-8').decode('latin-1'),
+            "QUERY_STRING": scope.get('query_string', b'').decode('latin-1'),
+            "SERVER_NAME": server_name,
+            "SERVER_PORT": str(server_port),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get('scheme', 'http'),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False
+        }
+        for raw_name, raw_value in scope.get('headers', []):
+            name = raw_name.decode('latin-1').upper().replace('-', '_')
+            value = raw_value.decode('latin-1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                environ[name] = value
+                continue
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+def run_server(app, asgi_app=None, asgi_app_path=None, host='0.0.0.0', port=10001, mode="asgi",
+               workers=1, startup=None, log=print):
+    """
+    按配置启动服务器；端口被占用时直接退出，不再换用其他端口
+
+    Args:
+        app: Flask 应用，threaded 和 development 模式使用
+        asgi_app: AsgiApp，asgi 模式且只有一个进程时使用
+        asgi_app_path: asgi_app 的导入路径（如 "game_backend:asgi_app"），多个进程时由各进程自行导入
+        host, port: 监听地址
+        mode: asgi / threaded / development
+        workers: asgi 模式的进程数
+        startup: threaded 和 development 模式启动前调用的初始化函数；asgi 模式由 AsgiApp 在各进程中调用
+        log: 日志输出函数
+    """
+    if mode not in SERVER_MODES:
+        raise ValueError(f"未知的服务器模式: {mode}")
+    if mode == "asgi" and uvicorn is None:
+        log("未安装 uvicorn，改用 threaded 模式（pip install uvicorn 后可使用 asgi 模式）")
+        mode = "threaded"
+
+    # 开发模式的重载进程会重复监听，不做检查
+    if mode != "development" and not port_available(host, port):
+        log(f"错误: 端口 {port} 已被占用，请关闭占用该端口的程序或使用 --port 指定其他端口")
+        sys.exit(1)
+
+    if mode != "asgi" and startup is not None:
+        startup()
+
+    if mode == "development":
+        log(f"开发模式: 启动服务器，监听端口 {port} (debug=True)")
+        app.run(host=host, port=port, debug=True)
+    elif mode == "threaded":
+        log(f"threaded 模式: 服务器启动，监听端口 {port}")
+        app.run(host=host, port=port, debug=False, threaded=True)
+    else:
+        log(f"asgi 模式: 服务器启动，监听端口 {port}，{workers} 个进程")
+        if workers > 1:
+            uvicorn.run(asgi_app_path, host=host, port=port, workers=workers, log_level="warning")
+        else:
+            uvicorn.run(asgi_app, host=host, port=port, log_level="warning")
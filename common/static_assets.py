@@ -0,0 +1,180 @@
+"""
+静态文件服务
+
+启动时把白名单中的文件读入内存，生成清单：
+    - 每个文件的内容哈希作为强 ETag，请求带 If-None-Match 且一致时返回 304
+    - 文本类文件预先压缩为 gzip（安装了 brotli 时还有 br），按 Accept-Encoding 选择，只在压缩后更小时使用
+    - 页面（HTML）要求每次向服务器确认（no-cache，配合 ETag 得到 304），图片等资源可缓存 max_age 秒
+    - 只提供白名单中的文件名，任何其他路径（包括 ../ 等）一律 404，不访问磁盘
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+# 值得压缩的类型；图片等本身已压缩的格式不再压缩
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+def _compressed_variants(data):
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+def _accepted_encodings(header):
+    """解析 Accept-Encoding，返回 q > 0 的编码集合"""
+    accepted = set()
+    for item in (header or "").split(','):
+        parts = item.strip().split(';')
+        encoding = parts[0].strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(encoding)
+    return accepted
+
+
+def _etag_matches(header, etag):
+    """If-None-Match 是否包含该 ETag（弱比较，允许 W/ 前缀）"""
+    if not header:
+        return False
+    for item in header.split(','):
+        item = item.strip()
+        if item.startswith('W/'):
+            item = item[2:]
+        if item == '*' or item == etag:
+            return True
+    return False
+
+
+class StaticAsset:
+    """一个静态文件在内存中的各个版本"""
+
+    __slots__ = ('filename', 'path', 'mimetype', 'cache_control', 'digest', 'variants', 'mtime', 'size')
+
+    def __init__(self, filename, path, mimetype, cache_control, digest, variants, mtime, size):
+        self.filename = filename
+        self.path = path
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.digest = digest
+        # {编码: 内容}，None 表示未压缩的原始内容
+        self.variants = variants
+        self.mtime = mtime
+        self.size = size
+
+    def etag(self, encoding):
+        """不同编码的内容不同，强 ETag 也不同"""
+        return f'"{self.digest}"' if encoding is None else f'"{self.digest}-{encoding}"'
+
+
+class StaticAssets:
+    """白名单静态文件的内存清单"""
+
+    def __init__(self, base_dir, filenames, max_age=86400, watch=False, log=print):
+        """
+        Args:
+            base_dir: 文件所在目录
+            filenames: 允许提供的文件名（相对 base_dir）
+            max_age: 非 HTML 文件的浏览器缓存时间（秒）
+            watch: 为 True 时每次请求检查文件是否修改并重新加载（开发模式使用）
+            log: 日志输出函数
+        """
+        self.base_dir = base_dir
+        self.max_age = max_age
+        self.watch = watch
+        self.log = log
+        self._assets = {}
+        for filename in filenames:
+            asset = self._load(filename)
+            if asset is not None:
+                self._assets[filename] = asset
+
+    def _load(self, filename):
+        path = os.path.join(self.base_dir, filename)
+        try:
+            stat = os.stat(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            self.log(f"静态文件 {filename} 无法读取，不会提供: {str(e)}")
+            return None
+
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        variants = {None: data}
+        if mimetype.startswith(COMPRESSIBLE_TYPES):
+            variants.update(_compressed_variants(data))
+        if mimetype == "text/html":
+            cache_control = "no-cache"
+        else:
+            cache_control = f"public, max-age={self.max_age}"
+        return StaticAsset(filename, path, mimetype, cache_control, hashlib.sha256(data).hexdigest()[:32],
+                           variants, stat.st_mtime_ns, stat.st_size)
+
+    def _reload_if_changed(self, asset):
+        try:
+            stat = os.stat(asset.path)
+        except OSError:
+            return asset
+        if stat.st_mtime_ns == asset.mtime and stat.st_size == asset.size:
+            return asset
+        reloaded = self._load(asset.filename)
+        if reloaded is None:
+            return asset
+        self._assets[asset.filename] = reloaded
+        return reloaded
+
+    def __contains__(self, filename):
+        return filename in self._assets
+
+    def filenames(self):
+        return list(self._assets)
+
+    def response(self, filename, request):
+        """
+        为 Flask 请求生成响应；文件名不在清单中时返回 None
+
+        Args:
+            filename: 请求的文件名
+            request: flask.request
+        """
+        from flask import Response
+
+        asset = self._assets.get(filename)
+        if asset is None:
+            return None
+        if self.watch:
+            asset = self._reload_if_changed(asset)
+
+        accepted = _accepted_encodings(request.headers.get('Accept-Encoding'))
+        encoding = next((name for name in ("br", "gzip") if name in asset.variants and name in accepted), None)
+        etag = asset.etag(encoding)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding"
+        }
+
+        if _etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status=304, headers=headers)
+
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], mimetype=asset.mimetype, headers=headers)
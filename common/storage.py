@@ -0,0 +1,628 @@
+"""
+可插拔的玩家数据存储
+
+game_backend.py、cloud/remote_backend.py 和 cloud/wechat_bot.py 共用这一套接口：
+    JsonFileStorage   原有的单个 data.json 文档，每次操作读写整个文件；用文件锁保证多个进程不会同时读改写
+    SqliteStorage     SQLite（WAL 模式），玩家表按 Number 建索引，元数据单独一行；
+                      多个进程可以同时读写同一个数据库文件，并且可以作为 SharedPlayerStore 的权威存储
+                      （玩家编号在写事务中原子分配，修改日志和取样租约也保存在数据库中）
+
+两种实现对外都使用 data.json 的文档布局：
+    {"received_data": {"players": [...], "metadata": {...}}, "received_at": ..., "source_server": ...}
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from common.file_lock import FileLock
+from common.journal import now_text, write_json_atomic
+from common.metrics import STORAGE_SECONDS
+from common.player import player_json_default
+from common.sync import check_watermark, new_sync_id
+
+# 连接池默认最多同时打开的连接数；同时访问数据库的线程更多时等待其他线程归还连接
+DEFAULT_POOL_SIZE = 8
+
+
+def _timed(method):
+    """把存储方法的耗时记录到 storage_operation_duration_seconds"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with STORAGE_SECONDS.time(backend=self.name, operation=method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=player_json_default)
+
+
+def _split_document(document):
+    """把文档拆成 (玩家列表, 元数据, 顶层其他字段)"""
+    received_data = document.get('received_data', {})
+    header = {key: value for key, value in document.items() if key != 'received_data'}
+    return list(received_data.get('players', [])), dict(received_data.get('metadata', {})), header
+
+
+def _join_document(players, metadata, header):
+    document = dict(header)
+    document['received_data'] = {"players": players, "metadata": metadata}
+    return document
+
+
+def _renumber(players, start_number):
+    """为合并进来的玩家分配从 start_number 开始的新编号"""
+    for i, player in enumerate(players):
+        player['Number'] = start_number + i
+        player['Timestamp'] = datetime.now().isoformat()
+    return players
+
+
+class SqliteConnectionPool:
+    """
+    SQLite（WAL 模式）连接池，可以在多个线程间共享
+
+    Flask 开发服务器、wechat_bot 等每个请求使用一个新线程，如果每个线程各开一个连接并保留到关闭存储，
+    连接和文件描述符会随请求数不断增加；这里连接用完即归还，最多同时打开 size 个。
+    同一线程嵌套取用时得到同一个连接。
+    """
+
+    def __init__(self, path, timeout=30, size=DEFAULT_POOL_SIZE, row_factory=None):
+        """
+        Args:
+            path: 数据库文件路径
+            timeout: 等待其他进程释放写锁、以及等待空闲连接的秒数
+            size: 最多同时打开的连接数
+            row_factory: 连接的 row_factory，例如 sqlite3.Row
+        """
+        self.path = path
+        self.timeout = timeout
+        self.size = size
+        self.row_factory = row_factory
+        self._idle = []
+        self._opened = 0
+        self._closed = False
+        self._available = threading.Condition()
+        self._local = threading.local()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.timeout
+        with self._available:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError(f"数据库 {self.path} 已关闭")
+                if self._idle:
+                    return self._idle.pop()
+                if self._opened < self.size:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(f"等待数据库连接超时（{self.size} 个连接都在使用中）")
+                self._available.wait(remaining)
+        try:
+            return self._open()
+        except BaseException:
+            with self._available:
+                self._opened -= 1
+                self._available.notify()
+            raise
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            # 调用方没有结束的事务不能留给下一个使用者
+            conn.rollback()
+        with self._available:
+            if self._closed:
+                conn.close()
+                self._opened -= 1
+            else:
+                self._idle.append(conn)
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """取用一个连接，离开 with 块时归还"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self, write=False):
+        """在一个事务中使用连接；写事务一开始就拿写锁，避免多个进程同时升级读锁导致死锁"""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def connection_count(self):
+        """当前打开的连接数（包括空闲的）"""
+        with self._available:
+            return self._opened
+
+    def close(self):
+        """关闭空闲的连接，正在使用的连接归还时关闭"""
+        with self._available:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._opened -= len(self._idle)
+            self._idle = []
+            self._available.notify_all()
+
+
+class DataStorage:
+    """存储接口"""
+
+    def read_document(self):
+        """返回完整文档"""
+        raise NotImplementedError
+
+    def write_document(self, document):
+        """用完整文档替换全部数据"""
+        raise NotImplementedError
+
+    def get_metadata(self):
+        """返回元数据"""
+        raise NotImplementedError
+
+    def apply_changes(self, changes, metadata, header, expected=None):
+        """
+        在一次写入中应用一批修改，并把元数据和顶层字段更新为给定值
+
+        Args:
+            changes: [(version, op, fields), ...]，op 为 add_player / add_players / dequeue，其他操作只更新元数据
+            metadata: 应用后的元数据
+            header: 应用后的顶层字段（received_at、source_server 等）
+            expected: (sync_id, sequence)，提供时在同一次写入中校验当前水位，
+                      不一致则抛出 common.sync.SyncConflict 且不做任何修改
+        """
+        raise NotImplementedError
+
+    def merge_players(self, players, source_server):
+        """
+        把玩家追加到现有数据之后并重新分配编号，返回合并后的玩家总数；
+        合并后的数据与发送端不再一致，因此会清除同步标识，下次同步改为完整复制
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonFileStorage(DataStorage):
+    """单个 JSON 文档存储，用文件锁保证进程内和进程间的读写安全"""
+
+    name = "json"
+
+    def __init__(self, path, initial_data, log=print):
+        self.path = path
+        self.initial_data = initial_data
+        self.log = log
+        # 同时在进程内和进程间互斥，多个进程共用一个 data.json 时不会互相覆盖
+        self.lock = FileLock(f"{path}.lock")
+        with self.lock:
+            if not os.path.exists(self.path):
+                write_json_atomic(self.path, self.initial_data(), indent=4)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            self.log(f"JSON解析错误: {str(e)}")
+            # 如果文件损坏，返回初始化结构
+            return self.initial_data()
+
+    def _write(self, document):
+        write_json_atomic(self.path, document, indent=4)
+
+    @_timed
+    def read_document(self):
+        with self.lock:
+            return self._read()
+
+    @_timed
+    def write_document(self, document):
+        with self.lock:
+            self._write(document)
+
+    @_timed
+    def get_metadata(self):
+        return self.read_document().get('received_data', {}).get('metadata', {})
+
+    @_timed
+    def apply_changes(self, changes, metadata, header, expected=None):
+        with self.lock:
+            players, current_metadata, _ = _split_document(self._read())
+            if expected is not None:
+                check_watermark(current_metadata, *expected)
+            for _, op, fields in changes:
+                if op == 'add_player':
+                    players.append(fields['player'])
+                elif op == 'add_players':
+                    players.extend(fields['players'])
+                elif op == 'dequeue':
+                    del players[:fields['count']]
+            self._write(_join_document(players, metadata, header))
+
+    @_timed
+    def merge_players(self, players, source_server):
+        with self.lock:
+            document = self._read()
+            existing_players = document['received_data']['players']
+            current_max_number = max((player.get('Number', -1) for player in existing_players), default=-1)
+            existing_players.extend(_renumber(players, current_max_number + 1))
+
+            metadata = document['received_data']['metadata']
+            metadata.pop('sync_id', None)
+            metadata['total_players'] = len(existing_players)
+            metadata['last_updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            document['received_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            document['source_server'] = source_server
+            self._write(document)
+            return len(existing_players)
+
+
+class SqliteStorage(DataStorage):
+    """SQLite 存储：players 表按 seq 排队、按 Number 建索引，metadata 表只有一行"""
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            number INTEGER,
+            data TEXT NOT NULL
+        );
+        -- 只用于合并时查询 MAX(number)。其余查询不按 Number 读取单个玩家：
+        -- 微信查询只读取 metadata 这一行，UE 取样按 seq（主键）顺序领取
+        CREATE INDEX IF NOT EXISTS idx_players_number ON players(number);
+        CREATE TABLE IF NOT EXISTS metadata (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            metadata TEXT NOT NULL,
+            header TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            sequence INTEGER PRIMARY KEY,
+            op TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+    """
+    # 取样租约使用的列，旧数据库启动时自动添加
+    LEASE_COLUMNS = (
+        ("lease_id", "TEXT"),
+        ("lease_expires", "REAL"),
+        ("acked", "INTEGER NOT NULL DEFAULT 0")
+    )
+
+    def __init__(self, path, initial_data, legacy_json_path=None, timeout=30, log=print,
+                 pool_size=DEFAULT_POOL_SIZE):
+        """
+        Args:
+            path: 数据库文件路径
+            initial_data: 返回空文档的函数
+            legacy_json_path: 数据库为空时从这个 data.json 导入已有数据
+            timeout: 等待其他进程释放写锁的秒数
+            log: 日志输出函数
+            pool_size: 最多同时打开的连接数
+        """
+        self.path = path
+        self.initial_data = initial_data
+        self.timeout = timeout
+        self.log = log
+        self._pool = SqliteConnectionPool(path, timeout=timeout, size=pool_size)
+        self._initialize(legacy_json_path)
+
+    def _transaction(self, write=False):
+        return self._pool.transaction(write=write)
+
+    def _initialize(self, legacy_json_path):
+        with self._pool.connection() as conn:
+            conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(players)")}
+            for name, definition in self.LEASE_COLUMNS:
+                if name not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE players ADD COLUMN {name} {definition}")
+                    except sqlite3.OperationalError as e:
+                        # 另一个进程刚好先添加了这一列
+                        if "duplicate column" not in str(e):
+                            raise
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_players_lease ON players(lease_id)")
+        with self._transaction(write=True) as conn:
+            if conn.execute("SELECT 1 FROM metadata WHERE id = 1").fetchone():
+                return
+            document = None
+            if legacy_json_path and os.path.exists(legacy_json_path):
+                try:
+                    with open(legacy_json_path, 'r', encoding='utf-8') as f:
+                        document = json.load(f)
+                    self.log(f"数据库为空，从 {legacy_json_path} 导入现有数据")
+                except json.JSONDecodeError as e:
+                    self.log(f"导入 {legacy_json_path} 失败，使用空数据: {str(e)}")
+            self._replace_all(conn, document or self.initial_data())
+
+    # ---------- 事务内的基本操作 ----------
+
+    @staticmethod
+    def _insert_players(conn, players):
+        conn.executemany(
+            "INSERT INTO players (number, data) VALUES (?, ?)",
+            [(player.get('Number'), _dumps(player)) for player in players]
+        )
+
+    @staticmethod
+    def _save_metadata(conn, metadata, header):
+        conn.execute(
+            "INSERT OR REPLACE INTO metadata (id, metadata, header) VALUES (1, ?, ?)",
+            (_dumps(metadata), _dumps(header))
+        )
+
+    def _replace_all(self, conn, document):
+        players, metadata, header = _split_document(document)
+        conn.execute("DELETE FROM players")
+        self._insert_players(conn, players)
+        self._save_metadata(conn, metadata, header)
+
+    @staticmethod
+    def _load_metadata(conn):
+        row = conn.execute("SELECT metadata, header FROM metadata WHERE id = 1").fetchone()
+        if row is None:
+            return {}, {}
+        return json.loads(row[0]), json.loads(row[1])
+
+    # ---------- 接口实现 ----------
+
+    @_timed
+    def read_document(self):
+        with self._transaction() as conn:
+            players = [json.loads(row[0]) for row in conn.execute("SELECT data FROM players ORDER BY seq")]
+            metadata, header = self._load_metadata(conn)
+        return _join_document(players, metadata, header)
+
+    @_timed
+    def write_document(self, document):
+        with self._transaction(write=True) as conn:
+            self._replace_all(conn, document)
+
+    @_timed
+    def get_metadata(self):
+        with self._pool.connection() as conn:
+            return self._load_metadata(conn)[0]
+
+    @_timed
+    def apply_changes(self, changes, metadata, header, expected=None):
+        with self._transaction(write=True) as conn:
+            if expected is not None:
+                check_watermark(self._load_metadata(conn)[0], *expected)
+            for _, op, fields in changes:
+                if op == 'add_player':
+                    self._insert_players(conn, [fields['player']])
+                elif op == 'add_players':
+                    self._insert_players(conn, fields['players'])
+                elif op == 'dequeue':
+                    conn.execute(
+                        "DELETE FROM players WHERE seq IN (SELECT seq FROM players ORDER BY seq LIMIT ?)",
+                        (fields['count'],)
+                    )
+            self._save_metadata(conn, metadata, header)
+
+    @_timed
+    def merge_players(self, players, source_server):
+        with self._transaction(write=True) as conn:
+            current_max_number = conn.execute("SELECT MAX(number) FROM players").fetchone()[0]
+            start_number = (current_max_number if current_max_number is not None else -1) + 1
+            self._insert_players(conn, _renumber(players, start_number))
+            total_players = conn.execute("SELECT COUNT(*) FROM players").fetchone()[0]
+
+            metadata, header = self._load_metadata(conn)
+            metadata.pop('sync_id', None)
+            metadata['total_players'] = total_players
+            metadata['last_updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            header['received_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            header['source_server'] = source_server
+            self._save_metadata(conn, metadata, header)
+        return total_players
+
+    # ---------- 多进程共享的玩家队列（SharedPlayerStore 使用） ----------
+
+    @staticmethod
+    def _record_change(conn, op, fields, metadata, header, change_log_size):
+        """分配同步序号并记录一条修改，同时保存元数据（调用方在写事务中）"""
+        sequence = metadata.get('sequence', 0) + 1
+        metadata['sequence'] = sequence
+        timestamp = now_text()
+        metadata['last_updated'] = timestamp
+        header['received_at'] = timestamp
+        fields = dict(fields, sequence=sequence)
+        conn.execute("INSERT OR REPLACE INTO changes (sequence, op, data) VALUES (?, ?, ?)",
+                     (sequence, op, _dumps(fields)))
+        conn.execute("DELETE FROM changes WHERE sequence <= ?", (sequence - change_log_size,))
+        SqliteStorage._save_metadata(conn, metadata, header)
+        return fields
+
+    @_timed
+    def read_changes(self, sequence):
+        """
+        在同一个读事务中返回同步序号大于 sequence 的修改和当前元数据
+
+        Returns:
+            (修改列表 [(sequence, op, fields), ...], 元数据, 顶层字段)；
+            修改日志已经不包含 sequence 之后的全部修改时修改列表为None
+        """
+        with self._transaction() as conn:
+            metadata, header = self._load_metadata(conn)
+            current = metadata.get('sequence', 0)
+            if sequence == current:
+                return [], metadata, header
+            rows = conn.execute(
+                "SELECT sequence, op, data FROM changes WHERE sequence > ? AND sequence <= ? ORDER BY sequence",
+                (sequence, current)
+            ).fetchall()
+        if sequence > current or not rows or rows[0][0] != sequence + 1 or rows[-1][0] != current:
+            return None, metadata, header
+        return [(row[0], row[1], json.loads(row[2])) for row in rows], metadata, header
+
+    def ensure_sync_id(self, change_log_size):
+        """没有数据集标识时补上（多个进程同时启动时只有一个会写入）"""
+        with self._transaction(write=True) as conn:
+            metadata, header = self._load_metadata(conn)
+            if metadata.get('sync_id'):
+                return
+            values = {"sync_id": new_sync_id()}
+            metadata.update(values)
+            self._record_change(conn, 'set_metadata', {"values": values}, metadata, header, change_log_size)
+
+    @_timed
+    def add_player(self, build_player, change_log_size):
+        """在一个写事务中分配编号（元数据中的 total_players）并追加玩家，多个进程不会分到相同的编号"""
+        with self._transaction(write=True) as conn:
+            metadata, header = self._load_metadata(conn)
+            number = metadata.get('total_players', 0)
+            player = build_player(number)
+            self._insert_players(conn, [player])
+            metadata['total_players'] = number + 1
+            self._record_change(conn, 'add_player', {"player": player}, metadata, header, change_log_size)
+        return player
+
+    @_timed
+    def add_players(self, build_players, change_log_size):
+        """在一个写事务中为一批玩家分配连续的编号并追加，记录为一条修改"""
+        with self._transaction(write=True) as conn:
+            metadata, header = self._load_metadata(conn)
+            first_number = metadata.get('total_players', 0)
+            players = build_players(first_number)
+            if players:
+                self._insert_players(conn, players)
+                metadata['total_players'] = first_number + len(players)
+                self._record_change(conn, 'add_players', {"players": players}, metadata, header, change_log_size)
+        return players
+
+    @staticmethod
+    def _claim(conn, count, lease_seconds):
+        # 按队列顺序跳过租约中和已确认的玩家，只读取领取到的记录
+        now = time.time()
+        rows = conn.execute(
+            "SELECT seq, data FROM players WHERE acked = 0 AND (lease_id IS NULL OR lease_expires <= ?) "
+            "ORDER BY seq LIMIT ?",
+            (now, max(0, count))
+        ).fetchall()
+        if not rows:
+            return None, []
+        lease_id = uuid.uuid4().hex
+        conn.executemany(
+            "UPDATE players SET lease_id = ?, lease_expires = ? WHERE seq = ?",
+            [(lease_id, now + lease_seconds, row[0]) for row in rows]
+        )
+        return lease_id, [json.loads(row[1]) for row in rows]
+
+    def _remove_acked_head(self, conn, change_log_size):
+        # 只有队首连续确认的玩家才出队，保持与 dequeue 操作（从队首移除 count 个）一致
+        cursor = conn.execute("SELECT seq, acked FROM players ORDER BY seq")
+        count, last_seq = 0, None
+        for seq, acked in cursor:
+            if not acked:
+                break
+            count, last_seq = count + 1, seq
+        cursor.close()
+        if count == 0:
+            return
+        conn.execute("DELETE FROM players WHERE seq <= ?", (last_seq,))
+        metadata, header = self._load_metadata(conn)
+        metadata['current_number'] = metadata.get('current_number', 0) + count
+        self._record_change(conn, 'dequeue', {"count": count}, metadata, header, change_log_size)
+
+    @_timed
+    def claim_players(self, count, lease_seconds):
+        """领取最多 count 个玩家，返回 (lease_id, 玩家列表)；没有可领取的玩家时为 (None, [])"""
+        with self._transaction(write=True) as conn:
+            return self._claim(conn, count, lease_seconds)
+
+    @_timed
+    def ack_players(self, lease_id, change_log_size):
+        """确认租约，返回确认的玩家数量；租约不存在或已过期时返回None"""
+        with self._transaction(write=True) as conn:
+            count = conn.execute(
+                "UPDATE players SET acked = 1 WHERE lease_id = ? AND acked = 0 AND lease_expires > ?",
+                (lease_id, time.time())
+            ).rowcount
+            if count == 0:
+                return None
+            self._remove_acked_head(conn, change_log_size)
+        return count
+
+    @_timed
+    def dequeue_players(self, count, change_log_size):
+        """领取并立即确认最多 count 个玩家，返回取出的玩家"""
+        with self._transaction(write=True) as conn:
+            lease_id, players = self._claim(conn, count, 0)
+            if lease_id is None:
+                return []
+            conn.execute("UPDATE players SET acked = 1 WHERE lease_id = ?", (lease_id,))
+            self._remove_acked_head(conn, change_log_size)
+        return players
+
+    def unavailable_count(self):
+        """租约中或已确认但尚未出队的玩家数量"""
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM players WHERE lease_id IS NOT NULL AND (acked = 1 OR lease_expires > ?)",
+                (time.time(),)
+            ).fetchone()
+        return row[0]
+
+    def lease_count(self):
+        """尚未确认且未过期的租约数量"""
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(DISTINCT lease_id) FROM players WHERE lease_id IS NOT NULL AND acked = 0 AND lease_expires > ?",
+                (time.time(),)
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        self._pool.close()
+
+
+def open_storage(backend, data_file, database_file, initial_data, log=print):
+    """
+    按配置打开存储
+
+    Args:
+        backend: "sqlite" 或 "json"
+        data_file: data.json 路径；sqlite 模式下首次启动时从这里导入数据
+        database_file: SQLite 数据库路径
+        initial_data: 返回空文档的函数
+        log: 日志输出函数
+    """
+    if backend == "sqlite":
+        return SqliteStorage(database_file, initial_data, legacy_json_path=data_file, log=log)
+    return JsonFileStorage(data_file, initial_data, log=log)
@@ -0,0 +1,53 @@
+"""
+game_backend 与 remote_backend 之间的增量同步
+
+game_backend 的每次修改都分配一个单调递增的序号，和数据集标识 sync_id 一起记录在 metadata 中：
+    metadata.sync_id     数据集标识；数据被整体替换时重新生成
+    metadata.sequence    最后一次修改的序号
+
+远程服务器把收到的 metadata 原样保存，它的 sequence 就是已经同步到的高水位。
+发送端先通过 GET /sync_state 取得远程的水位，只发送水位之后的修改（transfer_type: delta）；
+远程的 sync_id 不同、水位超出发送端的修改日志，或远程返回 409 时，退回到完整复制（full_copy）。
+"""
+
+import uuid
+
+
+class SyncConflict(Exception):
+    """增量修改的基准与接收端的当前水位不一致"""
+
+    def __init__(self, message, state):
+        super().__init__(message)
+        self.state = state
+
+
+def new_sync_id():
+    """生成新的数据集标识"""
+    return uuid.uuid4().hex
+
+
+def sync_state(metadata):
+    """从元数据中取出同步水位"""
+    return {
+        "sync_id": metadata.get('sync_id'),
+        "sequence": metadata.get('sequence', 0)
+    }
+
+
+def check_watermark(metadata, sync_id, base_sequence):
+    """确认增量修改的基准与当前水位一致，不一致时抛出 SyncConflict"""
+    state = sync_state(metadata)
+    if not sync_id or state['sync_id'] != sync_id:
+        raise SyncConflict(f"数据集不一致: 本地 {state['sync_id']}，请求 {sync_id}", state)
+    if state['sequence'] != base_sequence:
+        raise SyncConflict(f"水位不一致: 本地 {state['sequence']}，请求基准 {base_sequence}", state)
+
+
+def encode_changes(changes):
+    """把 [(version, op, fields), ...] 转换为可以放进 JSON 的记录列表"""
+    return [dict(fields, op=op) for _, op, fields in changes]
+
+
+def decode_changes(records):
+    """encode_changes 的逆操作，返回 [(sequence, op, fields), ...]"""
+    return [(record['sequence'], record['op'], record) for record in records]
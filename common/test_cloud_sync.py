@@ -0,0 +1,99 @@
+"""后台云同步：发件箱在重启后保留未上传的文件，同步失败时按指数退避重试"""
+
+import os
+import threading
+import time
+
+from common import cloud_sync
+from common.cloud_sync import FileOutbox, SyncWorker
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_outbox_keeps_files_until_removed(tmp_path):
+    output = tmp_path / "output"
+    output.mkdir()
+    outbox = FileOutbox(str(tmp_path / "outbox"))
+    for index, name in enumerate(("b.csv", "a.csv")):
+        path = output / name
+        path.write_text(f"{name}\n", encoding='utf-8')
+        stored = outbox.put(str(path))
+        os.utime(stored, (1000 + index, 1000 + index))
+    assert os.listdir(output) == []
+
+    # 按放入的先后顺序返回，进程重启后仍然存在
+    reopened = FileOutbox(str(tmp_path / "outbox"))
+    assert [os.path.basename(path) for path in reopened.pending()] == ["b.csv", "a.csv"]
+
+    reopened.remove(reopened.pending()[0])
+    reopened.remove(str(tmp_path / "outbox" / "missing.csv"))
+    assert [os.path.basename(path) for path in FileOutbox(str(tmp_path / "outbox")).pending()] == ["a.csv"]
+
+
+def test_worker_retries_until_success(monkeypatch):
+    monkeypatch.setattr(cloud_sync.random, 'uniform', lambda low, high: high)
+    outcomes = [RuntimeError("远程不可用"), RuntimeError("远程不可用"), {"transfer_type": "delta"}]
+    calls = []
+
+    def sync_once():
+        calls.append(time.monotonic())
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    messages = []
+    worker = SyncWorker(sync_once, interval=60, initial_backoff=0.05, max_backoff=1, log=messages.append).start()
+    try:
+        assert wait_until(lambda: worker.status()['state'] == "idle" and worker.status()['last_result'])
+    finally:
+        worker.close(5)
+
+    status = worker.status()
+    assert status['attempts'] == 3
+    assert status['consecutive_failures'] == 0
+    assert status['last_error'] is None
+    assert status['last_result'] == {"transfer_type": "delta"}
+    assert len(messages) == 2
+    # 第二次失败后的等待时间是第一次的两倍
+    assert calls[1] - calls[0] >= 0.05
+    assert calls[2] - calls[1] >= 0.1
+
+
+def test_failure_status_reports_retry(monkeypatch):
+    monkeypatch.setattr(cloud_sync.random, 'uniform', lambda low, high: high)
+    failed = threading.Event()
+
+    def sync_once():
+        failed.set()
+        raise RuntimeError("连接被拒绝")
+
+    worker = SyncWorker(sync_once, interval=60, initial_backoff=30, log=lambda message: None).start()
+    try:
+        assert failed.wait(5)
+        assert wait_until(lambda: worker.status()['state'] == "retrying")
+        status = worker.status()
+        assert status['consecutive_failures'] == 1
+        assert status['last_error'] == "连接被拒绝"
+        assert status['next_retry_at'] is not None
+    finally:
+        # 退避等待中也能立即停止
+        started = time.monotonic()
+        worker.close(5)
+        assert time.monotonic() - started < 5
+
+
+def test_backoff_doubles_up_to_limit(monkeypatch):
+    worker = SyncWorker(lambda: None, initial_backoff=1.0, max_backoff=10.0)
+    monkeypatch.setattr(cloud_sync.random, 'uniform', lambda low, high: high)
+    assert [worker._backoff(failures) for failures in range(1, 7)] == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+
+    monkeypatch.setattr(cloud_sync.random, 'uniform', lambda low, high: low)
+    assert worker._backoff(20) == 5.0
@@ -0,0 +1,144 @@
+"""任务队列：进程崩溃后的恢复、同键任务的去重和串行处理，以及工作线程"""
+
+import threading
+import time
+
+import pytest
+
+from common.job_queue import JobNotFound, JobQueue, JobWorkers
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+def crash_restart(queue, path, **kwargs):
+    """不把 running 的任务记入结果就关闭队列，再重新打开，相当于进程在处理中崩溃后重启"""
+    queue.close()
+    return JobQueue(path, log=lambda message: None, **kwargs)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_recover_requeues_interrupted_jobs(path):
+    queue = JobQueue(path, log=lambda message: None)
+    job = queue.enqueue("render", {"file": "a.csv"}, key="a.csv")
+    assert queue.claim(["render"])['id'] == job['id']
+
+    queue = crash_restart(queue, path)
+    assert queue.recover() == (1, 0, 0)
+    restored = queue.get(job['id'])
+    assert restored['status'] == "queued"
+    assert restored['payload'] == {"file": "a.csv"}
+    assert queue.claim(["render"])['attempts'] == 2
+    queue.close()
+
+
+def test_recover_fails_job_after_max_attempts(path):
+    """每次都在处理中导致进程崩溃的任务，达到尝试次数上限后不再重试"""
+    queue = JobQueue(path, max_attempts=2, log=lambda message: None)
+    job = queue.enqueue("render", {"file": "a.csv"})
+    for _ in range(2):
+        queue.claim(["render"])
+        queue = crash_restart(queue, path, max_attempts=2)
+        queue.recover()
+
+    failed = queue.get(job['id'])
+    assert failed['status'] == "failed"
+    assert failed['attempts'] == 2
+    assert queue.claim(["render"]) is None
+    assert queue.counts() == {"failed": 1}
+    queue.close()
+
+
+def test_recover_finishes_completed_jobs(path):
+    """工作已经完成、只是没来得及记入 done 的任务直接标记为完成，不再重新处理"""
+    queue = JobQueue(path, log=lambda message: None)
+    done = queue.enqueue("render", {"file": "a.csv"})
+    pending = queue.enqueue("render", {"file": "b.csv"})
+    queue.claim(["render"])
+    queue.claim(["render"])
+
+    queue = crash_restart(queue, path)
+    completed = lambda job: {"charts": 4} if job['payload']['file'] == "a.csv" else None
+    assert queue.recover(completed) == (1, 0, 1)
+    assert queue.get(done['id'])['status'] == "done"
+    assert queue.get(done['id'])['result'] == {"charts": 4}
+    assert queue.get(pending['id'])['status'] == "queued"
+    queue.close()
+
+
+def test_enqueue_deduplicates_queued_jobs(path):
+    queue = JobQueue(path, log=lambda message: None)
+    first = queue.enqueue("render", {"file": "a.csv"}, key="a.csv")
+    assert queue.enqueue("render", {"file": "a.csv"}, key="a.csv")['id'] == first['id']
+    assert queue.enqueue("other", {"file": "a.csv"}, key="a.csv")['id'] != first['id']
+    with pytest.raises(JobNotFound):
+        queue.get("missing")
+    queue.close()
+
+
+def test_claim_serializes_jobs_with_same_key(path):
+    """同键的任务正在处理时再次提交的任务照常排队，但要等前一个结束后才会被取出"""
+    queue = JobQueue(path, log=lambda message: None)
+    running = queue.enqueue("render", key="a.csv")
+    queue.claim(["render"])
+    again = queue.enqueue("render", key="a.csv")
+    other = queue.enqueue("render", key="b.csv")
+    assert again['id'] != running['id']
+
+    assert queue.claim(["render"])['id'] == other['id']
+    assert queue.claim(["render"]) is None
+    queue.finish(running['id'])
+    assert queue.claim(["render"])['id'] == again['id']
+    queue.close()
+
+
+def test_workers_record_results_and_failures(path):
+    queue = JobQueue(path, log=lambda message: None)
+
+    def render(payload):
+        if payload['file'] == "bad.csv":
+            raise ValueError("无法解析")
+        return {"file": payload['file']}
+
+    good = queue.enqueue("render", {"file": "a.csv"})
+    bad = queue.enqueue("render", {"file": "bad.csv"})
+    workers = JobWorkers(queue, {"render": render}, workers=2, log=lambda message: None)
+    workers.start()
+    try:
+        assert wait_until(lambda: queue.counts() == {"done": 1, "failed": 1})
+    finally:
+        workers.stop(5)
+
+    assert queue.get(good['id'])['result'] == {"file": "a.csv"}
+    assert queue.get(bad['id'])['error'] == "无法解析"
+    queue.close()
+
+
+def test_request_threads_do_not_accumulate_connections(path):
+    """/jobs/<id> 和 /health 在每个请求的线程中查询队列，连接用完即归还"""
+    queue = JobQueue(path, log=lambda message: None, pool_size=4)
+    job = queue.enqueue("render", {"file": "a.csv"})
+
+    def request():
+        queue.get(job['id'])
+        queue.counts()
+        queue.enqueue("render", {"file": "a.csv"}, key="a.csv")
+
+    threads = [threading.Thread(target=request) for _ in range(100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert queue._pool.connection_count() <= 4
+    assert queue.counts() == {"queued": 2}
+    queue.close()
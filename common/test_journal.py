@@ -0,0 +1,153 @@
+"""PlayerJournal 的重放、压缩和崩溃恢复"""
+
+import json
+import time
+
+from common.journal import PlayerJournal
+from common.player_store import JournalPersister, PlayerStore
+
+
+def initial_data():
+    return {"received_data": {"players": [], "metadata": {"total_players": 0}}}
+
+
+def make_journal(tmp_path, **kwargs):
+    return PlayerJournal(
+        str(tmp_path / "data.journal"),
+        str(tmp_path / "data.snapshot.json"),
+        str(tmp_path / "data.json"),
+        initial_data,
+        log=lambda message: None,
+        **kwargs
+    )
+
+
+def open_store(tmp_path, **kwargs):
+    return PlayerStore(JournalPersister(make_journal(tmp_path, **kwargs)), log=lambda message: None).open()
+
+
+def add_players(store, count):
+    for _ in range(count):
+        store.add_player(lambda number: {"Number": number, "Name": f"player{number}"})
+
+
+def numbers(store):
+    return [player.get('Number') for player in store.snapshot().players()]
+
+
+def test_replay_restores_state_without_close(tmp_path):
+    """进程没有正常关闭时，由日志重放恢复玩家、出队位置和元数据"""
+    store = open_store(tmp_path)
+    add_players(store, 5)
+    store.dequeue(2)
+    assert store.flush(5)
+    sync_id = store.snapshot().metadata['sync_id']
+
+    restored = open_store(tmp_path)
+    assert numbers(restored) == [2, 3, 4]
+    metadata = restored.snapshot().metadata
+    assert metadata['total_players'] == 5
+    assert metadata['current_number'] == 2
+    assert metadata['sync_id'] == sync_id
+    assert metadata['sequence'] == store.snapshot().metadata['sequence']
+    restored.close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    """最后一行只写了一半时丢弃它，之后的追加从截断处继续"""
+    journal = make_journal(tmp_path)
+    journal.open()
+    journal.append('add_player', player={"Number": 0})
+    journal.append('add_player', player={"Number": 1})
+    journal.close()
+    with open(tmp_path / "data.journal", 'a', encoding='utf-8') as f:
+        f.write('{"seq": 3, "op": "add_pl')
+
+    journal = make_journal(tmp_path)
+    data = journal.open()
+    assert [player.get('Number') for player in data['received_data']['players']] == [0, 1]
+    journal.append('add_player', player={"Number": 2})
+    journal.close()
+
+    data = make_journal(tmp_path).open()
+    assert [player.get('Number') for player in data['received_data']['players']] == [0, 1, 2]
+
+
+def test_compaction_writes_snapshot_and_export(tmp_path):
+    """达到阈值时压缩：快照和导出的 data.json 包含全部修改，日志被截断，之后的记录在快照之上重放"""
+    store = open_store(tmp_path, compact_threshold=4)
+    add_players(store, 6)
+    assert store.flush(5)
+
+    with open(tmp_path / "data.snapshot.json", encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert snapshot['seq'] >= 4
+    with open(tmp_path / "data.json", encoding='utf-8') as f:
+        exported = json.load(f)
+    assert len(exported['received_data']['players']) == len(snapshot['data']['received_data']['players'])
+    with open(tmp_path / "data.journal", encoding='utf-8') as f:
+        assert len(f.readlines()) < 6
+
+    store.dequeue(1)
+    assert store.flush(5)
+    restored = open_store(tmp_path)
+    assert numbers(restored) == [1, 2, 3, 4, 5]
+    restored.close()
+
+
+def test_crash_before_truncate_skips_compacted_records(tmp_path):
+    """快照写入后、截断日志前崩溃：重放时跳过序号不大于快照的记录，不会重复追加"""
+    journal = make_journal(tmp_path)
+    data = journal.open()
+    players = []
+    for number in range(3):
+        journal.append('add_player', player={"Number": number})
+        players.append({"Number": number})
+    with open(tmp_path / "data.journal", encoding='utf-8') as f:
+        uncompacted = f.read()
+    data['received_data']['players'] = players
+    data['received_data']['metadata']['total_players'] = 3
+    assert journal.compact(data)
+    journal.close()
+    with open(tmp_path / "data.journal", 'w', encoding='utf-8') as f:
+        f.write(uncompacted)
+
+    data = make_journal(tmp_path).open()
+    assert [player.get('Number') for player in data['received_data']['players']] == [0, 1, 2]
+    assert data['received_data']['metadata']['total_players'] == 3
+
+
+def test_migrates_existing_data_json(tmp_path):
+    """没有快照时从原有的 data.json 迁移"""
+    document = initial_data()
+    document['received_data']['players'] = [{"Number": 0}, {"Number": 1}]
+    document['received_data']['metadata']['total_players'] = 2
+    with open(tmp_path / "data.json", 'w', encoding='utf-8') as f:
+        json.dump(document, f)
+
+    store = open_store(tmp_path)
+    add_players(store, 1)
+    assert numbers(store) == [0, 1, 2]
+    store.close()
+
+    restored = open_store(tmp_path)
+    assert numbers(restored) == [0, 1, 2]
+    restored.close()
+
+
+def test_idle_compaction_refreshes_export(tmp_path):
+    """没有达到阈值时，空闲 compact_interval 秒后也压缩一次并刷新 data.json"""
+    store = open_store(tmp_path, compact_interval=0.1)
+    add_players(store, 2)
+    assert store.flush(5)
+
+    deadline = time.monotonic() + 5
+    exported = []
+    while time.monotonic() < deadline:
+        with open(tmp_path / "data.json", encoding='utf-8') as f:
+            exported = json.load(f)['received_data']['players']
+        if len(exported) == 2:
+            break
+        time.sleep(0.05)
+    assert [player['Number'] for player in exported] == [0, 1]
+    store.close()
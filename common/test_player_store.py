@@ -0,0 +1,150 @@
+"""PlayerStore 的取样租约：领取、确认、过期退回，以及重启后的恢复"""
+
+import json
+import time
+
+import pytest
+
+from common.journal import PlayerJournal
+from common.player_store import JournalPersister, JsonFilePersister, PlayerStore
+
+
+def initial_data():
+    return {"received_data": {"players": [], "metadata": {"total_players": 0}}}
+
+
+def journal_persister(tmp_path):
+    return JournalPersister(PlayerJournal(
+        str(tmp_path / "data.journal"),
+        str(tmp_path / "data.snapshot.json"),
+        str(tmp_path / "data.json"),
+        initial_data,
+        log=lambda message: None
+    ))
+
+
+def json_persister(tmp_path):
+    return JsonFilePersister(str(tmp_path / "data.json"), initial_data, log=lambda message: None)
+
+
+PERSISTERS = [journal_persister, json_persister]
+
+
+def open_store(make_persister, tmp_path):
+    return PlayerStore(make_persister(tmp_path), log=lambda message: None).open()
+
+
+def add_players(store, count):
+    for _ in range(count):
+        store.add_player(lambda number: {"Number": number})
+
+
+def numbers(players):
+    return [player.get('Number') for player in players]
+
+
+def crash_restart(store, make_persister, tmp_path):
+    """写完已有的修改后不关闭存储，直接从磁盘重新打开，相当于进程崩溃后重启"""
+    assert store.flush(5)
+    return open_store(make_persister, tmp_path)
+
+
+def test_claim_skips_leased_players(tmp_path):
+    store = open_store(json_persister, tmp_path)
+    add_players(store, 4)
+    _, first = store.claim(2, 60)
+    _, second = store.claim(5, 60)
+    assert numbers(first) == [0, 1]
+    assert numbers(second) == [2, 3]
+    assert store.claim(1, 60) == (None, [])
+    assert store.available_count() == 0
+    store.close()
+
+
+def test_ack_removes_head_and_persists(tmp_path):
+    store = open_store(json_persister, tmp_path)
+    add_players(store, 3)
+    lease_id, _ = store.claim(2, 60)
+    assert store.ack(lease_id) == 2
+    assert store.ack(lease_id) is None
+    assert numbers(store.snapshot().players()) == [2]
+    assert store.snapshot().metadata['current_number'] == 2
+
+    restored = crash_restart(store, json_persister, tmp_path)
+    assert numbers(restored.snapshot().players()) == [2]
+    restored.close()
+
+
+def test_expired_lease_returns_to_queue_first(tmp_path):
+    store = open_store(json_persister, tmp_path)
+    add_players(store, 4)
+    lease_id, _ = store.claim(2, 0.05)
+    store.claim(1, 60)
+    time.sleep(0.1)
+    assert store.available_count() == 3
+    assert store.ack(lease_id) is None
+    _, players = store.claim(3, 60)
+    assert numbers(players) == [0, 1, 3]
+    store.close()
+
+
+@pytest.mark.parametrize("make_persister", PERSISTERS)
+def test_non_head_ack_survives_restart(make_persister, tmp_path):
+    """前面的租约还没确认时确认后面的租约：重启后前面的玩家重新发出，已确认的不再发出"""
+    store = open_store(make_persister, tmp_path)
+    add_players(store, 4)
+    store.claim(1, 60)
+    lease_id, _ = store.claim(2, 60)
+    assert store.ack(lease_id) == 2
+    assert numbers(store.snapshot().players()) == [0, 1, 2, 3]
+
+    restored = crash_restart(store, make_persister, tmp_path)
+    assert restored.available_count() == 2
+    head_lease, players = restored.claim(10, 60)
+    assert numbers(players) == [0, 3]
+
+    # 队首确认后，连同之前确认的玩家一起出队，重启后也不再出现
+    assert restored.ack(head_lease) == 2
+    assert restored.snapshot().player_count == 0
+    assert 'acked_numbers' not in restored.snapshot().document()['received_data']['metadata']
+    again = crash_restart(restored, make_persister, tmp_path)
+    assert again.snapshot().player_count == 0
+    assert again.snapshot().metadata['current_number'] == 4
+    again.close()
+
+
+@pytest.mark.parametrize("make_persister", PERSISTERS)
+def test_dequeue_behind_open_lease_survives_restart(make_persister, tmp_path):
+    """有未确认的租约时用 dequeue 取出的玩家不在队首，重启后也不会再次发出"""
+    store = open_store(make_persister, tmp_path)
+    add_players(store, 3)
+    store.claim(1, 60)
+    assert numbers(store.dequeue(1)) == [1]
+
+    restored = crash_restart(store, make_persister, tmp_path)
+    assert numbers(restored.dequeue(10)) == [0, 2]
+    restored.close()
+
+
+def test_non_head_ack_writes_only_new_numbers(tmp_path):
+    """每次确认只写入这次确认的编号，不重写全部已确认的编号"""
+    store = open_store(journal_persister, tmp_path)
+    add_players(store, 10)
+    store.claim(1, 60)
+    for _ in range(3):
+        lease_id, _ = store.claim(3, 60)
+        store.ack(lease_id)
+    assert store.snapshot().acked_numbers() == list(range(1, 10))
+    assert store.flush(5)
+
+    with open(tmp_path / "data.journal", encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert [record['numbers'] for record in records if record['op'] == 'acknowledge'] == \
+        [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert not any(record['op'] == 'set_metadata' and 'acked_numbers' in record['values'] for record in records)
+
+    restored = crash_restart(store, journal_persister, tmp_path)
+    assert restored.snapshot().acked_numbers() == list(range(1, 10))
+    _, players = restored.claim(10, 60)
+    assert numbers(players) == [0]
+    restored.close()
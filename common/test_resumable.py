@@ -0,0 +1,202 @@
+"""分块上传：中断后从服务器已收到的位置续传，位置不一致时按服务器的位置继续，内容校验失败时拒绝"""
+
+import hashlib
+import os
+import threading
+
+import pytest
+
+from common.file_manifest import file_sha256
+from common.resumable import (
+    CHUNK_SHA256_HEADER, ChecksumMismatch, OffsetMismatch, UploadSessionNotFound,
+    UploadSessions, upload_file_resumable
+)
+from common.transfer import decompress_bytes
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def open_sessions(tmp_path, chunk_size=4):
+    return UploadSessions(str(tmp_path / "uploads"), str(tmp_path / "received"), chunk_size=chunk_size)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class SessionsClient:
+    """把请求直接交给 UploadSessions 处理，状态码与 remote_backend 的 /uploads 路由相同"""
+
+    def __init__(self, sessions, fail_after=None, replay=()):
+        """
+        Args:
+            fail_after: 收到这么多个块之后连接中断
+            replay: 这些序号的块请求被处理两次（第一次的响应丢失后重试），返回第二次的结果
+        """
+        self.sessions = sessions
+        self.fail_after = fail_after
+        self.replay = set(replay)
+        self.offsets = []
+
+    def post(self, url, json=None, timeout=None):
+        assert url.endswith('/uploads')
+        try:
+            state = self.sessions.open(json['filename'], json['size'], json['sha256'])
+        except ValueError as e:
+            return FakeResponse(400, {"status": "error", "message": str(e)})
+        return FakeResponse(200, dict(state, status="success"))
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None):
+        assert method == "PUT"
+        if self.fail_after is not None and len(self.offsets) >= self.fail_after:
+            raise ConnectionError("连接中断")
+        index = len(self.offsets)
+        self.offsets.append(params['offset'])
+        upload_id = url.rsplit('/', 1)[-1]
+        body = decompress_bytes(data, headers.get("Content-Encoding"))
+        if index in self.replay:
+            self._write(upload_id, params['offset'], body, headers)
+        return self._write(upload_id, params['offset'], body, headers)
+
+    def _write(self, upload_id, offset, body, headers):
+        try:
+            state = self.sessions.write_chunk(upload_id, offset, body, headers.get(CHUNK_SHA256_HEADER))
+        except UploadSessionNotFound:
+            return FakeResponse(404, {"status": "error"})
+        except OffsetMismatch as e:
+            return FakeResponse(409, {"status": "error", "offset": e.offset})
+        except ValueError as e:
+            return FakeResponse(400, {"status": "error", "message": str(e)})
+        return FakeResponse(200, dict(state, status="success"))
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = tmp_path / "game.txt"
+    path.write_bytes(b"0123456789abcdefghij")
+    return str(path)
+
+
+def test_partial_upload_resumes_after_restart(tmp_path):
+    data = b"0123456789"
+    sessions = open_sessions(tmp_path)
+    state = sessions.open("game.txt", len(data), sha256(data))
+    sessions.write_chunk(state['upload_id'], 0, data[:4], sha256(data[:4]))
+
+    # 服务器重启后再次创建会话，得到同一个编号和已收到的位置
+    restarted = open_sessions(tmp_path)
+    resumed = restarted.open("game.txt", len(data), sha256(data))
+    assert resumed['upload_id'] == state['upload_id']
+    assert resumed['offset'] == 4
+    assert restarted.status(state['upload_id'])['offset'] == 4
+
+    restarted.write_chunk(state['upload_id'], 4, data[4:])
+    assert (tmp_path / "received" / "game.txt").read_bytes() == data
+    with pytest.raises(UploadSessionNotFound):
+        restarted.status(state['upload_id'])
+
+
+def test_rejects_wrong_offset_and_corrupt_chunk(tmp_path):
+    data = b"0123456789"
+    sessions = open_sessions(tmp_path)
+    upload_id = sessions.open("game.txt", len(data), sha256(data))['upload_id']
+    sessions.write_chunk(upload_id, 0, data[:4])
+
+    with pytest.raises(OffsetMismatch) as mismatch:
+        sessions.write_chunk(upload_id, 0, data[:4])
+    assert mismatch.value.offset == 4
+    with pytest.raises(ChecksumMismatch):
+        sessions.write_chunk(upload_id, 4, data[4:8], sha256(b"other"))
+    with pytest.raises(ValueError):
+        sessions.write_chunk(upload_id, 4, data[4:] + b"extra")
+    assert sessions.status(upload_id)['offset'] == 4
+
+
+def test_whole_file_mismatch_discards_session(tmp_path):
+    data = b"0123456789"
+    sessions = open_sessions(tmp_path)
+    upload_id = sessions.open("game.txt", len(data), sha256(b"expected"))['upload_id']
+
+    with pytest.raises(ChecksumMismatch):
+        sessions.write_chunk(upload_id, 0, data)
+    assert not (tmp_path / "received" / "game.txt").exists()
+    assert os.listdir(tmp_path / "uploads") == []
+    assert sessions._session_locks == {}
+
+
+def test_session_locks_are_released(tmp_path):
+    """长时间运行的接收端不会为每个上传编号一直保留一个锁"""
+    sessions = open_sessions(tmp_path)
+    errors = []
+
+    def upload(index):
+        data = f"file {index:04d} contents".encode('utf-8')
+        try:
+            upload_id = sessions.open(f"game{index}.txt", len(data), sha256(data))['upload_id']
+            for offset in range(0, len(data), 4):
+                sessions.write_chunk(upload_id, offset, data[offset:offset + 4])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=upload, args=(index % 20,)) for index in range(60)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 同一文件的并发上传由会话锁串行化，重复的块被拒绝
+    assert all(isinstance(e, (OffsetMismatch, UploadSessionNotFound)) for e in errors)
+    assert len(os.listdir(tmp_path / "received")) == 20
+    assert sessions._session_locks == {}
+    with pytest.raises(UploadSessionNotFound):
+        sessions.status("missing")
+    assert sessions._session_locks == {}
+
+
+def test_rejects_unsafe_filename(tmp_path):
+    with pytest.raises(ValueError):
+        open_sessions(tmp_path).open("../game.txt", 1, sha256(b"x"))
+
+
+def test_client_resumes_after_connection_loss(tmp_path, log_file):
+    sessions = open_sessions(tmp_path)
+    digest = file_sha256(log_file)
+
+    interrupted = SessionsClient(sessions, fail_after=2)
+    with pytest.raises(ConnectionError):
+        upload_file_resumable(interrupted, "http://remote", log_file, digest, chunk_size=4)
+    assert interrupted.offsets == [0, 4]
+
+    # 发送端重启后只发送剩下的块
+    client = SessionsClient(open_sessions(tmp_path))
+    response = upload_file_resumable(client, "http://remote", log_file, digest, encoding="gzip", chunk_size=64)
+    assert response.status_code == 200 and response.json()['complete']
+    assert client.offsets == [8, 12, 16]
+    with open(log_file, 'rb') as f:
+        assert (tmp_path / "received" / "game.txt").read_bytes() == f.read()
+
+
+def test_client_follows_server_offset_on_conflict(tmp_path, log_file):
+    """块的响应丢失后重试得到 409，从服务器返回的位置继续，不重复写入"""
+    client = SessionsClient(open_sessions(tmp_path), replay=[1])
+    response = upload_file_resumable(client, "http://remote", log_file, file_sha256(log_file), chunk_size=4)
+
+    assert response.json()['complete']
+    assert client.offsets == [0, 4, 8, 12, 16]
+    with open(log_file, 'rb') as f:
+        assert (tmp_path / "received" / "game.txt").read_bytes() == f.read()
+
+
+def test_client_returns_none_without_chunked_upload(log_file):
+    class OldRemote:
+        def post(self, url, json=None, timeout=None):
+            return FakeResponse(404, {})
+
+    assert upload_file_resumable(OldRemote(), "http://remote", log_file, file_sha256(log_file)) is None
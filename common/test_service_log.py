@@ -0,0 +1,53 @@
+"""服务日志：多个进程不共用同一个轮转的日志文件"""
+
+import json
+import multiprocessing
+import os
+
+from common.service_log import ServiceLogger
+
+
+def write_logs(log_dir, count):
+    logger = ServiceLogger("svc", log_dir, console=False, max_bytes=2000, backup_count=50)
+    for i in range(count):
+        logger.log(f"message {i}", pid=os.getpid())
+    logger.close()
+
+
+def read_entries(log_dir):
+    entries = []
+    for filename in os.listdir(log_dir):
+        with open(os.path.join(log_dir, filename), encoding='utf-8') as f:
+            entries.extend(json.loads(line) for line in f)
+    return entries
+
+
+def test_child_processes_write_own_files(tmp_path):
+    log_dir = str(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=write_logs, args=(log_dir, 200)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    write_logs(log_dir, 200)
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    names = os.listdir(log_dir)
+    for process in processes:
+        assert any(name.startswith(f"svc.{process.pid}.log") for name in names)
+    assert "svc.log" in names
+
+    # 每个进程都轮转过多次，日志一条不少
+    entries = read_entries(log_dir)
+    assert len(entries) == 800
+    for pid in [os.getpid()] + [process.pid for process in processes]:
+        assert sorted(entry['message'] for entry in entries if entry['pid'] == pid) == \
+            sorted(f"message {i}" for i in range(200))
+
+
+def test_per_process_can_be_forced(tmp_path):
+    logger = ServiceLogger("svc", str(tmp_path), console=False, per_process=True)
+    logger.log("hello")
+    logger.close()
+    assert os.listdir(tmp_path) == [f"svc.{os.getpid()}.log"]
@@ -0,0 +1,80 @@
+"""SQLite 存储的连接池：每个请求一个线程时连接数保持有界"""
+
+import threading
+
+import pytest
+
+from common.storage import SqliteConnectionPool, SqliteStorage
+
+
+def initial_data():
+    return {"received_data": {"players": [], "metadata": {"total_players": 0}}}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "data.db"), initial_data, log=lambda message: None, pool_size=4)
+    yield storage
+    storage.close()
+
+
+def run_threads(count, target):
+    """像 Flask 开发服务器那样，每个请求启动一个新线程"""
+    errors = []
+
+    def request():
+        try:
+            target()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_short_lived_threads_reuse_connections(storage):
+    storage.merge_players([{"Name": "a"}], "test")
+    for _ in range(200):
+        run_threads(1, storage.read_document)
+    assert storage._pool.connection_count() == 1
+
+
+def test_concurrent_threads_stay_within_pool_size(storage):
+    barrier = threading.Barrier(32)
+
+    def request():
+        barrier.wait()
+        storage.merge_players([{"Name": "a"}], "test")
+        assert storage.read_document()['received_data']['players']
+
+    run_threads(32, request)
+    assert storage._pool.connection_count() <= 4
+    assert len(storage.read_document()['received_data']['players']) == 32
+
+
+def test_nested_use_in_one_thread_shares_connection(tmp_path):
+    pool = SqliteConnectionPool(str(tmp_path / "pool.db"), size=1)
+    with pool.connection() as outer:
+        with pool.transaction(write=True) as inner:
+            assert inner is outer
+            inner.execute("CREATE TABLE t (x INTEGER)")
+    assert pool.connection_count() == 1
+
+    pool.close()
+    assert pool.connection_count() == 0
+
+
+def test_unfinished_transaction_is_rolled_back_on_return(tmp_path):
+    pool = SqliteConnectionPool(str(tmp_path / "pool.db"), size=1)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.execute("BEGIN")
+        conn.execute("INSERT INTO t VALUES (1)")
+    with pool.connection() as conn:
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    pool.close()
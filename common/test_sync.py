@@ -0,0 +1,126 @@
+"""增量同步：发送端的修改日志和接收端按水位应用修改"""
+
+import pytest
+
+from common.player_store import JsonFilePersister, PlayerStore
+from common.storage import JsonFileStorage, SqliteStorage
+from common.sync import SyncConflict, decode_changes, encode_changes, sync_state
+
+
+def initial_data():
+    return {"received_data": {"players": [], "metadata": {"total_players": 0}}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PlayerStore(
+        JsonFilePersister(str(tmp_path / "data.json"), initial_data, log=lambda message: None),
+        log=lambda message: None,
+        change_log_size=5
+    ).open()
+    yield store
+    store.close()
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def remote(request, tmp_path):
+    if request.param == "json":
+        storage = JsonFileStorage(str(tmp_path / "remote.json"), initial_data, log=lambda message: None)
+    else:
+        storage = SqliteStorage(str(tmp_path / "remote.db"), initial_data, log=lambda message: None)
+    yield storage
+    storage.close()
+
+
+def add_players(store, count):
+    for _ in range(count):
+        store.add_player(lambda number: {"Number": number})
+
+
+def send_delta(store, remote):
+    """按接收端的水位发送增量，与 game_backend.build_sync_payload / remote_backend 的处理相同"""
+    state = sync_state(remote.get_metadata())
+    changes, snapshot = store.changes_since(state['sequence'])
+    records = decode_changes(encode_changes(changes))
+    remote.apply_changes(records, dict(snapshot.metadata), {"transfer_type": "delta"},
+                         expected=(state['sync_id'], state['sequence']))
+    return snapshot
+
+
+def send_full_copy(store, remote):
+    snapshot = store.snapshot()
+    remote.write_document(dict(snapshot.header, received_data={
+        "players": [player.to_dict() for player in snapshot.players()],
+        "metadata": dict(snapshot.metadata)
+    }))
+    return snapshot
+
+
+def remote_numbers(remote):
+    return [player['Number'] for player in remote.read_document()['received_data']['players']]
+
+
+def test_changes_since_returns_changes_after_watermark(store):
+    add_players(store, 2)
+    current = store.snapshot().metadata['sequence']
+
+    changes, snapshot = store.changes_since(current - 2)
+    assert [sequence for sequence, _, _ in changes] == [current - 1, current]
+    assert snapshot.version == store.snapshot().version
+    assert store.changes_since(current)[0] == []
+    # 远程水位超过本地：远程的数据来自别处，需要完整复制
+    assert store.changes_since(current + 1)[0] is None
+
+
+def test_changes_since_requires_full_copy_after_log_rotates(store):
+    start = store.snapshot().metadata['sequence']
+    add_players(store, 8)
+    assert store.changes_since(start)[0] is None
+    assert len(store.changes_since(store.snapshot().metadata['sequence'] - 5)[0]) == 5
+
+
+def test_delta_reproduces_sender_state(store, remote):
+    add_players(store, 3)
+    send_full_copy(store, remote)
+    add_players(store, 2)
+    store.dequeue(2)
+
+    snapshot = send_delta(store, remote)
+    assert remote_numbers(remote) == [2, 3, 4]
+    assert sync_state(remote.get_metadata()) == sync_state(snapshot.metadata)
+
+
+def test_stale_watermark_is_rejected_without_changes(store, remote):
+    """基准水位与接收端不一致时拒绝（remote_backend 返回 409），接收端数据不变"""
+    add_players(store, 2)
+    send_full_copy(store, remote)
+    state = sync_state(remote.get_metadata())
+    add_players(store, 1)
+    changes, snapshot = store.changes_since(state['sequence'])
+    before = remote.read_document()
+
+    with pytest.raises(SyncConflict) as conflict:
+        remote.apply_changes(changes, dict(snapshot.metadata), {}, expected=(state['sync_id'], state['sequence'] - 1))
+    assert conflict.value.state == state
+    assert remote.read_document() == before
+
+    with pytest.raises(SyncConflict):
+        remote.apply_changes(changes, dict(snapshot.metadata), {}, expected=("other", state['sequence']))
+    assert remote.read_document() == before
+
+
+def test_full_copy_after_conflict_resumes_deltas(store, remote):
+    """合并过其他数据的接收端没有数据集标识，增量被拒绝；完整复制后增量同步恢复"""
+    add_players(store, 2)
+    send_full_copy(store, remote)
+    remote.merge_players([{"Number": 0}], "other-server")
+    add_players(store, 1)
+
+    with pytest.raises(SyncConflict):
+        send_delta(store, remote)
+    send_full_copy(store, remote)
+    assert remote_numbers(remote) == [0, 1, 2]
+
+    add_players(store, 1)
+    send_delta(store, remote)
+    assert remote_numbers(remote) == [0, 1, 2, 3]
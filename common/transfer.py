@@ -0,0 +1,225 @@
+"""
+game_backend 与 remote_backend 之间的文件传输
+
+文件以原始二进制流逐个上传（POST /upload_file?filename=...），发送端直接从磁盘流式读取，
+接收端按块写入 received_files/，两端内存占用都只与块大小有关；
+相比原来的十六进制字符串嵌入 JSON，传输字节数减少一半。
+
+文件和 JSON 请求体都可以用 Content-Encoding 压缩（zstd 或 gzip），
+接收端在 /health 的 transfer_encodings 中声明支持的编码，发送端据此协商。
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import zlib
+
+from common.player import player_json_default
+
+try:
+    import zstandard
+except ImportError:
+    # zstandard 为可选依赖，未安装时只支持 gzip
+    zstandard = None
+
+# 接收端每次读取、写入的块大小
+CHUNK_SIZE = 64 * 1024
+# 需要传输的模拟输出文件类型
+TRANSFER_EXTENSIONS = ('.csv', '.txt')
+# 未指定压缩级别时使用的默认级别
+DEFAULT_COMPRESSION_LEVELS = {"zstd": 6, "gzip": 6}
+
+
+class UnsupportedEncoding(ValueError):
+    """请求使用了本端不支持的 Content-Encoding"""
+
+
+def supported_encodings():
+    """本端支持的压缩编码，按优先级排列"""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def choose_encoding(remote_encodings, preference="auto"):
+    """
+    根据远程服务器声明的编码选择压缩方式
+
+    Args:
+        remote_encodings: 远程 /health 返回的 transfer_encodings，旧版服务器为None
+        preference: "auto"、"zstd"、"gzip" 或 "none"
+
+    Returns:
+        选中的编码，不压缩时返回None
+    """
+    if not remote_encodings or preference == "none":
+        return None
+    candidates = supported_encodings() if preference == "auto" else [preference]
+    for encoding in candidates:
+        if encoding in remote_encodings and encoding in supported_encodings():
+            return encoding
+    return None
+
+
+def compress_bytes(data, encoding, level=None):
+    """压缩整段数据"""
+    level = level or DEFAULT_COMPRESSION_LEVELS[encoding]
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level)
+    raise UnsupportedEncoding(encoding)
+
+
+def decompress_bytes(data, encoding):
+    """解压整段数据，encoding 为空时原样返回"""
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(data).read()
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    raise UnsupportedEncoding(encoding)
+
+
+def compress_chunks(fileobj, encoding, level=None, chunk_size=CHUNK_SIZE):
+    """边读文件边压缩，逐块产出压缩数据，用作分块传输的请求体"""
+    level = level or DEFAULT_COMPRESSION_LEVELS[encoding]
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    else:
+        raise UnsupportedEncoding(encoding)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def open_decoded_stream(stream, encoding):
+    """按 Content-Encoding 包装请求体流，返回可按块读取的解压流"""
+    if not encoding or encoding == "identity":
+        return stream
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    if encoding == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    raise UnsupportedEncoding(encoding)
+
+
+def is_transfer_file(filename):
+    """是否为需要传输的 csv / txt 文件"""
+    return filename.lower().endswith(TRANSFER_EXTENSIONS)
+
+
+def safe_filename(filename):
+    """只接受不含路径的 csv / txt 文件名，不合法时返回None"""
+    if not filename or '/' in filename or '\\' in filename or filename in ('.', '..'):
+        return None
+    if not is_transfer_file(filename):
+        return None
+    return filename
+
+
+def list_transfer_files(directory):
+    """列出目录下需要传输的文件路径"""
+    if not os.path.exists(directory):
+        return []
+    paths = []
+    for filename in os.listdir(directory):
+        file_path = os.path.join(directory, filename)
+        if os.path.isfile(file_path) and is_transfer_file(filename):
+            paths.append(file_path)
+    return paths
+
+
+def upload_file(http, url, file_path, encoding=None, level=None, timeout=30, sha256=None):
+    """
+    以原始二进制流上传单个文件，文件内容不会整体读入内存
+
+    Args:
+        http: common.http_client.HttpClient、requests.Session 或 requests 模块
+        url: 远程 /upload_file 地址
+        file_path: 本地文件路径
+        encoding: 压缩编码（"zstd" / "gzip"），None 表示不压缩
+        level: 压缩级别，None 使用默认级别
+        timeout: 超时时间（秒）
+        sha256: 文件内容的 sha256，提供时接收端会校验并记入文件清单
+
+    Returns:
+        requests.Response
+    """
+    params = {"filename": os.path.basename(file_path), "size": os.path.getsize(file_path)}
+    if sha256:
+        params["sha256"] = sha256
+    headers = {"Content-Type": "application/octet-stream"}
+    with open(file_path, 'rb') as f:
+        if encoding is None:
+            body = f
+        else:
+            # 压缩后长度未知，以分块传输编码发送
+            body = compress_chunks(f, encoding, level)
+            headers["Content-Encoding"] = encoding
+        return http.post(url, params=params, data=body, headers=headers, timeout=timeout)
+
+
+def post_json(http, url, payload, encoding=None, level=None, timeout=30):
+    """发送 JSON 请求体，指定编码时压缩后发送"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=player_json_default).encode('utf-8')
+    if encoding is None:
+        return http.post(url, data=body, headers={"Content-Type": "application/json"}, timeout=timeout)
+    return http.post(url, data=compress_bytes(body, encoding, level), headers={
+        "Content-Type": "application/json",
+        "Content-Encoding": encoding
+    }, timeout=timeout)
+
+
+def read_json_body(request):
+    """读取 flask 请求中的 JSON，按 Content-Encoding 透明解压"""
+    encoding = request.headers.get('Content-Encoding')
+    if not encoding:
+        return request.get_json()
+    return json.loads(decompress_bytes(request.get_data(), encoding.strip().lower()))
+
+
+def receive_stream(stream, dest_path, expected_size=None, chunk_size=CHUNK_SIZE, expected_sha256=None):
+    """
+    把请求体按块写入临时文件，完整接收后再原子替换为目标文件
+
+    Args:
+        stream: 请求体流（flask 的 request.stream）
+        dest_path: 目标文件路径
+        expected_size: 文件原始字节数，提供时校验实际写入的字节数
+        chunk_size: 块大小
+        expected_sha256: 文件内容的 sha256，提供时边写边计算并校验
+
+    Returns:
+        写入的字节数
+    """
+    tmp_path = f"{dest_path}.part"
+    size = 0
+    digest = hashlib.sha256() if expected_sha256 else None
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+        if expected_size is not None and size != expected_size:
+            raise IOError(f"接收到 {size} 字节，预期 {expected_size} 字节")
+        if digest is not None and digest.hexdigest() != expected_sha256.lower():
+            raise IOError(f"文件内容校验失败: sha256 {digest.hexdigest()}，预期 {expected_sha256}")
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
@@ -4,9 +4,29 @@ from flask_cors import CORS
 from datetime import datetime
 import json
 import os
-from threading import Lock
 import sys
 import io
+import atexit
+import argparse
+import asyncio
+import zlib
+import math
+from common.journal import PlayerJournal
+from common.player_store import PlayerStore, SharedPlayerStore, JournalPersister, JsonFilePersister, StoragePersister
+from common.storage import SqliteStorage
+from common.broadcast import ValueBroadcaster
+from common.transfer import list_transfer_files, upload_file, post_json, choose_encoding
+from common.sync import encode_changes
+from common.cloud_sync import FileOutbox, SyncWorker
+from common.http_client import HttpClient
+from common.file_manifest import FileManifest
+from common.file_lock import FileLock
+from common.service_log import ServiceLogger
+from common.resumable import upload_file_resumable
+from common.serving import AsgiApp, run_server, send_json, wait_disconnect, SERVER_MODES
+from common.static_assets import StaticAssets
+from common.player import Player, PlayerValidationError, install_flask_json, validate_player_input
+from common.metrics import install_flask_metrics
 
 # 获取当前脚本或可执行文件的目录
 if getattr(sys, 'frozen', False):
@@ -22,97 +42,229 @@ sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
+install_flask_metrics(app, "game_backend")  # 请求指标，GET /metrics
+install_flask_json(app)  # 内存中的玩家为 Player，jsonify 时按原来的字段输出
+
+# 服务器配置，可用命令行参数 --mode/--port/--workers 覆盖
+# 服务方式：asgi（asyncio，推荐，需要 uvicorn）、threaded（Werkzeug 多线程）或 development（调试和自动重载）
+SERVER_MODE = "asgi"
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 10001
+# asgi 模式的进程数；大于 1 时需要 STORAGE_MODE = "shared"
+SERVER_WORKERS = 1
+# asgi 模式下执行普通 Flask 路由的线程数
+SERVER_THREADS = 64
 
 # 数据文件路径
 DATA_FILE = os.path.join(BASE_DIR, "data.json")
-# 线程锁，确保多线程安全写入
-file_lock = Lock()
+# 追加日志模式下的日志文件和快照文件路径，data.json 作为导出文件继续保留
+JOURNAL_FILE = os.path.join(BASE_DIR, "data.journal")
+SNAPSHOT_FILE = os.path.join(BASE_DIR, "data.snapshot.json")
+# sqlite 模式下的数据库文件路径
+DATABASE_FILE = os.path.join(BASE_DIR, "data.db")
+# 存储模式：journal（每次保存只追加一条日志记录）、sqlite（SQLite数据库）、json（每次保存重写整个data.json），
+# 以上三种以单个进程的内存为准；shared（SQLite数据库为准，多个 worker 进程共享，编号在数据库事务中分配）
+STORAGE_MODE = "journal"  # 可以改为 "sqlite"、"json" 或 "shared"
+# 内存中的权威玩家数据，启动时由 open_player_store() 加载；读取直接使用快照，不访问磁盘
+player_store = None
+# UE 请求中带 "UseLease": true 时样本以租约形式发出，需要调用 /ack_player_samples 确认；
+# 未在租约时间（秒，可由请求中的 "LeaseSeconds" 指定）内确认的样本退回队列
+UE_SAMPLE_LEASE_SECONDS = 300
+# "LeaseSeconds" 的上限（秒），更长的租约按上限处理，避免样本被长期占用
+MAX_UE_LEASE_SECONDS = 3600
+# 单个UE请求最多取出的样本数（"CanGenerateAgantNum"），更多的按上限处理
+MAX_UE_SAMPLES = 10000
+# /save_player_data_batch 单次最多接受的玩家数
+MAX_BATCH_PLAYERS = 10000
+# 缓存的队列状态，只在保存或UE取样改变队列时更新，/get_queue_status 和 /queue_events 共用
+queue_status_broadcaster = ValueBroadcaster()
+# /queue_events 无变化时发送心跳的间隔（秒），用于发现已断开的连接
+QUEUE_EVENTS_HEARTBEAT = 15
+
+# 远程服务器地址
+REMOTE_SERVER = "http://47.118.21.234:10002"
+# UE模拟输出文件所在目录
+OUTPUT_PATH = "C:\\output"
+# 向远程服务器传输时的压缩方式："auto"（与远程协商，优先zstd）、"zstd"、"gzip" 或 "none"
+TRANSFER_COMPRESSION = "auto"
+# 压缩级别，None 使用默认级别（zstd和gzip均为6）
+TRANSFER_COMPRESSION_LEVEL = None
+# 不小于这个大小的文件分块上传，中断后从远程已收到的位置续传；更小的文件一次上传
+RESUMABLE_UPLOAD_THRESHOLD = 4 * 1024 * 1024
+# 分块上传的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 远程服务器支持的压缩编码，首次传输时从 /health 获取
+remote_transfer_encodings = None
+# 等待上传到远程服务器的文件先移到这个发件箱目录，远程确认收到后删除
+OUTBOX_DIR = os.path.join(BASE_DIR, "outbox")
+# 发件箱文件的内容哈希清单，记录哪些内容已经确认送达
+OUTBOX_MANIFEST = os.path.join(OUTBOX_DIR, "manifest.json")
+# 后台云同步：没有新请求时的定期同步间隔、失败重试的最长等待时间（秒）
+CLOUD_SYNC_INTERVAL = 60
+CLOUD_SYNC_MAX_BACKOFF = 300
+# 多个 worker 进程时只有拿到这个锁的进程负责云同步
+CLOUD_SYNC_LOCK_FILE = os.path.join(BASE_DIR, "cloud_sync.lock")
+# 发件箱、文件清单、后台同步线程和出站HTTP客户端（连接池复用连接），启动时由 start_cloud_sync() 创建；
+# 不负责云同步的进程没有文件清单和后台同步线程
+cloud_outbox = None
+cloud_sync_lock = None
+cloud_file_manifest = None
+cloud_sync_worker = None
+http_client = None
+# 最近一次成功同步到远程服务器的序号
+synced_sequence = None
+
+
+# 日志级别（debug / info / warning / error）和日志文件目录（每行一个JSON，按大小轮转）
+LOG_LEVEL = "info"
+LOG_DIR = os.path.join(BASE_DIR, "logs")
+# 高频日志的抽样比例：每 N 条只记录 1 条
+LOG_SAMPLE_RATES = {"queue_status": 20, "player_data": 10, "health": 20, "static_file": 10}
+service_log = ServiceLogger("game_backend", LOG_DIR, level=LOG_LEVEL, sample_rates=LOG_SAMPLE_RATES)
+atexit.register(service_log.close)
+
+
+# 记录请求日志的辅助方法：只放入队列，由后台线程写控制台和日志文件，请求线程不等待输出
+def log_message(message, client_ip=None, level="info", sample=None, **fields):
+    service_log.log(message, level=level, sample=sample, client=client_ip, **fields)
+
+
+# 提供给浏览器的静态文件（相对 BASE_DIR），启动时读入内存并预先压缩；不在列表中的路径一律返回404
+STATIC_FILES = ("game.html", "future.jpg")
+# 图片等资源的浏览器缓存时间（秒）；game.html 每次向服务器确认，修改后立即生效
+STATIC_MAX_AGE = 86400
+static_assets = StaticAssets(BASE_DIR, STATIC_FILES, max_age=STATIC_MAX_AGE, log=log_message)
 
 
-# 记录请求日志的辅助方法
-def log_message(message, client_ip=None):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    client_info = f"[Client: {client_ip}]" if client_ip else ""
-    print(f"{timestamp} {client_info} {message}")
+def build_initial_data():
+    """构建空的数据文件结构"""
+    return {
+        "received_data": {
+            "players": [],
+            "metadata": {
+                "description": "玩家数据存储",
+                "version": "1.0",
+                "total_players": 0,
+                "current_number": 0,
+                "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "color_info": "R、G、B字段表示玩家的颜色属性，取值范围为0-255整数"
+            }
+        },
+        "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "source_server": "http://localhost:10001/save_player_data"
+    }
 
 
 def initialize_data_file():
     """初始化数据文件，如果文件不存在则创建"""
     if not os.path.exists(DATA_FILE):
-        initial_data = {
-            "received_data": {
-                "players": [],
-                "metadata": {
-                    "description": "玩家数据存储",
-                    "version": "1.0",
-                    "total_players": 0,
-                    "current_number": 0,
-                    "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "color_info": "R、G、B字段表示玩家的颜色属性，取值范围为0-255整数"
-                }
-            },
-            "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "source_server": "http://localhost:10001/save_player_data"
-        }
-
         with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(initial_data, f, ensure_ascii=False, indent=4)
+            json.dump(build_initial_data(), f, ensure_ascii=False, indent=4)
 
 
-# 检查端口是否被占用
-def check_port_available(host='0.0.0.0', port=10001):
-    import socket
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        try:
-            s.bind((host, port))
-            return True
-        except socket.error:
-            return False
+def open_player_store():
+    """加载玩家数据到内存，并按STORAGE_MODE选择后台持久化方式"""
+    global player_store
+    if STORAGE_MODE == "shared":
+        # 多个进程共用同一个数据库，不在内存中保留权威数据
+        storage = SqliteStorage(DATABASE_FILE, build_initial_data, legacy_json_path=DATA_FILE, log=log_message)
+        player_store = SharedPlayerStore(storage, log=log_message).open()
+    elif STORAGE_MODE == "journal":
+        # 首次启动时会从现有的data.json迁移数据
+        journal = PlayerJournal(
+            JOURNAL_FILE,
+            SNAPSHOT_FILE,
+            DATA_FILE,
+            build_initial_data,
+            log=log_message
+        )
+        persister = JournalPersister(journal)
+    elif STORAGE_MODE == "sqlite":
+        # 数据库为空时从现有的data.json导入数据
+        storage = SqliteStorage(DATABASE_FILE, build_initial_data, legacy_json_path=DATA_FILE, log=log_message)
+        persister = StoragePersister(storage)
+    else:
+        initialize_data_file()
+        persister = JsonFilePersister(DATA_FILE, build_initial_data, log=log_message)
+    if STORAGE_MODE != "shared":
+        player_store = PlayerStore(persister, log=log_message).open()
+    atexit.register(player_store.close)
 
+    # 队列状态随快照更新，未变化时不会通知 /queue_events 的连接
+    queue_status_broadcaster.publish(build_queue_status(player_store.snapshot().player_count))
+    player_store.add_listener(
+        lambda snapshot: queue_status_broadcaster.publish(build_queue_status(snapshot.player_count))
+    )
 
-def read_data_file():
-    """读取数据文件"""
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError as e:
-        log_message(f"JSON解析错误: {str(e)}")
-        # 如果文件损坏，返回初始化结构
-        return {
-            "received_data": {
-                "players": [],
-                "metadata": {
-                    "total_players": 0,
-                    "current_number": 0,
-                    "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-            }
-        }
 
+def build_queue_status(total_players):
+    """根据玩家数量计算队列状态"""
+    current_number = 1  # 当前处理的编号，从1开始
+    
+    # 计算等待人数：total_players - current_number
+    queue_count = max(0, total_players - current_number)
+    
+    # 计算等待时间：等待人数 × 3分钟
+    wait_minutes = queue_count * 3
+    
+    # 格式化等待时间显示
+    if wait_minutes == 0:
+        wait_time_text = "无需等待"
+    elif wait_minutes <= 60:
+        wait_time_text = f"{wait_minutes}分钟"
+    else:
+        hours = wait_minutes // 60
+        minutes = wait_minutes % 60
+        if minutes == 0:
+            wait_time_text = f"{hours}小时"
+        else:
+            wait_time_text = f"{hours}小时{minutes}分钟"
+    
+    return {
+        "queue_count": queue_count,
+        "wait_time_text": wait_time_text,
+        "wait_minutes": wait_minutes,
+        "current_number": current_number,
+        "total_players": total_players
+    }
 
-def write_data_file(data):
-    """写入数据文件"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+
+def build_player_record(player_input, number):
+    """根据校验后的前端数据（validate_player_input 的结果）构建完整的玩家记录"""
+    return Player.new(
+        number,
+        name=f"{number}_@{player_input['Player Name']}",
+        money=player_input['Player Money'],
+        body_state=player_input['Player Body State'],
+        r=player_input['R'],
+        g=player_input['G'],
+        b=player_input['B'],
+        timestamp=datetime.now().isoformat()
+    )
+
+
+def append_player(player_input):
+    """分配编号并保存一个新玩家，返回分配的编号"""
+    player = player_store.add_player(lambda number: build_player_record(player_input, number))
+    return player['Number']
+
+
+def append_players(player_inputs):
+    """为一批玩家分配连续的编号并一次保存，返回分配的编号列表"""
+    players = player_store.add_players(lambda first_number: [
+        build_player_record(player_input, first_number + i) for i, player_input in enumerate(player_inputs)
+    ])
+    return [player['Number'] for player in players]
 
 
 @app.route('/')
 def serve_game():
     """提供game.html文件"""
-    log_message(f"请求根路径 - 客户端IP: {request.remote_addr}")
-    try:
-        # 使用正确的基础目录
-        game_html_path = os.path.join(BASE_DIR, 'game.html')
-        log_message(f"尝试提供文件: {game_html_path}")
-        
-        if os.path.exists(game_html_path):
-            return send_from_directory(BASE_DIR, 'game.html')
-        else:
-            log_message(f"game.html文件不存在: {game_html_path}")
-            return jsonify({"status": "error", "message": "游戏页面文件不存在"}), 404
-    except Exception as e:
-        log_message(f"提供game.html失败: {str(e)}")
-        return jsonify({"status": "error", "message": "无法提供游戏页面"}), 404
+    log_message(f"请求根路径 - 客户端IP: {request.remote_addr}", sample="static_file")
+    response = static_assets.response('game.html', request)
+    if response is None:
+        return jsonify({"status": "error", "message": "游戏页面文件不存在"}), 404
+    return response
 
 
 @app.route('/save_player_data', methods=['POST'])
@@ -121,55 +273,20 @@ def save_player_data():
     try:
         # 获取前端发送的数据
         player_data = request.get_json()
-        log_message(f"接收到玩家数据请求: {player_data}", request.remote_addr)
-
-        # 验证必要字段
-        required_fields = ['R', 'G', 'B', 'Player Money', 'Player Body State']
-        for field in required_fields:
-            if field not in player_data:
-                log_message(f"缺少必要字段: {field}", request.remote_addr)
-                return jsonify({
-                    "status": "error",
-                    "message": f"Missing required field: {field}"
-                }), 400
-
-        # 使用线程锁确保文件读写安全
-        with file_lock:
-            # 读取现有数据
-            data = read_data_file()
-
-            # 获取下一个编号
-            next_number = data['received_data']['metadata']['total_players']
-
-            # 构建完整的玩家数据对象
-            complete_player_data = {
-                "Player Name": f"{next_number}_@{player_data['Player Name']}",
-                "Player Money": player_data['Player Money'],
-                "Player Age": 18,
-                "Player Body State": player_data['Player Body State'],
-                "Player Mind State": 100,
-                "PlayerIQ": 120,
-                "Player El": 120,
-                "R": player_data['R'],
-                "G": player_data['G'],
-                "B": player_data['B'],
-                "Additional Info": "游戏生成的玩家数据",
-                "Number": next_number,
-                "Timestamp": datetime.now().isoformat()
-            }
-
-            # 添加玩家数据
-            data['received_data']['players'].append(complete_player_data)
-            data['received_data']['metadata']['total_players'] = data['received_data']['metadata']['total_players'] + 1
+        log_message(f"接收到玩家数据请求: {player_data}", request.remote_addr, level="debug")
 
-            # 更新元数据
-            # data['received_data']['metadata']['total_players'] = len(data['received_data']['players'])
-            # data['received_data']['metadata']['current_number'] = len(data['received_data']['players'])
-            data['received_data']['metadata']['last_updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            data['received_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # 一次完成必要字段、类型转换和范围检查
+        try:
+            player_input = validate_player_input(player_data)
+        except PlayerValidationError as e:
+            log_message(f"玩家数据无效: {str(e)}", request.remote_addr, level="warning")
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
 
-            # 写回文件
-            write_data_file(data)
+        # 编号分配在存储的写锁内完成，落盘由后台线程处理
+        next_number = append_player(player_input)
 
         log_message(f"玩家数据保存成功，编号: {next_number}", request.remote_addr)
         return jsonify({
@@ -180,36 +297,221 @@ def save_player_data():
 
     except Exception as e:
         import traceback
-        log_message(f"保存玩家数据时发生错误: {str(e)}", request.remote_addr)
-        log_message(f"错误详情: {traceback.format_exc()}")
+        log_message(f"保存玩家数据时发生错误: {str(e)}", request.remote_addr, level="error")
+        log_message(f"错误详情: {traceback.format_exc()}", level="error")
         return jsonify({
             "status": "error",
             "message": f"An error occurred: {str(e)}"
         }), 500
 
 
+@app.route('/save_player_data_batch', methods=['POST'])
+def save_player_data_batch():
+    """
+    批量保存玩家数据（离线登记后统一上传）
+
+    请求体为玩家数组，或 {"players": [...]}；逐个校验后，有效的玩家在一次加锁中分配连续的编号
+    并作为一条修改保存，无效的玩家不保存。results 与请求中的顺序一一对应。
+    """
+    try:
+        request_data = request.get_json(silent=True)
+        players_data = request_data.get('players') if isinstance(request_data, dict) else request_data
+        if not isinstance(players_data, list):
+            return jsonify({"status": "error", "message": "Request body must be a list of players or {\"players\": [...]}"}), 400
+        if len(players_data) > MAX_BATCH_PLAYERS:
+            return jsonify({
+                "status": "error",
+                "message": f"Too many players in one batch: {len(players_data)} > {MAX_BATCH_PLAYERS}"
+            }), 413
+
+        results = []
+        valid_players = []
+        for index, player_data in enumerate(players_data):
+            try:
+                valid_players.append((index, validate_player_input(player_data)))
+                results.append({"index": index, "status": "success"})
+            except PlayerValidationError as e:
+                results.append({"index": index, "status": "error", "message": str(e)})
+
+        numbers = append_players([player_input for _, player_input in valid_players]) if valid_players else []
+        for (index, _), number in zip(valid_players, numbers):
+            results[index]['player_number'] = number
+
+        saved_count = len(numbers)
+        failed_count = len(players_data) - saved_count
+        log_message(f"批量保存玩家数据：保存 {saved_count} 个，无效 {failed_count} 个"
+                    + (f"，编号 {numbers[0]}-{numbers[-1]}" if numbers else ""), request.remote_addr)
+
+        if failed_count == 0:
+            status, code = "success", 200
+        elif saved_count:
+            status, code = "partial", 200
+        else:
+            status, code = "error", 400
+        return jsonify({
+            "status": status,
+            "saved_count": saved_count,
+            "failed_count": failed_count,
+            "results": results
+        }), code
+
+    except Exception as e:
+        import traceback
+        log_message(f"批量保存玩家数据时发生错误: {str(e)}", request.remote_addr, level="error")
+        log_message(f"错误详情: {traceback.format_exc()}", level="error")
+        return jsonify({
+            "status": "error",
+            "message": f"An error occurred: {str(e)}"
+        }), 500
+
+
+def parse_int_arg(name, minimum=0):
+    """读取整数查询参数，未提供时返回None，格式错误时抛出ValueError"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    number = int(value)
+    if number < minimum:
+        raise ValueError(f"{name} must be >= {minimum}")
+    return number
+
+
+def parse_body_number(request_data, name, default, minimum, maximum, integer=False):
+    """
+    读取请求体中的数值参数并限制在 maximum 以内，未提供时使用 default；
+    不是数字（包括 true/false 和字符串）、不是有限值或小于 minimum 时抛出ValueError
+    """
+    value = request_data.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{name} must be {'an integer' if integer else 'a number'}")
+    if value < minimum:
+        raise ValueError(f"{name} must be >= {minimum}")
+    return min(value, maximum)
+
+
+def parse_fields_arg():
+    """读取 fields=R,G,B,Number 形式的字段投影参数，未提供时返回None"""
+    value = request.args.get('fields')
+    if not value:
+        return None
+    return [field.strip() for field in value.split(',') if field.strip()]
+
+
+def project_player(player, fields):
+    """只保留请求的字段"""
+    if fields is None:
+        return player
+    return {field: player[field] for field in fields if field in player}
+
+
+def conditional_json(snapshot, build_body):
+    """
+    基于快照版本的条件GET：If-None-Match 命中时直接返回304，不再序列化数据
+
+    Args:
+        snapshot: 生成响应所用的快照
+        build_body: 返回响应JSON对象的函数，只在需要时调用
+    """
+    etag = f"{player_store.instance_id}-{snapshot.version}-{zlib.crc32(request.full_path.encode('utf-8')):08x}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build_body())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @app.route('/get_player_data', methods=['GET'])
 def get_player_data():
-    """获取所有玩家数据"""
+    """
+    获取玩家数据
+
+    可选查询参数：
+        limit / offset: 分页
+        since_number: 只返回 Number 大于该值的玩家
+        fields: 逗号分隔的字段列表，只返回这些字段
+    不带参数时返回完整数据，与原来的格式相同；支持 ETag / If-None-Match。
+    """
     try:
-        log_message(f"接收到获取玩家数据请求", request.remote_addr)
-        with file_lock:
-            data = read_data_file()
-        log_message(f"返回玩家数据成功", request.remote_addr)
-        return jsonify(data)
+        log_message(f"接收到获取玩家数据请求", request.remote_addr, level="debug")
+        try:
+            limit = parse_int_arg('limit')
+            offset = parse_int_arg('offset') or 0
+            since_number = parse_int_arg('since_number', minimum=-1)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": f"Invalid query parameter: {str(e)}"}), 400
+        fields = parse_fields_arg()
+        snapshot = player_store.snapshot()
+
+        def build_body():
+            if limit is None and offset == 0 and since_number is None and fields is None:
+                return snapshot.document()
+
+            start = offset
+            if since_number is not None:
+                start += snapshot.index_after_number(since_number)
+            stop = None if limit is None else start + limit
+            players = [project_player(player, fields) for player in snapshot.players(start, stop)]
+
+            body = dict(snapshot.header)
+            body['received_data'] = {
+                "players": players,
+                "metadata": dict(snapshot.metadata)
+            }
+            has_more = start + len(players) < snapshot.player_count
+            body['pagination'] = {
+                "offset": offset,
+                "limit": limit,
+                "since_number": since_number,
+                "returned": len(players),
+                "total": snapshot.player_count,
+                "next_offset": offset + len(players) if has_more else None
+            }
+            return body
+
+        response = conditional_json(snapshot, build_body)
+        log_message(f"返回玩家数据成功 (状态码: {response.status_code})", request.remote_addr, sample="player_data")
+        return response
     except Exception as e:
         import traceback
-        log_message(f"获取玩家数据时发生错误: {str(e)}", request.remote_addr)
-        log_message(f"错误详情: {traceback.format_exc()}")
+        log_message(f"获取玩家数据时发生错误: {str(e)}", request.remote_addr, level="error")
+        log_message(f"错误详情: {traceback.format_exc()}", level="error")
         return jsonify({
             "status": "error",
             "message": f"An error occurred: {str(e)}"
         }), 500
 
 
+@app.route('/get_player/<int:number>', methods=['GET'])
+def get_player(number):
+    """按编号获取单个玩家，支持 fields 投影和 ETag"""
+    snapshot = player_store.snapshot()
+    player = snapshot.find_player(number)
+    if player is None:
+        return jsonify({"status": "error", "message": f"Player {number} not found"}), 404
+    fields = parse_fields_arg()
+    return conditional_json(snapshot, lambda: {
+        "status": "success",
+        "player": project_player(player, fields)
+    })
+
+
+@app.route('/latest_player', methods=['GET'])
+def latest_player():
+    """获取最后加入的玩家，供 game.html 显示数字分身颜色和编号"""
+    snapshot = player_store.snapshot()
+    player = snapshot.latest_player()
+    fields = parse_fields_arg()
+    return conditional_json(snapshot, lambda: {
+        "status": "success",
+        "player": project_player(player, fields) if player is not None else None
+    })
+
+
 @app.route('/transfer_player_data', methods=['POST'])
 def transfer_player_data():
-    """复制完整的data.json数据到远程服务器，不删除本地数据"""
+    """把C:\\output中的文件放入发件箱并交给后台线程同步到远程服务器，UE取样直接从本地数据返回"""
     try:
         log_message(f"接收到数据传输请求", request.remote_addr)
 
@@ -220,17 +522,23 @@ def transfer_player_data():
         
         # 检查是否是UE游戏请求，以及是否有数据需要发送
         is_ue_game_request = 'CanGenerateAgantNum' in request_data
+        use_lease = bool(request_data.get('UseLease'))
         should_send_to_cloud = False
         
         if is_ue_game_request:
-            # 检查是否有数据可以发送给UE游戏
-            with file_lock:
-                current_data = read_data_file()
-                available_players = current_data['received_data']['players']
+            try:
+                num_samples = parse_body_number(request_data, 'CanGenerateAgantNum', 0, 0, MAX_UE_SAMPLES, integer=True)
+                lease_seconds = parse_body_number(request_data, 'LeaseSeconds', UE_SAMPLE_LEASE_SECONDS, 1, MAX_UE_LEASE_SECONDS)
+            except ValueError as e:
+                log_message(f"UE游戏请求参数无效: {str(e)}", request.remote_addr, level="warning")
+                return jsonify({"status": "error", "message": str(e)}), 400
+
+            # 检查是否有数据可以发送给UE游戏（租约中的样本不算）
+            available_count = player_store.available_count()
                 
-            if len(available_players) > 0:
+            if available_count > 0:
                 should_send_to_cloud = True
-                log_message(f"UE游戏请求且有 {len(available_players)} 个玩家数据，需要先向云服务器传输", request.remote_addr)
+                log_message(f"UE游戏请求且有 {available_count} 个玩家数据，需要向云服务器传输", request.remote_addr)
             else:
                 log_message(f"UE游戏请求但没有可用的玩家数据，跳过云服务器传输", request.remote_addr)
         
@@ -238,26 +546,23 @@ def transfer_player_data():
         if not should_send_to_cloud:
             if is_ue_game_request:
                 # 直接处理UE游戏请求，不进行云服务器传输
-                with file_lock:
-                    current_data = read_data_file()
+                snapshot = player_store.snapshot()
                 
                 response_data = {
                     "status": "success",
-                    "data": current_data['received_data'],
                     "transfer_type": "no_cloud_transfer",
-                    "total_players": len(current_data['received_data']['players']),
+                    "total_players": snapshot.player_count,
                     "files_count": 0,
                     "cloud_transfer_skipped": True
                 }
-                
-                # 仍然处理UE游戏数据请求
-                num_samples = request_data['CanGenerateAgantNum']
-                all_players = current_data['received_data']['players']
+                if not use_lease:
+                    # 旧版UE客户端读取响应中的完整数据，保持兼容；使用租约的客户端不需要
+                    response_data["data"] = snapshot.document()['received_data']
                 
                 response_data.update({
                     "ue_game_data": {
                         "players": [],
-                        "metadata": current_data['received_data']['metadata']
+                        "metadata": dict(snapshot.metadata)
                     },
                     "requested_samples": num_samples,
                     "actual_samples": 0,
@@ -267,171 +572,67 @@ def transfer_player_data():
                 return jsonify(response_data)
             else:
                 # 非UE游戏请求且不需要传输，直接返回
-                with file_lock:
-                    current_data = read_data_file()
-                
                 return jsonify({
                     "status": "success",
                     "message": "No transfer needed",
-                    "total_players": len(current_data['received_data']['players']),
+                    "total_players": player_store.snapshot().player_count,
                     "files_count": 0,
                     "cloud_transfer_skipped": True
                 })
         
-        # === 需要向云服务器传输的情况 ===
-        log_message(f"开始执行云服务器传输流程", request.remote_addr)
-        
-        # 收集 C:\output 路径下的 csv 和 txt 文件
-        files_to_transfer = []
-        output_path = "C:\\output"
-        
-        try:
-            if os.path.exists(output_path):
-                for filename in os.listdir(output_path):
-                    file_path = os.path.join(output_path, filename)
-                    if os.path.isfile(file_path) and filename.lower().endswith(('.csv', '.txt')):
-                        try:
-                            with open(file_path, 'rb') as f:
-                                file_content = f.read()
-                            files_to_transfer.append({
-                                'filename': filename,
-                                'content': file_content.hex()  # 将二进制文件转换为十六进制字符串传输
-                            })
-                            log_message(f"成功读取文件: {filename}")
-                        except Exception as e:
-                            log_message(f"读取文件 {filename} 失败: {str(e)}")
-                log_message(f"总共收集到 {len(files_to_transfer)} 个文件用于传输")
-            else:
-                log_message(f"C:\\output 路径不存在，跳过文件传输")
-        except Exception as e:
-            log_message(f"收集文件时发生异常: {str(e)}")
+        # === 需要向云服务器传输的情况：只在本地排队，由后台线程完成 ===
+        files_queued = queue_output_files()
+        request_cloud_sync()
+        log_message(f"已将 {files_queued} 个文件放入发件箱，云服务器传输在后台进行", request.remote_addr)
 
-        with file_lock:
-            # 读取完整的当前数据（传输前的数据）
-            current_data = read_data_file()
+        # 取样前的数据
+        snapshot = player_store.snapshot()
 
-            # 构建要返回的数据（完整复制）
-            response_data = {
-                "status": "success",
-                "data": current_data['received_data'],  # 传输完整数据
-                "transfer_type": "full_copy",  # 标记为完整复制
-                "total_players": len(current_data['received_data']['players']),
-                "files_count": len(files_to_transfer),  # 添加文件数量信息
-                "cloud_transfer_executed": True
-            }
-
-        log_message(f"成功读取完整数据，包含 {len(current_data['received_data']['players'])} 个玩家，准备传输 {len(files_to_transfer)} 个文件", request.remote_addr)
-
-        # 先向云服务器发送当前的data.json数据
-        try:
-            import requests
-            remote_server_url = "http://47.118.21.234:10002/receive_transferred_data"
-            log_message(f"开始将完整数据发送到远程服务器: {remote_server_url}")
-
-            # 发送完整数据结构，包含玩家数据和文件数据
-            send_data = {
-                "status": "success",
-                "data": current_data['received_data'],  # 传输完整数据
-                "transfer_type": "full_copy",
-                "total_players": len(current_data['received_data']['players']),
-                "files": files_to_transfer  # 添加收集到的文件数据
-            }
-
-            # 设置超时为30秒
-            response = requests.post(remote_server_url, json=send_data, timeout=30)
-            
-            log_message(f"远程服务器响应状态码: {response.status_code}")
-            
-            if response.status_code == 200:
-                try:
-                    remote_response = response.json()
-                    log_message(f"完整数据成功发送到远程服务器，远程服务器响应: {remote_response}")
-                except Exception as json_error:
-                    log_message(f"解析远程服务器JSON响应失败: {str(json_error)}")
-            else:
-                log_message(f"发送数据到远程服务器失败，状态码: {response.status_code}, 响应: {response.text}")
-                
-        except Exception as e:
-            log_message(f"发送数据到远程服务器时发生异常: {str(e)}")
-        
-        # 清空C:\output下的文件
-        if len(files_to_transfer) > 0:
-            log_message(f"开始清空 C:\\output 中的 {len(files_to_transfer)} 个文件")
-            try:
-                files_deleted = 0
-                for filename in os.listdir(output_path):
-                    file_path = os.path.join(output_path, filename)
-                    if os.path.isfile(file_path) and filename.lower().endswith(('.csv', '.txt')):
-                        try:
-                            os.remove(file_path)
-                            files_deleted += 1
-                            log_message(f"成功删除文件: {filename}")
-                        except Exception as e:
-                            log_message(f"删除文件 {filename} 失败: {str(e)}")
-                log_message(f"总共删除了 {files_deleted} 个文件")
-            except Exception as e:
-                log_message(f"清空 C:\\output 文件夹时发生异常: {str(e)}")
-        else:
-            log_message(f"没有文件需要删除")
+        response_data = {
+            "status": "success",
+            "transfer_type": "full_copy",
+            "total_players": snapshot.player_count,
+            "files_count": files_queued,  # 添加文件数量信息
+            "cloud_transfer_queued": True
+        }
+        if not use_lease:
+            # 旧版UE客户端读取响应中的完整数据，保持兼容；使用租约的请求只处理领取到的记录
+            response_data["data"] = snapshot.document()['received_data']
 
-        # === 云服务器传输完成后，处理UE游戏请求 ===
+        # === 处理UE游戏请求 ===
         if is_ue_game_request:
             try:
-                num_samples = request_data['CanGenerateAgantNum']
-                log_message(f"云服务器传输完成，现在处理UE游戏请求 {num_samples} 个样本数据", request.remote_addr)
+                log_message(f"处理UE游戏请求 {num_samples} 个样本数据", request.remote_addr)
                 
-                with file_lock:
-                    # 重新读取当前数据（使用传输前的数据进行UE游戏处理）
-                    all_players = current_data['received_data']['players']
-                    
-                    # 如果请求的样本数量超过可用数量，则调整实际提取数量
-                    if num_samples > len(all_players):
-                        actual_samples = len(all_players)
-                        log_message(f"请求 {num_samples} 个样本，但只有 {actual_samples} 个可用，返回所有可用样本", request.remote_addr)
-                    else:
-                        actual_samples = num_samples
-                    
-                    # 提取指定数量的样本（从前端开始取）
-                    samples_to_send = all_players[:actual_samples]
-                    remaining_players = all_players[actual_samples:]
-                    
-                    # 更新元数据
-                    metadata = current_data['received_data']['metadata']
-                    
-                    # 创建新的数据结构，只保留剩余玩家，更新metadata
-                    new_data = {
-                        "received_data": {
-                            "players": remaining_players,
-                            "metadata": {
-                                "description": metadata['description'],
-                                "version": metadata['version'],
-                                "total_players": metadata['total_players'],
-                                "current_number": metadata['current_number'] + actual_samples,
-                                "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                "color_info": metadata['color_info']
-                            }
-                        },
-                        "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "source_server": current_data['source_server']
-                    }
-                    
-                    # 写回更新后的数据（已删除发送的样本）
-                    write_data_file(new_data)
+                # 从队首原子地取出样本；确认后的出队也会在下次云同步时发送
+                lease_id = None
+                if use_lease:
+                    lease_id, samples_to_send = player_store.claim(num_samples, lease_seconds)
+                    response_data.update({"lease_id": lease_id, "lease_seconds": lease_seconds})
+                else:
+                    samples_to_send = player_store.dequeue(num_samples)
+                actual_samples = len(samples_to_send)
+                if actual_samples < num_samples:
+                    log_message(f"请求 {num_samples} 个样本，但只有 {actual_samples} 个可用，返回所有可用样本", request.remote_addr)
+                remaining_count = player_store.snapshot().player_count
                 
                 # 更新响应数据，添加UE游戏相关信息
                 response_data.update({
                     "ue_game_data": {
                         "players": samples_to_send,
-                        "metadata": current_data['received_data']['metadata']
+                        "metadata": dict(snapshot.metadata)
                     },
                     "requested_samples": num_samples,
                     "actual_samples": actual_samples
                 })
                 
-                log_message(f"成功发送 {actual_samples} 个玩家数据样本给UE游戏，本地剩余 {len(remaining_players)} 个玩家", request.remote_addr)
+                if lease_id:
+                    log_message(f"以租约 {lease_id} 发送 {actual_samples} 个玩家数据样本给UE游戏，等待确认", request.remote_addr)
+                else:
+                    log_message(f"成功发送 {actual_samples} 个玩家数据样本给UE游戏，本地剩余 {remaining_count} 个玩家", request.remote_addr)
                 
             except Exception as e:
-                log_message(f"UE游戏数据处理时发生错误: {str(e)}", request.remote_addr)
+                log_message(f"UE游戏数据处理时发生错误: {str(e)}", request.remote_addr, level="error")
                 # UE游戏处理错误不影响云服务器的成功结果
                 response_data["ue_game_error"] = str(e)
 
@@ -439,79 +640,391 @@ def transfer_player_data():
 
     except Exception as e:
         import traceback
-        log_message(f"数据传输时发生错误: {str(e)}", request.remote_addr)
-        log_message(f"错误详情: {traceback.format_exc()}")
+        log_message(f"数据传输时发生错误: {str(e)}", request.remote_addr, level="error")
+        log_message(f"错误详情: {traceback.format_exc()}", level="error")
         return jsonify({
             "status": "error",
             "message": f"An error occurred: {str(e)}"
         }), 500
 
 
+@app.route('/ack_player_samples', methods=['POST'])
+def ack_player_samples():
+    """确认UE已经处理完一个租约中的样本，样本随之出队"""
+    try:
+        request_data = request.get_json(silent=True) or {}
+        lease_id = request_data.get('lease_id')
+        if not lease_id:
+            return jsonify({"status": "error", "message": "缺少 lease_id"}), 400
+
+        acked = player_store.ack(lease_id)
+        if acked is None:
+            # 租约已过期时样本已经退回队列，可能会再次发出
+            log_message(f"确认取样租约 {lease_id} 失败：租约不存在或已过期", request.remote_addr, level="warning")
+            return jsonify({"status": "error", "message": "租约不存在或已过期"}), 409
+
+        log_message(f"取样租约 {lease_id} 已确认，{acked} 个玩家出队", request.remote_addr)
+        return jsonify({
+            "status": "success",
+            "acked_samples": acked,
+            "available_players": player_store.available_count()
+        })
+    except Exception as e:
+        log_message(f"确认取样时发生错误: {str(e)}", request.remote_addr, level="error")
+        return jsonify({"status": "error", "message": f"An error occurred: {str(e)}"}), 500
+
+
+@app.route('/cloud_sync_status', methods=['GET'])
+def cloud_sync_status():
+    """返回后台云同步的状态：是否在重试、最近的错误、发件箱中剩余的文件数等"""
+    try:
+        # 多个 worker 进程时只有一个进程负责云同步，其他进程返回 standby
+        status = cloud_sync_worker.status() if cloud_sync_worker is not None else {"state": "standby"}
+        status.update({
+            "pending_files": len(cloud_outbox.pending()),
+            "local_sequence": player_store.snapshot().metadata.get('sequence', 0),
+            "synced_sequence": synced_sequence,
+            "http": http_client.stats()  # 按主机统计的出站请求耗时
+        })
+        return jsonify({"status": "success", "cloud_sync": status})
+    except Exception as e:
+        log_message(f"获取云同步状态时发生错误: {str(e)}", request.remote_addr, level="error")
+        return jsonify({"status": "error", "message": f"An error occurred: {str(e)}"}), 500
+
+
+def start_cloud_sync():
+    """打开发件箱并启动后台云同步线程；多个 worker 进程时只有拿到云同步锁的进程启动"""
+    global cloud_outbox, cloud_sync_lock, cloud_file_manifest, cloud_sync_worker, http_client
+    http_client = HttpClient(log=log_message)
+    cloud_outbox = FileOutbox(OUTBOX_DIR)
+    if STORAGE_MODE == "shared":
+        # 锁一直持有到进程退出，负责的进程退出后由其他进程重启时接手
+        cloud_sync_lock = FileLock(CLOUD_SYNC_LOCK_FILE)
+        if not cloud_sync_lock.acquire(blocking=False):
+            log_message("云同步由另一个进程负责，本进程只把输出文件放入发件箱")
+            return
+        # 其他进程处理的UE取样请求只体现在数据库中，出队后请求同步
+        player_store.add_listener(request_cloud_sync_on_dequeue)
+    cloud_file_manifest = FileManifest(OUTBOX_MANIFEST, log=log_message)
+    cloud_sync_worker = SyncWorker(
+        run_cloud_sync,
+        interval=CLOUD_SYNC_INTERVAL,
+        max_backoff=CLOUD_SYNC_MAX_BACKOFF,
+        log=log_message
+    ).start()
+    # 在 player_store 之前关闭（atexit 按注册的相反顺序执行）
+    atexit.register(cloud_sync_worker.close, 10)
+
+
+def request_cloud_sync():
+    """请求后台同步；不负责云同步的进程什么也不做，由负责的进程发现数据变化或定期同步"""
+    if cloud_sync_worker is not None:
+        cloud_sync_worker.request()
+
+
+_last_current_number = None
+
+
+def request_cloud_sync_on_dequeue(snapshot):
+    """快照监听器：current_number 变化（有玩家出队）时请求同步"""
+    global _last_current_number
+    current_number = snapshot.metadata.get('current_number')
+    if _last_current_number is not None and current_number != _last_current_number:
+        request_cloud_sync()
+    _last_current_number = current_number
+
+
+def initialize_backend():
+    """加载玩家数据并启动后台云同步；asgi 模式下由服务器在每个进程开始接受请求前调用"""
+    if player_store is None:
+        open_player_store()
+        start_cloud_sync()
+
+
+def queue_output_files():
+    """把C:\\output中的csv和txt文件移入发件箱，返回移入的文件数"""
+    if not os.path.exists(OUTPUT_PATH):
+        log_message(f"C:\\output 路径不存在，跳过文件传输", level="warning")
+        return 0
+    queued = 0
+    for file_path in list_transfer_files(OUTPUT_PATH):
+        try:
+            cloud_outbox.put(file_path)
+            queued += 1
+        except Exception as e:
+            log_message(f"移动文件 {os.path.basename(file_path)} 到发件箱失败: {str(e)}", level="warning")
+    return queued
+
+
+def run_cloud_sync():
+    """
+    上传发件箱中的文件并把玩家数据同步到远程服务器，由后台线程调用
+
+    只上传远程服务器按内容哈希确认缺少的文件，远程确认收到后才从发件箱删除；
+    任何一步失败都抛出异常，由 SyncWorker 退避后重试
+    """
+    global synced_sequence
+
+    pending_files = cloud_outbox.pending()
+    if not pending_files and player_store.snapshot().metadata.get('sequence') == synced_sequence:
+        return {"skipped": True}
+
+    encoding = negotiate_transfer_encoding(http_client)
+    try:
+        files_to_upload, present_files = select_missing_files(http_client, pending_files)
+        uploaded_paths, legacy_paths, failed_count = upload_output_files(http_client, files_to_upload, encoding)
+        for file_path in uploaded_paths:
+            confirm_file_delivered(file_path)
+    finally:
+        cloud_file_manifest.save()
+
+    remote_server_url = f"{REMOTE_SERVER}/receive_transferred_data"
+
+    # 只发送远程水位之后的修改；文件已经单独上传，这里只带上文件名
+    present = [{"filename": os.path.basename(file_path), "sha256": sha256} for file_path, sha256 in present_files]
+    send_data = build_sync_payload(fetch_remote_sync_state(http_client))
+    send_data.update({
+        "uploaded_files": [os.path.basename(file_path) for file_path in uploaded_paths],
+        "present_files": present,  # 远程已有相同内容、没有上传的文件，由远程在本地复制
+        "files": read_files_as_hex(legacy_paths)  # 远程服务器不支持流式上传时的十六进制文件数据
+    })
+    log_message(f"开始将数据发送到远程服务器: {remote_server_url}，传输类型: {send_data['transfer_type']}")
+
+    response = send_transfer_payload(http_client, remote_server_url, send_data, encoding)
+    if response.status_code == 409 and send_data['transfer_type'] == 'delta':
+        # 远程水位在查询之后发生了变化，改为完整复制；文件已经保存过，不再重复发送，
+        # present_files 再发送一次（已经复制过的文件远程不会重复处理），以这次的响应确认
+        log_message(f"远程服务器拒绝增量同步，改为完整复制: {response.text}")
+        send_data = build_full_copy_payload(player_store.snapshot())
+        send_data.update({"uploaded_files": [], "present_files": present, "files": []})
+        response = send_transfer_payload(http_client, remote_server_url, send_data, encoding)
+
+    log_message(f"远程服务器响应状态码: {response.status_code}")
+    if response.status_code != 200:
+        raise RuntimeError(f"发送数据到远程服务器失败，状态码: {response.status_code}, 响应: {response.text[:200]}")
+
+    for file_path in legacy_paths:
+        confirm_file_delivered(file_path)
+    # 远程找不到相同内容的文件（例如在查询后被删除）留在发件箱，下一轮重新上传
+    unresolved = set(response.json().get('unresolved_files', []))
+    for file_path, _ in present_files:
+        if os.path.basename(file_path) not in unresolved:
+            confirm_file_delivered(file_path)
+    cloud_file_manifest.save()
+    metadata = send_data['metadata'] if send_data['transfer_type'] == 'delta' else send_data['data']['metadata']
+    synced_sequence = metadata.get('sequence')
+    log_message(f"数据成功同步到远程服务器，序号 {synced_sequence}，上传 {len(uploaded_paths) + len(legacy_paths)} 个文件")
+
+    if failed_count:
+        raise RuntimeError(f"{failed_count} 个文件上传失败，保留在发件箱中等待重试")
+    return {
+        "transfer_type": send_data['transfer_type'],
+        "sequence": synced_sequence,
+        "changes": len(send_data.get('changes', [])),
+        "files": len(uploaded_paths) + len(legacy_paths),
+        "files_already_on_remote": len(pending_files) - len(files_to_upload)
+    }
+
+
+def confirm_file_delivered(file_path):
+    """远程服务器已确认收到文件内容：在清单中标记并从发件箱删除"""
+    cloud_file_manifest.update(os.path.basename(file_path), delivered_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    cloud_outbox.remove(file_path)
+
+
+def select_missing_files(http, file_paths):
+    """
+    按内容哈希询问远程服务器缺少哪些文件
+
+    以前已经送达过的相同内容直接确认并从发件箱删除；远程已有相同内容的文件
+    在同步请求的 present_files 中告诉远程服务器，远程处理后才确认；
+    远程服务器不支持查询时返回全部文件
+
+    Returns:
+        (需要上传的文件路径列表, 远程已有内容的 [(文件路径, sha256)])
+    """
+    hashes = {}
+    for file_path in file_paths:
+        filename = os.path.basename(file_path)
+        previous = cloud_file_manifest.get(filename)
+        sha256 = cloud_file_manifest.hash_file(file_path)
+        if previous and previous.get('delivered_at') and previous['sha256'] == sha256:
+            log_message(f"文件 {filename} 的内容已经送达过，不再上传", level="debug")
+            confirm_file_delivered(file_path)
+            continue
+        hashes[file_path] = sha256
+    if not hashes:
+        return [], []
+
+    files = [
+        {"filename": os.path.basename(file_path), "sha256": sha256, "size": os.path.getsize(file_path)}
+        for file_path, sha256 in hashes.items()
+    ]
+    response = http.post(f"{REMOTE_SERVER}/missing_files", json={"files": files}, timeout=30)
+    if response.status_code != 200:
+        log_message(f"远程服务器不支持文件清单查询（状态码 {response.status_code}），上传全部 {len(hashes)} 个文件")
+        return list(hashes), []
+
+    missing = set(response.json().get('missing', []))
+    present = [(file_path, sha256) for file_path, sha256 in hashes.items() if sha256 not in missing]
+    for file_path, _ in present:
+        log_message(f"远程服务器已有文件 {os.path.basename(file_path)} 的内容，不再上传", level="debug")
+    return [file_path for file_path, sha256 in hashes.items() if sha256 in missing], present
+
+
+def fetch_remote_sync_state(http):
+    """获取远程服务器已同步到的水位，旧版服务器或请求失败时返回None"""
+    try:
+        response = http.get(f"{REMOTE_SERVER}/sync_state", timeout=5)
+        if response.status_code == 200:
+            return response.json()
+        log_message(f"远程服务器不支持增量同步，状态码: {response.status_code}")
+    except Exception as e:
+        log_message(f"获取远程同步水位失败: {str(e)}", level="warning")
+    return None
+
+
+def build_full_copy_payload(snapshot):
+    """构建完整复制请求"""
+    return {
+        "status": "success",
+        "data": snapshot.document()['received_data'],  # 传输完整数据
+        "transfer_type": "full_copy",
+        "total_players": snapshot.player_count
+    }
+
+
+def build_sync_payload(remote_state):
+    """根据远程水位构建增量同步请求；数据集不同或修改日志不够时构建完整复制请求"""
+    snapshot = player_store.snapshot()
+    if remote_state and remote_state.get('sync_id') == snapshot.metadata.get('sync_id'):
+        base_sequence = remote_state.get('sequence', 0)
+        changes, snapshot = player_store.changes_since(base_sequence)
+        if changes is not None:
+            return {
+                "status": "success",
+                "transfer_type": "delta",
+                "sync_id": snapshot.metadata['sync_id'],
+                "base_sequence": base_sequence,
+                "changes": encode_changes(changes),
+                "metadata": dict(snapshot.metadata),
+                "total_players": snapshot.player_count
+            }
+        log_message(f"远程水位 {base_sequence} 之后的修改已不在内存修改日志中，改为完整复制")
+    return build_full_copy_payload(snapshot)
+
+
+def send_transfer_payload(http, url, payload, encoding):
+    """发送同步请求，远程服务器不支持协商的编码时以未压缩方式重发"""
+    response = post_json(http, url, payload, encoding, TRANSFER_COMPRESSION_LEVEL)
+    if response.status_code == 415 and encoding is not None:
+        # 远程服务器不再支持协商的编码，重新协商并以未压缩方式重发
+        reset_transfer_encoding()
+        response = post_json(http, url, payload)
+    return response
+
+
+def negotiate_transfer_encoding(http):
+    """从远程服务器的 /health 获取支持的压缩编码并选择压缩方式，结果会被缓存"""
+    global remote_transfer_encodings
+    if TRANSFER_COMPRESSION == "none":
+        return None
+    if remote_transfer_encodings is None:
+        try:
+            response = http.get(f"{REMOTE_SERVER}/health", timeout=5)
+            remote_transfer_encodings = response.json().get('transfer_encodings') or []
+            log_message(f"远程服务器支持的压缩编码: {remote_transfer_encodings}")
+        except Exception as e:
+            log_message(f"获取远程服务器压缩编码失败，本次不压缩: {str(e)}", level="warning")
+            return None
+    return choose_encoding(remote_transfer_encodings, TRANSFER_COMPRESSION)
+
+
+def reset_transfer_encoding():
+    """清除缓存的协商结果，下次传输时重新协商"""
+    global remote_transfer_encodings
+    remote_transfer_encodings = None
+
+
+def upload_output_file(http, file_path, sha256, encoding=None):
+    """上传单个文件：大文件分块续传，远程服务器不支持分块上传或文件较小时一次上传"""
+    if os.path.getsize(file_path) >= RESUMABLE_UPLOAD_THRESHOLD:
+        response = upload_file_resumable(http, REMOTE_SERVER, file_path, sha256, encoding,
+                                         TRANSFER_COMPRESSION_LEVEL, chunk_size=UPLOAD_CHUNK_SIZE)
+        if response is not None:
+            return response
+        log_message(f"远程服务器不支持分块上传，一次上传文件 {os.path.basename(file_path)}")
+    return upload_file(http, f"{REMOTE_SERVER}/upload_file", file_path, encoding, TRANSFER_COMPRESSION_LEVEL, sha256=sha256)
+
+
+def upload_output_files(http, file_paths, encoding=None):
+    """
+    把文件逐个以二进制流上传到远程服务器，encoding 不为空时边读边压缩
+
+    Returns:
+        (已上传的文件路径列表, 需要以十六进制嵌入JSON发送的文件路径列表, 上传失败的文件数)；
+        远程服务器还不支持 /upload_file 时，退回到原来的十六进制方式
+    """
+    uploaded_paths = []
+    failed_count = 0
+    for i, file_path in enumerate(file_paths):
+        filename = os.path.basename(file_path)
+        sha256 = cloud_file_manifest.hash_file(file_path)
+        try:
+            response = upload_output_file(http, file_path, sha256, encoding)
+            if response.status_code == 415 and encoding is not None:
+                reset_transfer_encoding()
+                encoding = None
+                response = upload_output_file(http, file_path, sha256)
+        except Exception as e:
+            log_message(f"上传文件 {filename} 失败: {str(e)}", level="warning")
+            failed_count += 1
+            continue
+        if response.status_code == 404 and not uploaded_paths:
+            log_message(f"远程服务器不支持流式上传，改用十六进制方式发送 {len(file_paths) - i} 个文件")
+            return uploaded_paths, file_paths[i:], failed_count
+        if response.status_code == 200:
+            uploaded_paths.append(file_path)
+            log_message(f"成功上传文件: {filename}", level="debug")
+        else:
+            log_message(f"上传文件 {filename} 失败，状态码: {response.status_code}", level="warning")
+            failed_count += 1
+    return uploaded_paths, [], failed_count
+
+
+def read_files_as_hex(file_paths):
+    """读取文件并转换为十六进制字符串（旧版远程服务器的传输格式）"""
+    files = []
+    for file_path in file_paths:
+        try:
+            with open(file_path, 'rb') as f:
+                files.append({
+                    'filename': os.path.basename(file_path),
+                    'content': f.read().hex()
+                })
+        except Exception as e:
+            log_message(f"读取文件 {os.path.basename(file_path)} 失败: {str(e)}", level="warning")
+    return files
+
+
 @app.route('/get_queue_status', methods=['GET'])
 def get_queue_status():
-    """获取队列状态信息，从本地data.json读取玩家数据计算队列"""
+    """获取队列状态信息，直接返回缓存的队列状态"""
     try:
-        log_message(f"接收到获取队列状态请求", request.remote_addr)
+        log_message(f"接收到获取队列状态请求", request.remote_addr, level="debug")
         
-        # 读取本地的data.json文件（用户的数据保存在这里）
-        local_data_file = DATA_FILE  # 使用全局定义的DATA_FILE
-        log_message(f"尝试读取数据文件: {local_data_file}")
+        queue_status = queue_status_broadcaster.value
         
-        if os.path.exists(local_data_file):
-            with file_lock:
-                data = read_data_file()
-            
-            # 从本地data.json获取玩家数据
-            players = data.get('received_data', {}).get('players', [])
-            total_players = len(players)  # 总玩家数 = 实际玩家数量
-            current_number = 1  # 当前处理的编号，从1开始
-            
-            # 计算等待人数：total_players - current_number
-            queue_count = max(0, total_players - current_number)
-            
-            # 计算等待时间：等待人数 × 3分钟
-            wait_minutes = queue_count * 3
-            
-            # 格式化等待时间显示
-            if wait_minutes == 0:
-                wait_time_text = "无需等待"
-            elif wait_minutes <= 60:
-                wait_time_text = f"{wait_minutes}分钟"
-            else:
-                hours = wait_minutes // 60
-                minutes = wait_minutes % 60
-                if minutes == 0:
-                    wait_time_text = f"{hours}小时"
-                else:
-                    wait_time_text = f"{hours}小时{minutes}分钟"
-            
-            queue_status = {
-                "queue_count": queue_count,
-                "wait_time_text": wait_time_text,
-                "wait_minutes": wait_minutes,
-                "current_number": current_number,
-                "total_players": total_players
-            }
-            
-            log_message(f"队列状态: 排队{queue_count}人, 等待时间{wait_time_text} (总玩家:{total_players})", request.remote_addr)
-            return jsonify({
-                "status": "success",
-                **queue_status
-            })
-        else:
-            log_message(f"本地data.json文件不存在", request.remote_addr)
-            return jsonify({
-                "status": "error",
-                "message": "Queue data not available",
-                "queue_count": 0,
-                "wait_time_text": "数据不可用",
-                "wait_minutes": 0
-            })
+        log_message(f"队列状态: 排队{queue_status['queue_count']}人, 等待时间{queue_status['wait_time_text']} (总玩家:{queue_status['total_players']})", request.remote_addr, sample="queue_status")
+        return jsonify({
+            "status": "success",
+            **queue_status
+        })
             
     except Exception as e:
         import traceback
-        log_message(f"获取队列状态时发生错误: {str(e)}", request.remote_addr)
-        log_message(f"错误详情: {traceback.format_exc()}")
+        log_message(f"获取队列状态时发生错误: {str(e)}", request.remote_addr, level="error")
+        log_message(f"错误详情: {traceback.format_exc()}", level="error")
         return jsonify({
             "status": "error",
             "message": f"An error occurred: {str(e)}",
@@ -521,31 +1034,137 @@ def get_queue_status():
         }), 500
 
 
+@app.route('/queue_events', methods=['GET'])
+def queue_events():
+    """
+    以 Server-Sent Events 推送队列状态
+
+    连接建立时先推送一次当前状态，之后只在队列状态变化时推送；
+    每个连接只占用一个服务器线程，空闲时只有定期心跳。
+    """
+    log_message(f"队列状态推送连接建立", request.remote_addr)
+    client_ip = request.remote_addr
+
+    def stream():
+        version = -1
+        # 建议浏览器断线后3秒重连
+        yield "retry: 3000\n\n"
+        try:
+            while True:
+                new_version, queue_status = queue_status_broadcaster.wait(version, timeout=QUEUE_EVENTS_HEARTBEAT)
+                if new_version == version:
+                    yield ": keep-alive\n\n"
+                    continue
+                version = new_version
+                payload = json.dumps({"status": "success", **queue_status}, ensure_ascii=False)
+                yield f"id: {version}\nevent: queue_status\ndata: {payload}\n\n"
+        finally:
+            log_message(f"队列状态推送连接断开", client_ip)
+
+    return app.response_class(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查端点"""
-    log_message(f"健康检查请求", request.remote_addr)
-    return jsonify({"status": "ok", "message": "Server is running"})
+    log_message(f"健康检查请求", request.remote_addr, sample="health")
+    return jsonify(health_status())
+
+
+def health_status():
+    """健康检查的内容，包括尚未确认的UE取样租约数，便于发现UE没有确认租约"""
+    status = {"status": "ok", "message": "Server is running"}
+    if player_store is not None:
+        status.update({
+            "active_leases": player_store.lease_count(),
+            "available_players": player_store.available_count()
+        })
+    return status
+
+
+# ---------- asgi 模式：长连接和简单查询直接在事件循环中处理 ----------
+
+asgi_app = AsgiApp(
+    app,
+    threads=SERVER_THREADS,
+    startup=initialize_backend,
+    default_headers=[("Access-Control-Allow-Origin", "*")],
+    service="game_backend",
+    log=log_message
+)
+
+
+def _asgi_client(scope):
+    return (scope.get('client') or ("", 0))[0]
+
+
+@asgi_app.route('/get_queue_status')
+async def get_queue_status_async(scope, receive, send):
+    """与 /get_queue_status 相同，直接返回缓存的队列状态"""
+    queue_status = queue_status_broadcaster.value
+    await send_json(send, {"status": "success", **queue_status}, headers=asgi_app.default_headers)
+
+
+@asgi_app.route('/health')
+async def health_check_async(scope, receive, send):
+    """健康检查端点；shared 模式下租约数需要查询数据库，在线程池中执行"""
+    status = await asyncio.get_running_loop().run_in_executor(None, health_status)
+    await send_json(send, status, headers=asgi_app.default_headers)
+
 
+@asgi_app.route('/queue_events')
+async def queue_events_async(scope, receive, send):
+    """与 /queue_events 相同的 SSE 推送，等待期间不占用线程"""
+    client_ip = _asgi_client(scope)
+    log_message(f"队列状态推送连接建立", client_ip)
 
-# 添加静态文件服务，以便提供CSS、JS等资源
+    async def stream():
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+                *[(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in asgi_app.default_headers]
+            ]
+        })
+        version = -1
+        # 建议浏览器断线后3秒重连
+        await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+        while True:
+            new_version, queue_status = await queue_status_broadcaster.wait_async(version, timeout=QUEUE_EVENTS_HEARTBEAT)
+            if new_version == version:
+                await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+                continue
+            version = new_version
+            payload = json.dumps({"status": "success", **queue_status}, ensure_ascii=False)
+            event = f"id: {version}\nevent: queue_status\ndata: {payload}\n\n"
+            await send({"type": "http.response.body", "body": event.encode('utf-8'), "more_body": True})
+
+    # 客户端断开时结束推送
+    tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(wait_disconnect(receive))]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        log_message(f"队列状态推送连接断开", client_ip)
+
+
+# 添加静态文件服务，只提供 STATIC_FILES 中的文件
 @app.route('/<path:filename>')
 def serve_static(filename):
     """提供静态文件"""
-    log_message(f"请求静态文件: {filename}", request.remote_addr)
-    try:
-        # 使用正确的基础目录
-        file_path = os.path.join(BASE_DIR, filename)
-        log_message(f"尝试提供文件: {file_path}")
-        
-        if os.path.exists(file_path):
-            return send_from_directory(BASE_DIR, filename)
-        else:
-            log_message(f"文件不存在: {file_path}")
-            return jsonify({"status": "error", "message": "文件不存在"}), 404
-    except Exception as e:
-        log_message(f"提供静态文件{filename}失败: {str(e)}", request.remote_addr)
-        return jsonify({"status": "error", "message": "无法提供静态文件"}), 404
+    log_message(f"请求静态文件: {filename}", request.remote_addr, sample="static_file")
+    response = static_assets.response(filename, request)
+    if response is None:
+        log_message(f"拒绝不在白名单中的静态文件: {filename}", request.remote_addr, level="warning")
+        return jsonify({"status": "error", "message": "文件不存在"}), 404
+    return response
 
 
 if __name__ == '__main__':
@@ -553,42 +1172,40 @@ if __name__ == '__main__':
     log_message(f"当前基础目录: {BASE_DIR}")
     log_message(f"数据文件路径: {DATA_FILE}")
     
-    # 检查关键文件是否存在
-    game_html_path = os.path.join(BASE_DIR, 'game.html')
-    if os.path.exists(game_html_path):
-        log_message(f"game.html文件存在: {game_html_path}")
+    # 检查关键文件是否已载入
+    if 'game.html' in static_assets:
+        log_message(f"已载入静态文件: {', '.join(static_assets.filenames())}")
     else:
-        log_message(f"警告: game.html文件不存在: {game_html_path}")
+        log_message(f"警告: game.html文件不存在: {os.path.join(BASE_DIR, 'game.html')}", level="warning")
     
-    # 初始化数据文件
-    initialize_data_file()
-
-    # 选择服务器模式：production（生产模式）或 development（开发模式）
-    # production 模式：只启动一个进程，没有自动重载功能
-    # development 模式：启动两个进程，有自动重载功能
-    server_mode = "production"  # 可以改为 "development"
-
-    if server_mode == "development":
-        # 开发模式 - 使用debug=True但不进行端口检查（因为Flask会启动两个进程）
-        log_message(f"开发模式: 启动服务器，监听端口 10001 (debug=True)")
-        app.run(host='0.0.0.0', port=10001, debug=True)
-    else:
-        # 生产模式 - 进行端口检查并使用debug=False
-        if check_port_available(port=10001):
-            log_message(f"生产模式: 服务器启动成功，监听端口 10001")
-            app.run(host='0.0.0.0', port=10001, debug=False)
-        else:
-            log_message(f"错误: 端口 10001 已被占用")
-            # 尝试使用备用端口
-            alt_port = 10002
-            if check_port_available(port=alt_port):
-                log_message(f"尝试使用备用端口 {alt_port}")
-                app.run(host='0.0.0.0', port=alt_port, debug=False)
-            else:
-                log_message(f"错误: 备用端口 {alt_port} 也已被占用")
-                sys.exit(1)
+    parser = argparse.ArgumentParser(description="游戏后端服务器")
+    parser.add_argument('--mode', choices=SERVER_MODES, default=SERVER_MODE, help="服务方式")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="监听端口")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help="asgi 模式的进程数")
+    args = parser.parse_args()
+
+    # 开发模式下修改静态文件后刷新即可看到
+    static_assets.watch = args.mode == "development"
+
+    workers = args.workers
+    if workers > 1 and STORAGE_MODE != "shared":
+        log_message(f"警告: 存储模式 {STORAGE_MODE} 以单个进程的内存为准，不能由 {workers} 个进程共享，改为 1 个进程"
+                    f"（多进程请使用 STORAGE_MODE = \"shared\"）", level="warning")
+        workers = 1
+
+    run_server(
+        app,
+        asgi_app=asgi_app,
+        asgi_app_path="game_backend:asgi_app",
+        host=SERVER_HOST,
+        port=args.port,
+        mode=args.mode,
+        workers=workers,
+        startup=initialize_backend,
+        log=log_message
+    )
 
 # 错误处理辅助方法
 def _send_error_response(message, status_code=400):
-    log_message(f"发送错误响应: {message} (状态码: {status_code})")
+    log_message(f"发送错误响应: {message} (状态码: {status_code})", level="error")
     return jsonify({"status": "error", "message": message}), status_code
\ No newline at end of file
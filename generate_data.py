@@ -2,6 +2,8 @@ import json
 import random
 from datetime import datetime
 
+from common.player import Player
+
 def generate_player_data(count=10):
     """
     Generate player data according to the data.json format
@@ -15,22 +17,18 @@ def generate_player_data(count=10):
     players = []
     
     for i in range(count):
-        player = {
-            "Player Name": f"{i}_@{i}",
-            "Player Money": random.randint(8000000, 100000000),
-            "Player Age": 18,  # Fixed value
-            "Player Body State": 80,  # Fixed value
-            "Player Mind State": 100,  # Fixed value
-            "PlayerIQ": 120,  # Fixed value
-            "Player El": 120,  # Fixed value
-            "R": random.randint(0, 255),
-            "G": random.randint(0, 255),
-            "B": random.randint(0, 255),
-            "Additional Info": "游戏生成的玩家数据",  # Fixed value
-            "Number": i,
-            "Timestamp": datetime.now().isoformat()
-        }
-        players.append(player)
+        # Age, Mind State, IQ, El and Additional Info use the model's fixed values
+        player = Player.new(
+            i,
+            name=f"{i}_@{i}",
+            money=random.randint(8000000, 100000000),
+            body_state=80,
+            r=random.randint(0, 255),
+            g=random.randint(0, 255),
+            b=random.randint(0, 255),
+            timestamp=datetime.now().isoformat()
+        )
+        players.append(player.to_dict())
     
     # Create the complete data structure
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -2,7 +2,7 @@
 cls
 
 REM 启动游戏后端服务器的批处理文件
-REM 默认使用生产模式启动，可以避免端口冲突问题
+REM 默认使用生产模式（asgi，需要 uvicorn；未安装时自动改用多线程模式）启动
 
 REM 显示启动信息
 echo ===================================================
@@ -33,11 +33,8 @@ echo 提示：生产模式下不会有端口冲突问题，但没有自动重载
 echo 如果需要修改代码后自动重启，请选择开发模式。
 echo.
 
-REM 修改game_backend.py中的server_mode为production
-powershell -Command "(Get-Content game_backend.py) -replace 'server_mode = "development"', 'server_mode = "production"' | Set-Content game_backend.py"
-
 REM 启动服务器
-python game_backend.py
+python game_backend.py --mode asgi
 goto end
 
 :development_mode
@@ -48,20 +45,17 @@ echo 注意：开发模式下Flask会启动两个进程，可能会出现端口
 echo 这是正常现象，服务器仍然可以正常运行。
 echo.
 
-REM 修改game_backend.py中的server_mode为development
-powershell -Command "(Get-Content game_backend.py) -replace 'server_mode = "production"', 'server_mode = "development"' | Set-Content game_backend.py"
-
 REM 启动服务器
-python game_backend.py
+python game_backend.py --mode development
 goto end
 
 :check_ports
 REM 检查端口占用情况
 echo.
-echo 检查端口10001和10002的占用情况...
+echo 检查端口10001的占用情况...
 echo.
 
-powershell -Command "Get-NetTCPConnection -LocalPort 10001,10002 | Select-Object LocalPort, RemotePort, State, OwningProcess | Format-Table -AutoSize"
+powershell -Command "Get-NetTCPConnection -LocalPort 10001 | Select-Object LocalPort, RemotePort, State, OwningProcess | Format-Table -AutoSize"
 echo.
 echo 如果要释放被占用的端口，请关闭占用该端口的程序。
 echo 可以使用任务管理器结束占用端口的进程（通过PID）。
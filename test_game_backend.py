@@ -0,0 +1,133 @@
+"""game_backend 的后台云同步：增量被拒绝（409）时改为完整复制，远程已有内容的文件在远程确认后才删除"""
+
+import json
+import os
+
+import pytest
+
+import game_backend
+from common.cloud_sync import FileOutbox
+from common.file_manifest import FileManifest
+from common.player_store import JsonFilePersister, PlayerStore
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self._body
+
+
+class ScriptedRemote:
+    """按路径返回预先设定的响应，并记录发送的同步请求"""
+
+    def __init__(self, sync_state, transfer_responses, missing=()):
+        self.sync_state = sync_state
+        self.transfer_responses = list(transfer_responses)
+        self.missing = list(missing)
+        self.payloads = []
+
+    def get(self, url, **kwargs):
+        assert url.endswith('/sync_state')
+        return FakeResponse(200, dict(self.sync_state, status="ok"))
+
+    def post(self, url, data=None, **kwargs):
+        if url.endswith('/missing_files'):
+            return FakeResponse(200, {"status": "success", "missing": self.missing})
+        assert url.endswith('/receive_transferred_data')
+        self.payloads.append(json.loads(data))
+        return FakeResponse(*self.transfer_responses.pop(0))
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    def initial_data():
+        return {"received_data": {"players": [], "metadata": {"total_players": 0}}}
+
+    store = PlayerStore(
+        JsonFilePersister(str(tmp_path / "data.json"), initial_data, log=lambda message: None),
+        log=lambda message: None
+    ).open()
+    monkeypatch.setattr(game_backend, 'player_store', store)
+    monkeypatch.setattr(game_backend, 'cloud_outbox', FileOutbox(str(tmp_path / "outbox")))
+    monkeypatch.setattr(game_backend, 'cloud_file_manifest', FileManifest(str(tmp_path / "manifest.json")))
+    monkeypatch.setattr(game_backend, 'TRANSFER_COMPRESSION', "none")
+    monkeypatch.setattr(game_backend, 'synced_sequence', None)
+    monkeypatch.setattr(game_backend, 'log_message', lambda *args, **kwargs: None)
+    yield game_backend
+    store.close()
+
+
+def add_players(store, count):
+    for _ in range(count):
+        store.add_player(lambda number: {"Number": number})
+
+
+def test_conflicting_delta_falls_back_to_full_copy(backend, monkeypatch):
+    add_players(backend.player_store, 3)
+    metadata = backend.player_store.snapshot().metadata
+    remote = ScriptedRemote(
+        {"sync_id": metadata['sync_id'], "sequence": metadata['sequence'] - 1},
+        [(409, {"status": "error", "sync_state": {}}), (200, {"status": "success"})]
+    )
+    monkeypatch.setattr(backend, 'http_client', remote)
+
+    result = backend.run_cloud_sync()
+
+    delta, full_copy = remote.payloads
+    assert delta['transfer_type'] == 'delta'
+    assert [change['op'] for change in delta['changes']] == ['add_player']
+    assert full_copy['transfer_type'] == 'full_copy'
+    assert [player['Number'] for player in full_copy['data']['players']] == [0, 1, 2]
+    assert result['transfer_type'] == 'full_copy'
+    assert backend.synced_sequence == metadata['sequence']
+
+
+def test_unknown_remote_dataset_gets_full_copy(backend, monkeypatch):
+    add_players(backend.player_store, 1)
+    remote = ScriptedRemote({"sync_id": "other", "sequence": 7}, [(200, {"status": "success"})])
+    monkeypatch.setattr(backend, 'http_client', remote)
+
+    backend.run_cloud_sync()
+
+    assert [payload['transfer_type'] for payload in remote.payloads] == ['full_copy']
+
+
+def test_present_files_removed_only_after_remote_copies_them(backend, monkeypatch, tmp_path):
+    """远程按内容哈希判断已有的文件随同步请求发出，远程找不到内容的留在发件箱"""
+    for name in ("a.csv", "b.csv"):
+        path = tmp_path / name
+        path.write_text(f"{name}\n1,2\n", encoding='utf-8')
+        backend.cloud_outbox.put(str(path))
+    metadata = backend.player_store.snapshot().metadata
+    remote = ScriptedRemote(
+        {"sync_id": metadata['sync_id'], "sequence": metadata['sequence']},
+        [(200, {"status": "success", "unresolved_files": ["b.csv"]})]
+    )
+    monkeypatch.setattr(backend, 'http_client', remote)
+
+    backend.run_cloud_sync()
+
+    payload, = remote.payloads
+    assert sorted(item['filename'] for item in payload['present_files']) == ["a.csv", "b.csv"]
+    assert payload['uploaded_files'] == [] and payload['files'] == []
+    assert [os.path.basename(path) for path in backend.cloud_outbox.pending()] == ["b.csv"]
+
+
+def test_present_files_kept_when_transfer_fails(backend, monkeypatch, tmp_path):
+    path = tmp_path / "a.csv"
+    path.write_text("a\n1\n", encoding='utf-8')
+    backend.cloud_outbox.put(str(path))
+    metadata = backend.player_store.snapshot().metadata
+    remote = ScriptedRemote(
+        {"sync_id": metadata['sync_id'], "sequence": metadata['sequence']},
+        [(500, {"status": "error"})]
+    )
+    monkeypatch.setattr(backend, 'http_client', remote)
+
+    with pytest.raises(RuntimeError):
+        backend.run_cloud_sync()
+    assert [os.path.basename(path) for path in backend.cloud_outbox.pending()] == ["a.csv"]